@@ -1,3 +1,4 @@
+import functools
 import logging
 import os
 import random
@@ -98,17 +99,25 @@ def cli(ctx, **kwargs):
         ctx.obj["experiment"] = experiment_logger
 
         if args.model_file:
-            model_archive = ModelArchive.load(args.model_file)
+            model_archive = load_model_archive(os.path.abspath(args.model_file))
             ctx.obj["tokenizer"] = model_archive.tokenizer
             ctx.obj["entity_vocab"] = model_archive.entity_vocab
             ctx.obj["bert_model_name"] = model_archive.bert_model_name
             ctx.obj["model_config"] = model_archive.config
             ctx.obj["max_mention_length"] = model_archive.max_mention_length
-            ctx.obj["model_weights"] = model_archive.state_dict
+            # the tasks replace some of the weights, so the cached state dict is not passed directly
+            ctx.obj["model_weights"] = dict(model_archive.state_dict)
 
             experiment_logger.log_parameter("model_file_name", os.path.basename(args.model_file))
 
 
+@functools.lru_cache(maxsize=1)
+def load_model_archive(model_file):
+    """Loads the model archive, which is cached so that it is loaded only once when commands are run repeatedly in the
+    same process (e.g., the trials of a sweep)."""
+    return ModelArchive.load(model_file)
+
+
 from .entity_typing.main import cli as entity_typing_cli
 
 cli.add_command(entity_typing_cli)
@@ -127,6 +136,12 @@ cli.add_command(mention_db_cli)
 from .entity_span_qa.main import cli as entity_span_qa_cli
 
 cli.add_command(entity_span_qa_cli)
+from .utils.sweep import cli as sweep_cli
+
+cli.add_command(sweep_cli)
+from .utils.feature_extraction import cli as feature_extraction_cli
+
+cli.add_command(feature_extraction_cli)
 
 if __name__ == "__main__":
     cli()
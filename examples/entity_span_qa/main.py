@@ -1,10 +1,11 @@
 import json
 import logging
 import os
+import time
 from argparse import Namespace
-from collections import defaultdict
 
 import click
+import numpy as np
 import torch
 from torch.utils.data import DataLoader, RandomSampler
 from torch.utils.data.distributed import DistributedSampler
@@ -140,21 +141,38 @@ def run(common_args, **task_args):
 
 def evaluate(args, model, fold="dev", output_file=None):
     dataloader, examples, features, processor = load_examples(args, fold)
-    doc_predictions = defaultdict(list)
+    start_time = time.time()
+
+    all_feature_indices = []
+    all_max_logits = []
+    all_max_indices = []
+    model.eval()
     for batch in tqdm(dataloader, desc="Eval"):
-        model.eval()
         inputs = {k: v.to(args.device) for k, v in batch.items() if k != "feature_indices"}
         with torch.no_grad():
-            logits = model(**inputs)
-
-        for i, feature_index in enumerate(batch["feature_indices"]):
-            feature = features[feature_index.item()]
-            max_logit, max_index = logits[i].detach().max(dim=0)
-            example_id = examples[feature.example_index].qas_id
-            entity = feature.entities[max_index.item()]
-            doc_predictions[example_id].append((max_logit, entity))
-
-    predictions = {k: sorted(v, key=lambda o: o[0])[-1][1]["text"] for k, v in doc_predictions.items()}
+            max_logits, max_indices = model(**inputs).float().max(dim=1)
+        all_feature_indices.append(batch["feature_indices"])
+        all_max_logits.append(max_logits)
+        all_max_indices.append(max_indices)
+
+    feature_indices = torch.cat(all_feature_indices).numpy()
+    max_logits = torch.cat(all_max_logits).cpu().numpy()
+    max_indices = torch.cat(all_max_indices).cpu().numpy()
+    example_indices = np.array([features[i].example_index for i in feature_indices], dtype=np.int64)
+
+    # select the feature with the highest score for each example; ties are broken by taking the last feature
+    order = np.lexsort((np.arange(len(feature_indices)), max_logits, example_indices))
+    best_positions = order[np.append(example_indices[order][1:] != example_indices[order][:-1], True)]
+    # output the examples in the order they first appear in the dataloader
+    first_positions = np.unique(example_indices, return_index=True)[1]
+    best_positions = best_positions[np.argsort(first_positions)]
+
+    predictions = {}
+    for position in best_positions:
+        feature = features[feature_indices[position]]
+        predictions[examples[feature.example_index].qas_id] = feature.entities[max_indices[position]]["text"]
+
+    # the predictions are needed in memory for the evaluation below, so writing them incrementally saves nothing
     if output_file:
         with open(output_file, "w") as f:
             json.dump(predictions, f)
@@ -162,7 +180,9 @@ def evaluate(args, model, fold="dev", output_file=None):
     with open(os.path.join(args.data_dir, processor.dev_file)) as f:
         dev_data = json.load(f)["data"]
 
-    return evaluate_on_record(dev_data, predictions)[0]
+    results = evaluate_on_record(dev_data, predictions)[0]
+    logger.info("Evaluated %d examples in %.2f seconds", len(predictions), time.time() - start_time)
+    return results
 
 
 def load_examples(args, fold):
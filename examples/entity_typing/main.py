@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import os
@@ -9,12 +10,19 @@ from torch.utils.data import DataLoader, RandomSampler
 from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm
 from transformers import WEIGHTS_NAME
+from luke.utils.attention_statistics import AttentionStatistics
 from luke.utils.entity_vocab import MASK_TOKEN
+from luke.utils.multilabel_metrics import one_hot_encoding, precision_recall_f1
 
 from ..utils import set_seed
+from ..utils.evaluation_sink import EvaluationSink, get_file_references
+from ..utils.inference_server import InferenceServer, inference_server_args
+from ..utils.model_export import export_and_benchmark, model_export_args
+from ..utils.quantization import compare_quantized_model
+from ..utils.sweep import run_in_process_sweep, sweep_args
 from ..utils.trainer import Trainer, trainer_args
 from .model import LukeForEntityTyping
-from .utils import ENTITY_TOKEN, convert_examples_to_features, DatasetProcessor
+from .utils import ENTITY_TOKEN, convert_examples_to_features, DatasetProcessor, InputExample
 
 import numpy as np
 import random
@@ -28,34 +36,64 @@ def cli():
     pass
 
 
+def run_args(func):
+    @click.option("--checkpoint-file", type=click.Path(exists=True))
+    @click.option("--data-dir", default="data/open_entity", type=click.Path(exists=True))
+    @click.option("--do-eval/--no-eval", default=True)
+    @click.option("--do-train/--no-train", default=True)
+    @click.option("--eval-batch-size", default=32)
+    @click.option("--num-train-epochs", default=3.0)
+    @click.option("--seed", default=12)
+    @click.option("--train-batch-size", default=2)
+    @click.option("--quantize/--no-quantize", default=False)
+    @click.option("--do-evaluate-prior-train/--no-evaluate-prior-train", default=True)
+    @click.option("--output-attentions/--no-output-attentions", default=False)
+    @click.option(
+        "--attention-statistics/--no-attention-statistics",
+        default=False,
+        help="Writes the binned [MASK] attention of the dev and test sets instead of the full attention maps",
+    )
+    @click.option("--attention-bins", default=5)
+    @click.option(
+        "--attention-target-tokens",
+        default="",
+        help="Comma-separated tokens to which the attention from the entity mention is computed",
+    )
+    @trainer_args
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
 @cli.command()
-@click.option("--checkpoint-file", type=click.Path(exists=True))
-@click.option("--data-dir", default="data/open_entity", type=click.Path(exists=True))
-@click.option("--do-eval/--no-eval", default=True)
-@click.option("--do-train/--no-train", default=True)
-@click.option("--eval-batch-size", default=32)
-@click.option("--num-train-epochs", default=3.0)
-@click.option("--seed", default=12)
-@click.option("--train-batch-size", default=2)
-@click.option("--do-evaluate-prior-train/--no-evaluate-prior-train", default=True)
-@click.option("--output-attentions/--no-output-attentions", default=False)
-@trainer_args
+@run_args
 @click.pass_obj
 def run(common_args, **task_args):
     task_args.update(common_args)
     args = Namespace(**task_args)
 
-    set_seed(args.seed)
+    setup_model_args(args)
+    return run_trial(args)
 
-    args.model_config.output_attentions = args.output_attentions
-    args.model_config.hidden_dropout_prob = args.hidden_dropout_prob
 
-    if args.output_attentions and args.eval_batch_size>1: 
-        args.eval_batch_size = 1
-        logger.info(f"Eval batch size set: {args.eval_batch_size}")
+@cli.command()
+@run_args
+@sweep_args
+@click.pass_obj
+def sweep(common_args, **task_args):
+    """Runs the training and evaluation for each combination of the swept values in this process, keeping the
+    pretrained weights and the features in memory across the trials."""
+    task_args.update(common_args)
+    args = Namespace(**task_args)
 
+    setup_model_args(args)
+    args.feature_cache = {}
+    run_in_process_sweep(args, run, run_trial)
 
-    args.experiment.log_parameters({p.name: getattr(args, p.name) for p in run.params})
+
+def setup_model_args(args):
     args.model_config.vocab_size += 1
     word_emb = args.model_weights["embeddings.word_embeddings.weight"]
     marker_emb = word_emb[args.tokenizer.convert_tokens_to_ids(["@"])[0]].unsqueeze(0)
@@ -67,6 +105,20 @@ def run(common_args, **task_args):
     args.model_config.entity_vocab_size = 2
     args.model_weights["entity_embeddings.entity_embeddings.weight"] = torch.cat([entity_emb[:1], mask_emb])
 
+
+def run_trial(args):
+    set_seed(args.seed)
+
+    args.model_config.output_attentions = args.output_attentions
+    args.model_config.hidden_dropout_prob = args.hidden_dropout_prob
+
+    if args.output_attentions and args.eval_batch_size>1: 
+        args.eval_batch_size = 1
+        logger.info(f"Eval batch size set: {args.eval_batch_size}")
+
+
+    args.experiment.log_parameters({p.name: getattr(args, p.name) for p in run.params})
+
     train_dataloader, _, features, label_list, tokens = load_examples(args, fold="train")
     num_labels = len(features[0].labels)
 
@@ -139,10 +191,14 @@ def run(common_args, **task_args):
         
         for eval_set in ("dev", "test"):
             output_file = os.path.join(args.output_dir, f"{eval_set}_predictions.jsonl")
-            result_dict, sample_size, evaluation_predict_label[eval_set], output_attentions_format[eval_set] = evaluate(args, model, eval_set, output_file) 
+            output_prefix = os.path.join(args.output_dir, eval_set)
+            result_dict, sample_size, evaluation_predict_label[eval_set], output_attentions_format[eval_set] = evaluate(args, model, eval_set, output_file, output_prefix=output_prefix) 
             results.update({f"{eval_set}_{k}": v for k, v in result_dict.items()})
             dataset_size[f"{eval_set}_samples"] = sample_size
 
+        if args.quantize:
+            results.update(compare_quantized_model(args, model, lambda *eval_args: evaluate(*eval_args)[0]))
+
     if args.output_attentions:
         for eval_set in ("dev", "test"):
             with open(os.path.join(args.output_dir, f"output_attentions_{eval_set}.p"), "wb") as f:
@@ -192,7 +248,91 @@ def run(common_args, **task_args):
     return results
 
 
-def evaluate(args, model, fold="dev", output_file=None, write_all=False):
+@cli.command()
+@click.option("--checkpoint-file", type=click.Path(exists=True), required=True)
+@click.option("--data-dir", default="data/open_entity", type=click.Path(exists=True))
+@inference_server_args
+@click.pass_obj
+def serve(common_args, **task_args):
+    """Serves the model. POST /predict accepts {"text": ..., "span": [start, end]} or a list of them."""
+    task_args.update(common_args)
+    args = Namespace(**task_args)
+
+    model, label_list = create_inference_model(args)
+
+    def postprocess(logits):
+        return dict(labels=[label_list[i] for i in np.flatnonzero(logits > 0)])
+
+    server = InferenceServer(
+        model,
+        functools.partial(featurize_instance, args, label_list),
+        postprocess,
+        args.tokenizer.pad_token_id,
+        args.device,
+        args.max_batch_size,
+        args.max_latency_ms,
+        args.num_workers,
+        args.num_threads,
+        args.metrics_window_size,
+    )
+    server.serve_forever(args.port)
+
+
+@cli.command()
+@click.option("--checkpoint-file", type=click.Path(exists=True), required=True)
+@click.option("--data-dir", default="data/open_entity", type=click.Path(exists=True))
+@model_export_args
+@click.pass_obj
+def export(common_args, **task_args):
+    task_args.update(common_args)
+    args = Namespace(**task_args)
+    torch.set_num_threads(args.num_threads)
+
+    model, label_list = create_inference_model(args)
+    features = [featurize_instance(args, label_list, instance) for instance in EXPORT_EXAMPLE_INSTANCES]
+    output_file = args.output_file or os.path.join(args.output_dir, "model.pt")
+    results = export_and_benchmark(
+        model,
+        features,
+        args.tokenizer.pad_token_id,
+        output_file,
+        args.benchmark_batch_size,
+        args.benchmark_iterations,
+    )
+    logger.info("Exported the model to %s", output_file)
+    logger.info("Results: %s", json.dumps(results, indent=2, sort_keys=True))
+    with open(os.path.join(args.output_dir, "export_results.json"), "w") as f:
+        json.dump(results, f)
+
+
+EXPORT_EXAMPLE_INSTANCES = [
+    dict(text="Barack Obama was born in Hawaii .", span=[0, 12]),
+    dict(text="The company moved its headquarters to Seattle in 2001 .", span=[38, 45]),
+]
+
+
+def create_inference_model(args):
+    args.model_config.output_attentions = False
+    args.model_config.vocab_size += 1
+    args.model_config.entity_vocab_size = 2
+    args.tokenizer.add_special_tokens(dict(additional_special_tokens=[ENTITY_TOKEN]))
+
+    label_list = DatasetProcessor().get_label_list(args.data_dir)
+    model = LukeForEntityTyping(args, len(label_list))
+    model.load_state_dict(torch.load(args.checkpoint_file, map_location="cpu"))
+
+    return model, label_list
+
+
+def featurize_instance(args, label_list, instance):
+    example = InputExample(None, instance["text"], (int(instance["span"][0]), int(instance["span"][1])), [])
+    features, _ = convert_examples_to_features(
+        [example], label_list, args.tokenizer, args.max_mention_length, show_progress=False
+    )
+    return features[0]
+
+
+def evaluate(args, model, fold="dev", output_file=None, write_all=False, output_prefix=None):
     
     def format_attention(attention):
         squeezed = []
@@ -208,9 +348,15 @@ def evaluate(args, model, fold="dev", output_file=None, write_all=False):
     dataloader, examples, features, label_list, tokens = load_examples(args, fold=fold)
     model.eval()
 
-    all_logits = []
-    all_labels = []
+    # the logits and labels are written to preallocated arrays instead of being accumulated as lists
+    sink = EvaluationSink(len(features), output_prefix=output_prefix)
     output_attentions_format = {}
+
+    attention_statistics = None
+    if args.attention_statistics and output_prefix:
+        attention_statistics = AttentionStatistics(num_bins=args.attention_bins)
+        target_tokens = [token.lower() for token in args.attention_target_tokens.split(",") if token]
+        num_evaluated = 0
     
     for i, batch in enumerate(tqdm(dataloader, desc=fold)):
         inputs = {k: v.to(args.device) for k, v in batch.items() if k != "labels"}
@@ -221,26 +367,33 @@ def evaluate(args, model, fold="dev", output_file=None, write_all=False):
                 attention = format_attention(attention_probs)
                 
                 output_attentions_format[f"sent_{i}"] = {}
-                tokens[i].extend(["[MASK]", "[PAD]"]) # adding entity [1, 0] on to the the word_ids 
-                output_attentions_format[f"sent_{i}"]["tokens"] = tokens[i] 
+                # adding entity [1, 0] on to the the word_ids (without modifying the tokens that may be cached)
+                output_attentions_format[f"sent_{i}"]["tokens"] = tokens[i] + ["[MASK]", "[PAD]"]
                 output_attentions_format[f"sent_{i}"]["sentence"] = examples[i].text
                 output_attentions_format[f"sent_{i}"]["attention"] = attention.detach().cpu()
                 output_attentions_format[f"sent_{i}"]["entity_position_ids"] = inputs["entity_position_ids"].detach().cpu()
+        elif attention_statistics is not None:
+            batch_tokens = tokens[num_evaluated : num_evaluated + len(batch["labels"])]
+            num_evaluated += len(batch_tokens)
+            token_pairs = None
+            if target_tokens:
+                token_pairs = create_attention_token_pairs(batch_tokens, batch["entity_position_ids"], target_tokens)
+                token_pairs = token_pairs.to(args.device)
+            word_attention_mask = inputs["word_attention_mask"]
+            with torch.no_grad(), attention_statistics.capture(model.encoder, word_attention_mask, token_pairs):
+                logits = model(**inputs)
         else:
             with torch.no_grad():
                 logits = model(**inputs)
 
-        logits = logits.detach().cpu().tolist()
-        labels = batch["labels"].to("cpu").tolist()
+        sink.add(logits, batch["labels"])
 
-        all_logits.extend(logits)
-        all_labels.extend(labels)
+    all_logits, all_labels = sink.close()
+    if attention_statistics is not None:
+        attention_statistics.save(output_prefix + "_attention_statistics.npz")
 
     #pickle.dump(output_attentions_format, open( "output_attentions.p", "wb"))
 
-    all_predicted_indexes = []
-    all_label_indexes = []
-    
     # Idea with all_predicted_prob was to collect logits and probability for prediction. Change in plan I will collect all raw data in results file 
     # all_predicted_prob = []
     # def logit_to_prob(logits):
@@ -250,10 +403,10 @@ def evaluate(args, model, fold="dev", output_file=None, write_all=False):
     #     return softmax
 
     # Logit select all with > 0 (~ 50% chance) 
-    for logits, labels in zip(all_logits, all_labels):
-        all_predicted_indexes.append([i for i, v in enumerate(logits) if v > 0])
-        all_label_indexes.append([i for i, v in enumerate(labels) if v > 0])
-        # all_predicted_prob.append([logit_to_prob(logits)])
+    predicted = one_hot_encoding(all_logits)
+    gold = one_hot_encoding(all_labels)
+    all_predicted_indexes = [np.flatnonzero(row).tolist() for row in predicted]
+    all_label_indexes = [np.flatnonzero(row).tolist() for row in gold]
 
     if write_all:
         if not os.path.exists(args.output_dir + "/all_files"):
@@ -263,9 +416,9 @@ def evaluate(args, model, fold="dev", output_file=None, write_all=False):
         with open(os.path.join(args.output_dir, "all_files",'all_label_indexes.txt'), 'w') as outfile:
             json.dump(all_label_indexes, outfile)
         with open(os.path.join(args.output_dir, "all_files", 'all_logits.txt'), 'w') as outfile:
-            json.dump(all_logits, outfile)
+            json.dump(all_logits.tolist(), outfile)
         with open(os.path.join(args.output_dir, "all_files", 'all_labels.txt'), 'w') as outfile:
-            json.dump(all_labels, outfile)
+            json.dump(all_labels.tolist(), outfile)
         with open(os.path.join(args.output_dir, "all_files", 'label_list.txt'), 'w') as outfile:
             json.dump(label_list, outfile)
         # with open(os.path.join(args.output_dir, "all_files", 'all_predicted_prob.txt'), 'w') as outfile:
@@ -284,49 +437,54 @@ def evaluate(args, model, fold="dev", output_file=None, write_all=False):
                 )
                 f.write(json.dumps(data) + "\n")
 
-    num_predicted_labels = 0
-    num_gold_labels = 0
-    num_correct_labels = 0
-
-    for predicted_indexes, label_indexes in zip(all_predicted_indexes, all_label_indexes):
-        num_predicted_labels += len(predicted_indexes)
-        num_gold_labels += len(label_indexes)
-        num_correct_labels += len(frozenset(predicted_indexes).intersection(frozenset(label_indexes)))
-
-    if num_predicted_labels > 0:
-        precision = num_correct_labels / num_predicted_labels
+    # Raw predicted logits and true labels (only references to the array files if they are written to disk)
+    if output_prefix:
+        evaluation_predict_label = get_file_references(output_prefix)
     else:
-        precision = 0.0
+        evaluation_predict_label = {"predict_logits": all_logits, "true_labels": all_labels}
 
-    recall = num_correct_labels / num_gold_labels
-    if precision + recall == 0.0:
-        f1 = 0.0
-    else:
-        f1 = 2 * precision * recall / (precision + recall)
+    return precision_recall_f1(gold, predicted), len(all_labels), evaluation_predict_label, output_attentions_format
 
-    # Save raw predicted logits and true labels
-    evaluation_predict_label = {"predict_logits": all_logits, 
-                            "true_labels": all_labels}
 
-    return dict(precision=precision, recall=recall, f1=f1), len(all_labels), evaluation_predict_label, output_attentions_format
+def create_attention_token_pairs(batch_tokens, entity_position_ids, target_tokens):
+    """Returns the positions of the first token of the entity mention and the first occurrence of each target token
+    in the examples, or -1 if a target token does not occur."""
+    token_pairs = torch.full((len(batch_tokens), len(target_tokens), 2), -1, dtype=torch.long)
+    for i, tokens in enumerate(batch_tokens):
+        # the mention starts with the [ENTITY] marker
+        mention_start = int(entity_position_ids[i, 0, 0]) + 1
+        normalized_tokens = [token.lstrip("Ġ▁").lower() for token in tokens]
+        for j, target_token in enumerate(target_tokens):
+            if target_token in normalized_tokens:
+                token_pairs[i, j, 0] = mention_start
+                token_pairs[i, j, 1] = normalized_tokens.index(target_token)
+    return token_pairs
 
 
 def load_examples(args, fold="train"):
     if args.local_rank not in (-1, 0) and fold == "train":
         torch.distributed.barrier()
 
-    processor = DatasetProcessor()
-    if fold == "train":
-        examples = processor.get_train_examples(args.data_dir)
-    elif fold == "dev":
-        examples = processor.get_dev_examples(args.data_dir)
+    # the features are cached across the trials of a sweep
+    feature_cache = getattr(args, "feature_cache", None)
+    cache_key = (fold, args.data_dir)
+    if feature_cache is not None and cache_key in feature_cache:
+        examples, features, tokens, label_list = feature_cache[cache_key]
     else:
-        examples = processor.get_test_examples(args.data_dir)
+        processor = DatasetProcessor()
+        if fold == "train":
+            examples = processor.get_train_examples(args.data_dir)
+        elif fold == "dev":
+            examples = processor.get_dev_examples(args.data_dir)
+        else:
+            examples = processor.get_test_examples(args.data_dir)
 
-    label_list = processor.get_label_list(args.data_dir)
+        label_list = processor.get_label_list(args.data_dir)
 
-    logger.info("Creating features from the dataset...")
-    features, tokens = convert_examples_to_features(examples, label_list, args.tokenizer, args.max_mention_length)
+        logger.info("Creating features from the dataset...")
+        features, tokens = convert_examples_to_features(examples, label_list, args.tokenizer, args.max_mention_length)
+        if feature_cache is not None:
+            feature_cache[cache_key] = (examples, features, tokens, label_list)
 
     if args.local_rank == 0 and fold == "train":
         torch.distributed.barrier()
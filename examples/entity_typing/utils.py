@@ -61,7 +61,7 @@ class DatasetProcessor(object):
         ]
 
 
-def convert_examples_to_features(examples, label_list, tokenizer, max_mention_length):
+def convert_examples_to_features(examples, label_list, tokenizer, max_mention_length, show_progress=True):
     label_map = {label: i for i, label in enumerate(label_list)}
 
     conv_tables = (
@@ -74,7 +74,7 @@ def convert_examples_to_features(examples, label_list, tokenizer, max_mention_le
     )
     tokens_all = []
     features = []
-    for example in tqdm(examples):
+    for example in tqdm(examples, disable=not show_progress):
 
         def preprocess_and_tokenize(text, start, end=None):
             target_text = text[start:end]
@@ -1,10 +1,12 @@
 import json
 import logging
 import os
+import time
 from argparse import Namespace
 from collections import defaultdict
 
 import click
+import numpy as np
 import seqeval.metrics
 import torch
 from torch.utils.data import DataLoader, RandomSampler
@@ -17,7 +19,13 @@ from luke.utils.entity_vocab import MASK_TOKEN
 from ..utils import set_seed
 from ..utils.trainer import Trainer, trainer_args
 from .model import LukeForNamedEntityRecognition
-from .utils import CoNLLProcessor, convert_examples_to_features
+from .utils import (
+    CoNLLProcessor,
+    convert_examples_to_features,
+    group_sentence_features,
+    merge_sentence_features,
+    select_non_overlapping_spans,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -36,11 +44,14 @@ def cli():
 @click.option("--max-entity-length", default=128)
 @click.option("--max-mention-length", default=16)
 @click.option("--max-seq-length", default=512)
+@click.option("--merge-entity-chunks/--no-merge-entity-chunks", default=False)
 @click.option("--no-entity-feature", is_flag=True)
 @click.option("--no-word-feature", is_flag=True)
 @click.option("--train-batch-size", default=2)
 @click.option("--num-train-epochs", default=5.0)
 @click.option("--seed", default=35)
+@click.option("--span-scorer/--no-span-scorer", default=False)
+@click.option("--span-pruning-top-k", default=0)
 @click.option("--train-on-dev-set", is_flag=True)
 @trainer_args
 @click.pass_obj
@@ -50,6 +61,9 @@ def run(common_args, **task_args):
 
     set_seed(args.seed)
 
+    if args.span_pruning_top_k > 0 and not args.span_scorer:
+        raise click.UsageError("--span-pruning-top-k requires --span-scorer")
+
     args.experiment.log_parameters({p.name: getattr(args, p.name) for p in run.params})
 
     args.model_config.entity_vocab_size = 2
@@ -94,6 +108,12 @@ def run(common_args, **task_args):
         results.update({f"dev_{k}": v for k, v in evaluate(args, model, "dev", dev_output_file).items()})
         results.update({f"test_{k}": v for k, v in evaluate(args, model, "test", test_output_file).items()})
 
+        if args.span_pruning_top_k > 0:
+            for fold in ("dev", "test"):
+                output_file = os.path.join(args.output_dir, f"{fold}_pruned_predictions.txt")
+                fold_results = evaluate(args, model, fold, output_file, span_pruning_top_k=args.span_pruning_top_k)
+                results.update({f"{fold}_pruned_{k}": v for k, v in fold_results.items()})
+
     logger.info("Results: %s", json.dumps(results, indent=2, sort_keys=True))
     args.experiment.log_metrics(results)
     with open(os.path.join(args.output_dir, "results.json"), "w") as f:
@@ -102,10 +122,22 @@ def run(common_args, **task_args):
     return results
 
 
-def evaluate(args, model, fold, output_file=None):
+def evaluate(args, model, fold, output_file=None, span_pruning_top_k=0):
     dataloader, examples, features, processor = load_examples(args, fold)
     label_list = processor.get_labels()
     all_predictions = defaultdict(dict)
+    num_sentences = len(frozenset(f.sentence_index for f in features))
+
+    start_time = time.time()
+    if span_pruning_top_k > 0 or args.merge_entity_chunks:
+        if span_pruning_top_k > 0:
+            features = prune_features(args, model, features, span_pruning_top_k)
+        else:
+            # encode each sentence once together with all of its entity chunks instead of once per chunk
+            features = [merge_sentence_features(li) for li in group_sentence_features(features)]
+        dataloader = DataLoader(
+            list(enumerate(features)), batch_size=args.eval_batch_size, collate_fn=dataloader.collate_fn
+        )
 
     for batch in tqdm(dataloader, desc="Eval"):
         model.eval()
@@ -113,12 +145,20 @@ def evaluate(args, model, fold, output_file=None):
         with torch.no_grad():
             logits = model(**inputs)
 
-        for i, feature_index in enumerate(batch["feature_indices"]):
-            feature = features[feature_index.item()]
-            for j, span in enumerate(feature.original_entity_spans):
+        # reduce the logits on the device and move the results to the host in a single transfer
+        max_logits, max_indices = logits.max(dim=2)
+        max_logits, max_indices = torch.stack([max_logits, max_indices.type_as(max_logits)]).cpu().numpy()
+        max_indices = max_indices.astype(np.int64)
+
+        for i, feature_index in enumerate(batch["feature_indices"].tolist()):
+            feature = features[feature_index]
+            predictions = all_predictions[feature.example_index]
+            for j in np.flatnonzero(max_indices[i, : len(feature.original_entity_spans)]):
+                span = feature.original_entity_spans[j]
                 if span is not None:
-                    all_predictions[feature.example_index][span] = logits[i, j].detach().cpu().max(dim=0)
+                    predictions[span] = (max_logits[i, j], max_indices[i, j])
 
+    sentences_per_second = num_sentences / (time.time() - start_time)
     assert len(all_predictions) == len(examples)
 
     final_labels = []
@@ -126,17 +166,16 @@ def evaluate(args, model, fold, output_file=None):
 
     for example_index, example in enumerate(examples):
         predictions = all_predictions[example_index]
-        doc_results = []
-        for span, (max_logit, max_index) in predictions.items():
-            if max_index != 0:
-                doc_results.append((max_logit.item(), span, label_list[max_index.item()]))
+        spans = list(predictions.keys())
+        max_logits = [o[0] for o in predictions.values()]
 
         predicted_sequence = ["O"] * len(example.words)
-        for _, span, label in sorted(doc_results, key=lambda o: o[0], reverse=True):
-            if all([o == "O" for o in predicted_sequence[span[0] : span[1]]]):
-                predicted_sequence[span[0]] = "B-" + label
-                if span[1] - span[0] > 1:
-                    predicted_sequence[span[0] + 1 : span[1]] = ["I-" + label] * (span[1] - span[0] - 1)
+        for index in select_non_overlapping_spans(spans, max_logits, len(example.words)):
+            start, end = spans[index]
+            label = label_list[predictions[spans[index]][1]]
+            predicted_sequence[start] = "B-" + label
+            if end - start > 1:
+                predicted_sequence[start + 1 : end] = ["I-" + label] * (end - start - 1)
 
         final_predictions += predicted_sequence
         final_labels += example.labels
@@ -162,9 +201,47 @@ def evaluate(args, model, fold, output_file=None):
         f1=seqeval.metrics.f1_score(final_labels, final_predictions),
         precision=seqeval.metrics.precision_score(final_labels, final_predictions),
         recall=seqeval.metrics.recall_score(final_labels, final_predictions),
+        sentences_per_second=sentences_per_second,
     )
 
 
+def prune_features(args, model, features, top_k):
+    """Keeps the `top_k` candidate spans of each sentence ranked by the word-only span scorer of the model.
+
+    Each sentence is encoded once without entities, and the surviving spans are merged into a single feature so that
+    only they are passed to the entity-aware model.
+    """
+    top_k = min(top_k, args.max_entity_length)
+    sentence_features = [merge_sentence_features(li) for li in group_sentence_features(features)]
+
+    def create_padded_sequence(sequences, padding_value):
+        tensors = [torch.as_tensor(o, dtype=torch.long) for o in sequences]
+        return torch.nn.utils.rnn.pad_sequence(tensors, batch_first=True, padding_value=padding_value)
+
+    model.eval()
+    pruned_features = []
+    for batch_start in tqdm(range(0, len(sentence_features), args.eval_batch_size), desc="Prune"):
+        batch = sentence_features[batch_start : batch_start + args.eval_batch_size]
+        inputs = dict(
+            word_ids=create_padded_sequence([f.word_ids for f in batch], args.tokenizer.pad_token_id),
+            word_segment_ids=create_padded_sequence([f.word_segment_ids for f in batch], 0),
+            word_attention_mask=create_padded_sequence([f.word_attention_mask for f in batch], 0),
+            entity_start_positions=create_padded_sequence([f.entity_start_positions for f in batch], 0),
+            entity_end_positions=create_padded_sequence([f.entity_end_positions for f in batch], 0),
+        )
+        with torch.no_grad():
+            span_scores = model.score_spans(**{k: v.to(args.device) for k, v in inputs.items()}).cpu().numpy()
+
+        for feature, scores in zip(batch, span_scores):
+            candidate_indices = np.flatnonzero([span is not None for span in feature.original_entity_spans])
+            if len(candidate_indices) > top_k:
+                top_indices = np.argpartition(-scores[candidate_indices], top_k - 1)[:top_k]
+                candidate_indices = np.sort(candidate_indices[top_indices])
+            pruned_features.append(merge_sentence_features([feature], candidate_indices))
+
+    return pruned_features
+
+
 def load_examples(args, fold):
     if args.local_rank not in (-1, 0) and fold == "train":
         torch.distributed.barrier()
@@ -183,9 +260,11 @@ def load_examples(args, fold):
     label_list = processor.get_labels()
 
     logger.info("Creating features from the dataset...")
+    start_time = time.time()
     features = convert_examples_to_features(
         examples, label_list, args.tokenizer, args.max_seq_length, args.max_entity_length, args.max_mention_length
     )
+    logger.info("Created %d features in %.2f seconds", len(features), time.time() - start_time)
 
     if args.local_rank == 0 and fold == "train":
         torch.distributed.barrier()
@@ -213,6 +292,9 @@ def load_examples(args, fold):
             ret["entity_ids"].fill_(0)
             ret["entity_attention_mask"].fill_(0)
 
+        if batch[0][1].entity_chunk_ids is not None:
+            ret["entity_chunk_ids"] = create_padded_sequence("entity_chunk_ids", -1)
+
         if fold == "train":
             ret["labels"] = create_padded_sequence("labels", -1)
         else:
@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.nn import CrossEntropyLoss
 
 from luke.model import LukeEntityAwareAttentionModel
@@ -19,6 +20,9 @@ class LukeForNamedEntityRecognition(LukeEntityAwareAttentionModel):
         else:
             self.classifier = nn.Linear(args.model_config.hidden_size * 3, num_labels)
 
+        if args.span_scorer:
+            self.span_scorer = nn.Linear(args.model_config.hidden_size * 2, 1)
+
         self.apply(self.init_weights)
 
     def forward(
@@ -32,17 +36,30 @@ class LukeForNamedEntityRecognition(LukeEntityAwareAttentionModel):
         entity_position_ids,
         entity_segment_ids,
         entity_attention_mask,
+        entity_chunk_ids=None,
         labels=None,
     ):
-        encoder_outputs = super(LukeForNamedEntityRecognition, self).forward(
-            word_ids,
-            word_segment_ids,
-            word_attention_mask,
-            entity_ids,
-            entity_position_ids,
-            entity_segment_ids,
-            entity_attention_mask,
-        )
+        if entity_chunk_ids is None:
+            encoder_outputs = super(LukeForNamedEntityRecognition, self).forward(
+                word_ids,
+                word_segment_ids,
+                word_attention_mask,
+                entity_ids,
+                entity_position_ids,
+                entity_segment_ids,
+                entity_attention_mask,
+            )
+        else:
+            encoder_outputs = self._encode_entity_chunks(
+                word_ids,
+                word_segment_ids,
+                word_attention_mask,
+                entity_ids,
+                entity_position_ids,
+                entity_segment_ids,
+                entity_attention_mask,
+                entity_chunk_ids,
+            )
 
         word_hidden_states, entity_hidden_states = encoder_outputs[:2]
         hidden_size = word_hidden_states.size()[-1]
@@ -51,10 +68,10 @@ class LukeForNamedEntityRecognition(LukeEntityAwareAttentionModel):
             feature_vector = entity_hidden_states
 
         else:
-            entity_start_positions = entity_start_positions.unsqueeze(-1).expand(-1, -1, hidden_size)
-            start_states = torch.gather(word_hidden_states, -2, entity_start_positions)
-            entity_end_positions = entity_end_positions.unsqueeze(-1).expand(-1, -1, hidden_size)
-            end_states = torch.gather(word_hidden_states, -2, entity_end_positions)
+            start_positions = entity_start_positions.unsqueeze(-1).expand(-1, -1, hidden_size)
+            start_states = torch.gather(word_hidden_states, -2, start_positions)
+            end_positions = entity_end_positions.unsqueeze(-1).expand(-1, -1, hidden_size)
+            end_states = torch.gather(word_hidden_states, -2, end_positions)
             if self.args.no_entity_feature:
                 feature_vector = torch.cat([start_states, end_states], dim=2)
             else:
@@ -67,4 +84,75 @@ class LukeForNamedEntityRecognition(LukeEntityAwareAttentionModel):
             return logits
 
         loss_fn = CrossEntropyLoss(ignore_index=-1)
-        return (loss_fn(logits.view(-1, self.num_labels), labels.view(-1)),)
+        loss = loss_fn(logits.view(-1, self.num_labels), labels.view(-1))
+
+        if self.args.span_scorer:
+            span_logits = self.score_spans(
+                word_ids, word_segment_ids, word_attention_mask, entity_start_positions, entity_end_positions
+            ).view(-1)
+            span_labels = labels.view(-1)
+            span_mask = span_labels != -1
+            loss = loss + F.binary_cross_entropy_with_logits(
+                span_logits[span_mask], (span_labels[span_mask] > 0).type_as(span_logits)
+            )
+
+        return (loss,)
+
+    def _encode_entity_chunks(
+        self,
+        word_ids,
+        word_segment_ids,
+        word_attention_mask,
+        entity_ids,
+        entity_position_ids,
+        entity_segment_ids,
+        entity_attention_mask,
+        entity_chunk_ids,
+    ):
+        """Encodes the words of a sentence once together with all of its entity chunks.
+
+        Words attend to the entities of every chunk, while an entity only attends to the words and to the entities
+        of its own chunk.
+        """
+        word_embeddings = self.embeddings(word_ids, word_segment_ids)
+        entity_embeddings = self.entity_embeddings(entity_ids, entity_position_ids, entity_segment_ids)
+        attention_mask = self._compute_extended_attention_mask(word_attention_mask, entity_attention_mask)
+
+        chunk_ids = torch.cat([entity_chunk_ids.new_full(word_ids.size(), -1), entity_chunk_ids], dim=1)
+        query_chunk_ids = chunk_ids.unsqueeze(2)
+        key_chunk_ids = chunk_ids.unsqueeze(1)
+        cross_chunk_mask = (query_chunk_ids != key_chunk_ids) & (query_chunk_ids != -1) & (key_chunk_ids != -1)
+        attention_mask = attention_mask + cross_chunk_mask.unsqueeze(1).type_as(attention_mask) * -10000.0
+
+        return self.encoder(word_embeddings, entity_embeddings, attention_mask)
+
+    def score_spans(
+        self, word_ids, word_segment_ids, word_attention_mask, entity_start_positions, entity_end_positions
+    ):
+        """Scores candidate spans using only the start and end states of a word-only encoding of the input.
+
+        The encoder is not updated through this score, so training the scorer only fits the `span_scorer` layer and
+        does not change the entity-aware predictions.
+        """
+        batch_size = word_ids.size(0)
+        entity_ids = word_ids.new_zeros(batch_size, 1)
+        entity_position_ids = word_ids.new_full((batch_size, 1, 1), -1)
+
+        with torch.no_grad():
+            word_hidden_states = super(LukeForNamedEntityRecognition, self).forward(
+                word_ids,
+                word_segment_ids,
+                word_attention_mask,
+                entity_ids,
+                entity_position_ids,
+                entity_ids,
+                entity_ids,
+            )[0]
+        hidden_size = word_hidden_states.size()[-1]
+
+        entity_start_positions = entity_start_positions.unsqueeze(-1).expand(-1, -1, hidden_size)
+        start_states = torch.gather(word_hidden_states, -2, entity_start_positions)
+        entity_end_positions = entity_end_positions.unsqueeze(-1).expand(-1, -1, hidden_size)
+        end_states = torch.gather(word_hidden_states, -2, entity_end_positions)
+
+        return self.span_scorer(torch.cat([start_states, end_states], dim=2)).squeeze(-1)
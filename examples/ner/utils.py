@@ -2,6 +2,8 @@ import itertools
 import math
 import os
 import unicodedata
+
+import numpy as np
 from transformers.tokenization_roberta import RobertaTokenizer
 
 
@@ -17,6 +19,7 @@ class InputFeatures(object):
     def __init__(
         self,
         example_index,
+        sentence_index,
         word_ids,
         word_segment_ids,
         word_attention_mask,
@@ -28,8 +31,10 @@ class InputFeatures(object):
         entity_attention_mask,
         original_entity_spans,
         labels,
+        entity_chunk_ids=None,
     ):
         self.example_index = example_index
+        self.sentence_index = sentence_index
         self.word_ids = word_ids
         self.word_segment_ids = word_segment_ids
         self.word_attention_mask = word_attention_mask
@@ -41,6 +46,7 @@ class InputFeatures(object):
         self.entity_attention_mask = entity_attention_mask
         self.original_entity_spans = original_entity_spans
         self.labels = labels
+        self.entity_chunk_ids = entity_chunk_ids
 
 
 class CoNLLProcessor(object):
@@ -97,6 +103,7 @@ def convert_examples_to_features(
     max_num_subwords = max_seq_length - 2
     label_map = {label: i for i, label in enumerate(label_list)}
     features = []
+    sentence_index = 0
 
     def tokenize_word(text):
         if (
@@ -111,9 +118,11 @@ def convert_examples_to_features(
         tokens = [tokenize_word(w) for w in example.words]
         subwords = [w for li in tokens for w in li]
 
-        subword2token = list(itertools.chain(*[[i] * len(li) for i, li in enumerate(tokens)]))
+        subword2token = np.fromiter(
+            itertools.chain(*[[i] * len(li) for i, li in enumerate(tokens)]), dtype=np.int64, count=len(subwords)
+        )
         token2subword = [0] + list(itertools.accumulate(len(li) for li in tokens))
-        subword_start_positions = frozenset(token2subword)
+        subword_start_positions = np.unique(token2subword)
         subword_sentence_boundaries = [sum(len(li) for li in tokens[:p]) for p in example.sentence_boundaries]
 
         entity_labels = {}
@@ -144,6 +153,10 @@ def convert_examples_to_features(
         if start is not None:
             entity_labels[(token2subword[start], len(subwords))] = label_map[cur_type]
 
+        entity_label_keys = np.array([s * (len(subwords) + 1) + e for s, e in entity_labels], dtype=np.int64)
+        entity_label_ids = np.array(list(entity_labels.values()), dtype=np.int64)
+        unseen_entity_labels = np.ones(len(entity_labels), dtype=np.bool_)
+
         for n in range(len(subword_sentence_boundaries) - 1):
             doc_sent_start, doc_sent_end = subword_sentence_boundaries[n : n + 2]
 
@@ -166,53 +179,42 @@ def convert_examples_to_features(
             word_attention_mask = [1] * (len(target_tokens) + 2)
             word_segment_ids = [0] * (len(target_tokens) + 2)
 
-            entity_start_positions = []
-            entity_end_positions = []
-            entity_ids = []
-            entity_attention_mask = []
-            entity_segment_ids = []
-            entity_position_ids = []
-            original_entity_spans = []
-            labels = []
-
-            for entity_start in range(left_context_length, left_context_length + sentence_length):
-                doc_entity_start = entity_start + doc_offset
-                if doc_entity_start not in subword_start_positions:
-                    continue
-                for entity_end in range(entity_start + 1, left_context_length + sentence_length + 1):
-                    doc_entity_end = entity_end + doc_offset
-                    if doc_entity_end not in subword_start_positions:
-                        continue
-
-                    if entity_end - entity_start > max_mention_length:
-                        continue
-
-                    entity_start_positions.append(entity_start + 1)
-                    entity_end_positions.append(entity_end)
-                    entity_ids.append(1)
-                    entity_attention_mask.append(1)
-                    entity_segment_ids.append(0)
-
-                    position_ids = list(range(entity_start + 1, entity_end + 1))
-                    position_ids += [-1] * (max_mention_length - entity_end + entity_start)
-                    entity_position_ids.append(position_ids)
-
-                    original_entity_spans.append(
-                        (subword2token[doc_entity_start], subword2token[doc_entity_end - 1] + 1)
-                    )
-
-                    labels.append(entity_labels.get((doc_entity_start, doc_entity_end), 0))
-                    entity_labels.pop((doc_entity_start, doc_entity_end), None)
-
-            if len(entity_ids) == 1:
-                entity_start_positions.append(0)
-                entity_end_positions.append(0)
-                entity_ids.append(0)
-                entity_attention_mask.append(0)
-                entity_segment_ids.append(0)
-                entity_position_ids.append(([-1] * max_mention_length))
+            sentence_boundaries = subword_start_positions[
+                (subword_start_positions >= doc_sent_start) & (subword_start_positions <= doc_sent_end)
+            ]
+            entity_starts, entity_ends = enumerate_spans(sentence_boundaries - doc_offset, max_mention_length)
+            doc_entity_starts = entity_starts + doc_offset
+            doc_entity_ends = entity_ends + doc_offset
+            num_entities = len(entity_starts)
+
+            entity_start_positions = entity_starts + 1
+            entity_end_positions = entity_ends
+            entity_ids = np.ones(num_entities, dtype=np.int64)
+            entity_attention_mask = np.ones(num_entities, dtype=np.int64)
+            entity_segment_ids = np.zeros(num_entities, dtype=np.int64)
+            entity_position_ids = create_entity_position_ids(entity_starts + 1, entity_ends + 1, max_mention_length)
+            original_entity_spans = list(
+                zip(subword2token[doc_entity_starts].tolist(), (subword2token[doc_entity_ends - 1] + 1).tolist())
+            )
+
+            # spans are sorted by (start, end), so their keys are sorted and can be matched with binary search
+            span_keys = doc_entity_starts * (len(subwords) + 1) + doc_entity_ends
+            labels = np.zeros(num_entities, dtype=np.int64)
+            if num_entities > 0:
+                indices = np.searchsorted(span_keys, entity_label_keys).clip(max=num_entities - 1)
+                found = span_keys[indices] == entity_label_keys
+                labels[indices[found]] = entity_label_ids[found]
+                unseen_entity_labels[found] = False
+
+            if num_entities == 1:
+                entity_start_positions = np.append(entity_start_positions, 0)
+                entity_end_positions = np.append(entity_end_positions, 0)
+                entity_ids = np.append(entity_ids, 0)
+                entity_attention_mask = np.append(entity_attention_mask, 0)
+                entity_segment_ids = np.append(entity_segment_ids, 0)
+                entity_position_ids = np.vstack([entity_position_ids, np.full((1, max_mention_length), -1)])
                 original_entity_spans.append(None)
-                labels.append(-1)
+                labels = np.append(labels, -1)
 
             split_size = math.ceil(len(entity_ids) / max_entity_length)
             for i in range(split_size):
@@ -222,6 +224,7 @@ def convert_examples_to_features(
                 features.append(
                     InputFeatures(
                         example_index=example_index,
+                        sentence_index=sentence_index,
                         word_ids=word_ids,
                         word_attention_mask=word_attention_mask,
                         word_segment_ids=word_segment_ids,
@@ -235,12 +238,101 @@ def convert_examples_to_features(
                         labels=labels[start:end],
                     )
                 )
+            sentence_index += 1
 
-        assert not entity_labels
+        assert not unseen_entity_labels.any()
 
     return features
 
 
+def group_sentence_features(features):
+    sentence_features = {}
+    for feature in features:
+        sentence_features.setdefault(feature.sentence_index, []).append(feature)
+    return list(sentence_features.values())
+
+
+def merge_sentence_features(features, entity_indices=None):
+    """Merges the features of one sentence into a single feature.
+
+    The `entity_chunk_ids` of the merged feature record which of the original features each entity came from. If
+    `entity_indices` is given, only the candidate spans at these positions are kept and they are treated as a plain
+    feature without chunks.
+    """
+    feature = features[0]
+    entity_attrs = (
+        "entity_start_positions",
+        "entity_end_positions",
+        "entity_ids",
+        "entity_position_ids",
+        "entity_segment_ids",
+        "entity_attention_mask",
+        "labels",
+    )
+    entity_values = {attr: np.concatenate([getattr(f, attr) for f in features]) for attr in entity_attrs}
+    original_entity_spans = [span for f in features for span in f.original_entity_spans]
+    entity_chunk_ids = np.concatenate([np.full(len(f.labels), i, dtype=np.int64) for i, f in enumerate(features)])
+
+    if entity_indices is not None:
+        entity_values = {attr: values[entity_indices] for attr, values in entity_values.items()}
+        original_entity_spans = [original_entity_spans[i] for i in entity_indices]
+
+        if len(original_entity_spans) == 1:
+            for attr in entity_attrs:
+                padding_value = -1 if attr in ("entity_position_ids", "labels") else 0
+                padding = np.full((1,) + entity_values[attr].shape[1:], padding_value, dtype=np.int64)
+                entity_values[attr] = np.concatenate([entity_values[attr], padding])
+            original_entity_spans.append(None)
+
+        entity_chunk_ids = None
+
+    return InputFeatures(
+        example_index=feature.example_index,
+        sentence_index=feature.sentence_index,
+        word_ids=feature.word_ids,
+        word_attention_mask=feature.word_attention_mask,
+        word_segment_ids=feature.word_segment_ids,
+        original_entity_spans=original_entity_spans,
+        entity_chunk_ids=entity_chunk_ids,
+        **entity_values,
+    )
+
+
+def enumerate_spans(boundaries, max_mention_length):
+    """Returns the start and end positions of all spans between word boundaries.
+
+    A span is valid if both of its ends are in `boundaries` and it is at most `max_mention_length` subwords long.
+    The spans are ordered by their start positions and then by their end positions.
+    """
+    boundaries = np.asarray(boundaries, dtype=np.int64)
+    lengths = boundaries[np.newaxis, :] - boundaries[:, np.newaxis]
+    start_indices, end_indices = np.nonzero((lengths > 0) & (lengths <= max_mention_length))
+    return boundaries[start_indices], boundaries[end_indices]
+
+
+def create_entity_position_ids(start_positions, end_positions, max_mention_length):
+    position_ids = np.asarray(start_positions, dtype=np.int64)[:, np.newaxis] + np.arange(max_mention_length)
+    position_ids[position_ids >= np.asarray(end_positions, dtype=np.int64)[:, np.newaxis]] = -1
+    return position_ids
+
+
+def select_non_overlapping_spans(spans, scores, sequence_length):
+    """Greedily selects the highest-scoring spans that do not overlap with any already selected span.
+
+    Returns the indices of the selected spans in the order of selection.
+    """
+    spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+    occupied = np.zeros(sequence_length, dtype=np.bool_)
+    selected_indices = []
+    for index in np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable"):
+        start, end = spans[index]
+        if not occupied[start:end].any():
+            occupied[start:end] = True
+            selected_indices.append(index)
+
+    return selected_indices
+
+
 def is_punctuation(char):
     # obtained from:
     # https://github.com/huggingface/transformers/blob/5f25a5f367497278bf19c9994569db43f96d5278/transformers/tokenization_bert.py#L489
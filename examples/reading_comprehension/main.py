@@ -2,6 +2,7 @@ import json
 import logging
 import multiprocessing
 import os
+import time
 from argparse import Namespace
 
 import click
@@ -14,6 +15,7 @@ from transformers import WEIGHTS_NAME, BertTokenizer
 from wikipedia2vec.dump_db import DumpDB
 
 from ..utils import set_seed
+from ..utils.evaluation_sink import EvaluationSink, get_file_references
 from ..utils.mention_db import MentionDB
 from ..utils.trainer import Trainer, trainer_args
 from .model import LukeForReadingComprehension
@@ -127,6 +129,7 @@ def run(common_args, **task_args):
 
         result = evaluate(args, model, prefix="")
         results.update(result)
+        results["evaluation_arrays"] = get_file_references(os.path.join(args.output_dir, "eval"), with_labels=False)
 
     logger.info("Results: %s", json.dumps(results, indent=2, sort_keys=True))
     args.experiment.log_metrics(results)
@@ -138,18 +141,27 @@ def run(common_args, **task_args):
 
 def evaluate(args, model, prefix=""):
     dataloader, examples, features, processor = load_examples(args, evaluate=True)
-    all_results = []
+    # the start and end logits are written to a preallocated array padded with NaN up to the max sequence length
+    sink = EvaluationSink(
+        len(features), output_prefix=os.path.join(args.output_dir, "eval"), logits_shape=(2, args.max_seq_length)
+    )
+    feature_indices = []
+    sequence_lengths = []
     for batch in tqdm(dataloader, desc="eval"):
         model.eval()
         inputs = {k: v.to(args.device) for k, v in batch.items() if k != "example_indices"}
         with torch.no_grad():
-            outputs = model(**inputs)
+            start_logits, end_logits = model(**inputs)
 
-        for i, example_index in enumerate(batch["example_indices"]):
-            eval_feature = features[example_index.item()]
-            unique_id = int(eval_feature.unique_id)
-            start_logits, end_logits = [o[i].detach().cpu().tolist() for o in outputs]
-            all_results.append(Result(unique_id, start_logits, end_logits))
+        sink.add(torch.stack([start_logits, end_logits], dim=1))
+        feature_indices.extend(batch["example_indices"].tolist())
+        sequence_lengths.extend([start_logits.size(1)] * start_logits.size(0))
+
+    all_logits, _ = sink.close()
+    all_results = []
+    for logits, feature_index, sequence_length in zip(all_logits, feature_indices, sequence_lengths):
+        unique_id = int(features[feature_index].unique_id)
+        all_results.append(Result(unique_id, logits[0, :sequence_length], logits[1, :sequence_length]))
 
     output_prediction_file = os.path.join(args.output_dir, "predictions_{}.json".format(prefix))
     output_nbest_file = os.path.join(args.output_dir, "nbest_predictions_{}.json".format(prefix))
@@ -210,6 +222,7 @@ def load_examples(args, evaluate=False):
         add_extra_sep_token = True
 
     logger.info("Creating features from the dataset...")
+    start_time = time.time()
     features = convert_examples_to_features(
         examples=examples,
         tokenizer=args.tokenizer,
@@ -226,6 +239,7 @@ def load_examples(args, evaluate=False):
         add_extra_sep_token=add_extra_sep_token,
         is_training=not evaluate,
     )
+    logger.info("Created %d features in %.2f seconds", len(features), time.time() - start_time)
 
     if args.local_rank == 0 and not evaluate:
         torch.distributed.barrier()
@@ -2,11 +2,15 @@ import logging
 import multiprocessing
 import unicodedata
 from argparse import Namespace
+from collections import OrderedDict
 from contextlib import closing
-from itertools import chain, repeat
+from itertools import accumulate, chain, repeat
 from multiprocessing.pool import Pool
 
+import marisa_trie
+import numpy as np
 from tqdm import tqdm
+from transformers.tokenization_bert import BertTokenizer
 from transformers.tokenization_roberta import RobertaTokenizer
 
 logger = logging.getLogger(__name__)
@@ -67,6 +71,7 @@ def convert_examples_to_features(
     is_training,
     pool_size=multiprocessing.cpu_count(),
     chunk_size=30,
+    mention_cache_size=1024,
 ):
     passage_encoder = PassageEncoder(
         tokenizer,
@@ -78,6 +83,7 @@ def convert_examples_to_features(
         min_mention_link_prob,
         add_extra_sep_token,
         segment_b_id,
+        mention_cache_size,
     )
 
     worker_params = Namespace(
@@ -91,14 +97,20 @@ def convert_examples_to_features(
     )
     features = []
     unique_id = 1000000000
+    cache_hits = 0
+    cache_misses = 0
     with closing(Pool(pool_size, initializer=_initialize_worker, initargs=(worker_params,))) as pool:
         with tqdm(total=len(examples)) as pbar:
-            for ret in pool.imap(_process_example, enumerate(examples), chunksize=chunk_size):
+            for ret, num_hits, num_misses in pool.imap(_process_example, enumerate(examples), chunksize=chunk_size):
                 for feature in ret:
                     feature.unique_id = unique_id
                     features.append(feature)
                     unique_id += 1
+                cache_hits += num_hits
+                cache_misses += num_misses
                 pbar.update()
+
+    logger.info("Mention candidate cache: %d hits, %d misses", cache_hits, cache_misses)
     return features
 
 
@@ -114,6 +126,7 @@ class PassageEncoder(object):
         min_mention_link_prob,
         add_extra_sep_token,
         segment_b_id,
+        mention_cache_size=1024,
     ):
         self._tokenizer = tokenizer
         self._entity_vocab = entity_vocab
@@ -124,6 +137,10 @@ class PassageEncoder(object):
         self._add_extra_sep_token = add_extra_sep_token
         self._segment_b_id = segment_b_id
         self._min_mention_link_prob = min_mention_link_prob
+        self._mention_cache_size = mention_cache_size
+        self._mention_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def encode(self, title, tokens_a, tokens_b):
         if self._add_extra_sep_token:
@@ -137,30 +154,9 @@ class PassageEncoder(object):
         word_segment_ids = [0] * (len(tokens_a) + len(mid_sep_tokens) + 1) + [self._segment_b_id] * (len(tokens_b) + 1)
         word_attention_mask = [1] * len(all_tokens)
 
-        try:
-            title = self._link_redirect_mappings.get(title, title)
-            mention_candidates = {}
-            ambiguous_mentions = set()
-            for link in self._wiki_link_db.get(title):
-                if link.link_prob < self._min_mention_link_prob:
-                    continue
-
-                link_text = self._normalize_mention(link.text)
-                if link_text in mention_candidates and mention_candidates[link_text] != link.title:
-                    ambiguous_mentions.add(link_text)
-                    continue
-
-                mention_candidates[link_text] = link.title
-
-            for link_text in ambiguous_mentions:
-                del mention_candidates[link_text]
-
-        except KeyError:
-            mention_candidates = {}
-            logger.warning("Not found in the Dump DB: %s", title)
-
-        mentions_a = self._detect_mentions(tokens_a, mention_candidates)
-        mentions_b = self._detect_mentions(tokens_b, mention_candidates)
+        mention_candidates, mention_trie = self._get_mention_matcher(title)
+        mentions_a = self._detect_mentions(tokens_a, mention_candidates, mention_trie)
+        mentions_b = self._detect_mentions(tokens_b, mention_candidates, mention_trie)
         all_mentions = mentions_a + mentions_b
 
         if not all_mentions:
@@ -203,7 +199,84 @@ class PassageEncoder(object):
             entity_attention_mask=entity_attention_mask,
         )
 
-    def _detect_mentions(self, tokens, mention_candidates):
+    def _get_mention_matcher(self, title):
+        """Returns the mention candidates of the passage and a trie built over them.
+
+        The results are cached per resolved title in an LRU cache, since many questions share the same passage.
+        """
+        title = self._link_redirect_mappings.get(title, title)
+        if title in self._mention_cache:
+            self._mention_cache.move_to_end(title)
+            self.cache_hits += 1
+            return self._mention_cache[title]
+
+        self.cache_misses += 1
+        text_ids, title_ids, link_probs = self._wiki_link_db.get_arrays(title)
+        mask = link_probs.astype(np.float64) >= self._min_mention_link_prob
+        # WikiLinkDB.get() stores the mention text in WikiLink.title and the title in WikiLink.text, and the
+        # candidates below are built in the same way. The values are kept as ids and only restored when the
+        # mention is detected in the passage
+        unique_title_ids, title_indices = np.unique(title_ids[mask], return_inverse=True)
+        link_texts = [self._normalize_mention(self._wiki_link_db.get_title(title_id)) for title_id in unique_title_ids]
+
+        mention_candidates = {}
+        ambiguous_mentions = set()
+        for title_index, text_id in zip(title_indices.tolist(), text_ids[mask].tolist()):
+            link_text = link_texts[title_index]
+            if link_text in mention_candidates and mention_candidates[link_text] != text_id:
+                ambiguous_mentions.add(link_text)
+                continue
+
+            mention_candidates[link_text] = text_id
+
+        for link_text in ambiguous_mentions:
+            del mention_candidates[link_text]
+
+        matcher = (mention_candidates, marisa_trie.Trie(mention_candidates.keys()))
+        if self._mention_cache_size > 0:
+            self._mention_cache[title] = matcher
+            if len(self._mention_cache) > self._mention_cache_size:
+                self._mention_cache.popitem(last=False)
+
+        return matcher
+
+    def _detect_mentions(self, tokens, mention_candidates, mention_trie):
+        token_texts = self._get_normalized_token_texts(tokens)
+        if token_texts is None:
+            return self._detect_mentions_by_string_matching(tokens, mention_candidates)
+
+        is_subword = [self._is_subword(token) for token in tokens]
+        mentions = []
+        cur = 0
+        for start in range(len(tokens)):
+            if start < cur or is_subword[start]:
+                continue
+
+            max_end = min(start + self._max_mention_length, len(tokens))
+            text = "".join(token_texts[start:max_end])
+            stripped_text = text.lstrip()
+            # all candidates found here are prefixes of the same text, so they can be identified by their lengths
+            candidate_lengths = frozenset(len(key) for key in mention_trie.prefixes(stripped_text))
+            if not candidate_lengths:
+                continue
+
+            text_lengths = [0] + list(accumulate(len(t) for t in token_texts[start:max_end]))
+            num_stripped_chars = len(text) - len(stripped_text)
+            for end in range(max_end, start, -1):
+                if end < len(tokens) and is_subword[end]:
+                    continue
+                mention_text = stripped_text[: max(0, text_lengths[end - start] - num_stripped_chars)].rstrip()
+                if len(mention_text) in candidate_lengths:
+                    cur = end
+                    title = self._wiki_link_db.get_text(mention_candidates[mention_text])
+                    title = self._model_redirect_mappings.get(title, title)  # resolve mismatch between two dumps
+                    if title in self._entity_vocab:
+                        mentions.append((self._entity_vocab[title], start, end))
+                    break
+
+        return mentions
+
+    def _detect_mentions_by_string_matching(self, tokens, mention_candidates):
         mentions = []
         cur = 0
         for start, token in enumerate(tokens):
@@ -219,7 +292,7 @@ class PassageEncoder(object):
                 mention_text = self._normalize_mention(mention_text)
                 if mention_text in mention_candidates:
                     cur = end
-                    title = mention_candidates[mention_text]
+                    title = self._wiki_link_db.get_text(mention_candidates[mention_text])
                     title = self._model_redirect_mappings.get(title, title)  # resolve mismatch between two dumps
                     if title in self._entity_vocab:
                         mentions.append((self._entity_vocab[title], start, end))
@@ -227,6 +300,30 @@ class PassageEncoder(object):
 
         return mentions
 
+    def _get_normalized_token_texts(self, tokens):
+        """Returns the lowercased text of each token.
+
+        The texts are built such that the normalized mention text of any token span equals the concatenation of the
+        texts of its tokens with surrounding whitespace removed. None is returned if this does not hold for the given
+        tokens, i.e., if a token is not a complete UTF-8 sequence or the text contains a capital sigma, whose
+        lowercase form depends on the following characters.
+        """
+        if isinstance(self._tokenizer, RobertaTokenizer):
+            byte_decoder = self._tokenizer.byte_decoder
+            try:
+                texts = [bytearray([byte_decoder[c] for c in token]).decode("utf-8") for token in tokens]
+            except (KeyError, UnicodeDecodeError):
+                return None
+        elif isinstance(self._tokenizer, BertTokenizer):
+            texts = [token[2:] if token.startswith("##") else " " + token for token in tokens]
+        else:
+            return None
+
+        if any("\u03a3" in text for text in texts):
+            return None
+
+        return [text.lower() for text in texts]
+
     def _is_subword(self, token):
         if isinstance(self._tokenizer, RobertaTokenizer):
             token = self._tokenizer.convert_tokens_to_string(token)
@@ -266,6 +363,9 @@ def _process_example(args):
     example_index, example = args
 
     tokenizer = params.tokenizer
+    passage_encoder = params.passage_encoder
+    cache_hits = passage_encoder.cache_hits
+    cache_misses = passage_encoder.cache_misses
 
     query_tokens = _tokenize(example.question_text)
     if len(query_tokens) > params.max_query_length:
@@ -360,11 +460,11 @@ def _process_example(args):
                 token_is_max_context=token_is_max_context,
                 start_positions=start_positions,
                 end_positions=end_positions,
-                **params.passage_encoder.encode(example.title, query_tokens, answer_tokens)
+                **passage_encoder.encode(example.title, query_tokens, answer_tokens)
             )
         )
 
-    return features
+    return features, passage_encoder.cache_hits - cache_hits, passage_encoder.cache_misses - cache_misses
 
 
 def _tokenize(text):
@@ -1,8 +1,11 @@
 import json
 import logging
 import math
+import time
 import collections
 
+import numpy as np
+
 from transformers.tokenization_bert import BasicTokenizer
 from transformers.tokenization_roberta import RobertaTokenizer
 
@@ -42,18 +45,21 @@ def write_predictions(
     for result in all_results:
         unique_id_to_result[result.unique_id] = result
 
-    _PrelimPrediction = collections.namedtuple(
-        "PrelimPrediction", ["feature_index", "start_index", "end_index", "start_logit", "end_logit"]
-    )
+    _NbestPrediction = collections.namedtuple("NbestPrediction", ["text", "start_logit", "end_logit"])
 
     all_predictions = collections.OrderedDict()
     all_nbest_json = collections.OrderedDict()
     scores_diff_json = collections.OrderedDict()
 
+    start_time = time.time()
     for example_index, example in enumerate(all_examples):
         features = example_index_to_features[example_index]
 
-        prelim_predictions = []
+        # each prelim prediction is represented by its position in the following lists
+        prelim_feature_indexes = []
+        prelim_start_indexes = []
+        prelim_end_indexes = []
+        prelim_scores = []
         # keep track of the minimum score of null start+end of position 0
         score_null = 1000000  # large and positive
         min_null_feature_index = 0  # the paragraph slice with min null score
@@ -61,74 +67,75 @@ def write_predictions(
         null_end_logit = 0  # the end logit at the slice with min null score
         for (feature_index, feature) in enumerate(features):
             result = unique_id_to_result[feature.unique_id]
-            start_indexes = _get_best_indexes(result.start_logits, n_best_size)
-            end_indexes = _get_best_indexes(result.end_logits, n_best_size)
+            start_logits = np.array(result.start_logits, dtype=np.float64)
+            end_logits = np.array(result.end_logits, dtype=np.float64)
+            start_indexes = _get_best_indexes(start_logits, n_best_size)
+            end_indexes = _get_best_indexes(end_logits, n_best_size)
             # if we could have irrelevant answers, get the min score of irrelevant
             if version_2_with_negative:
-                feature_null_score = result.start_logits[0] + result.end_logits[0]
+                feature_null_score = float(start_logits[0]) + float(end_logits[0])
                 if feature_null_score < score_null:
                     score_null = feature_null_score
                     min_null_feature_index = feature_index
-                    null_start_logit = result.start_logits[0]
-                    null_end_logit = result.end_logits[0]
-            for start_index in start_indexes:
-                for end_index in end_indexes:
-                    # We could hypothetically create invalid predictions, e.g., predict
-                    # that the start of the span is in the question. We throw out all
-                    # invalid predictions.
-                    if start_index >= len(feature.tokens):
-                        continue
-                    if end_index >= len(feature.tokens):
-                        continue
-                    if start_index not in feature.token_to_orig_map:
-                        continue
-                    if end_index not in feature.token_to_orig_map:
-                        continue
-                    if not feature.token_is_max_context.get(start_index, False):
-                        continue
-                    if end_index < start_index:
-                        continue
-                    length = end_index - start_index + 1
-                    if length > max_answer_length:
-                        continue
-                    prelim_predictions.append(
-                        _PrelimPrediction(
-                            feature_index=feature_index,
-                            start_index=start_index,
-                            end_index=end_index,
-                            start_logit=result.start_logits[start_index],
-                            end_logit=result.end_logits[end_index],
-                        )
-                    )
+                    null_start_logit = float(start_logits[0])
+                    null_end_logit = float(end_logits[0])
+
+            # We could hypothetically create invalid predictions, e.g., predict that the start of the span is in the
+            # question. We throw out all invalid predictions.
+            num_tokens = min(len(feature.tokens), len(start_logits))
+            valid_end = np.zeros(len(start_logits), dtype=np.bool_)
+            valid_end[[i for i in feature.token_to_orig_map.keys() if i < num_tokens]] = True
+            valid_start = np.zeros(len(start_logits), dtype=np.bool_)
+            valid_start[[i for i, v in feature.token_is_max_context.items() if v and i < num_tokens]] = True
+            valid_start &= valid_end
+
+            lengths = end_indexes[None, :] - start_indexes[:, None] + 1
+            mask = valid_start[start_indexes][:, None] & valid_end[end_indexes][None, :]
+            mask &= (lengths >= 1) & (lengths <= max_answer_length)
+            scores = start_logits[start_indexes][:, None] + end_logits[end_indexes][None, :]
+
+            # the candidates are enumerated in the row-major order of the score matrix
+            start_positions, end_positions = np.nonzero(mask)
+            prelim_feature_indexes.append(np.full(len(start_positions), feature_index, dtype=np.int64))
+            prelim_start_indexes.append(start_indexes[start_positions])
+            prelim_end_indexes.append(end_indexes[end_positions])
+            prelim_scores.append(scores[mask])
+
         if version_2_with_negative:
-            prelim_predictions.append(
-                _PrelimPrediction(
-                    feature_index=min_null_feature_index,
-                    start_index=0,
-                    end_index=0,
-                    start_logit=null_start_logit,
-                    end_logit=null_end_logit,
-                )
-            )
-        prelim_predictions = sorted(prelim_predictions, key=lambda x: (x.start_logit + x.end_logit), reverse=True)
-
-        _NbestPrediction = collections.namedtuple("NbestPrediction", ["text", "start_logit", "end_logit"])
+            prelim_feature_indexes.append(np.array([min_null_feature_index], dtype=np.int64))
+            prelim_start_indexes.append(np.zeros(1, dtype=np.int64))
+            prelim_end_indexes.append(np.zeros(1, dtype=np.int64))
+            prelim_scores.append(np.array([null_start_logit + null_end_logit], dtype=np.float64))
+
+        if prelim_scores:
+            prelim_feature_indexes = np.concatenate(prelim_feature_indexes)
+            prelim_start_indexes = np.concatenate(prelim_start_indexes)
+            prelim_end_indexes = np.concatenate(prelim_end_indexes)
+            prelim_scores = np.concatenate(prelim_scores)
 
         seen_predictions = {}
         nbest = []
-        for pred in prelim_predictions:
+        for i in _iterate_best_indexes(prelim_scores, n_best_size):
             if len(nbest) >= n_best_size:
                 break
-            feature = features[pred.feature_index]
-            if pred.start_index > 0:  # this is a non-null prediction
-                tok_tokens = feature.tokens[pred.start_index : (pred.end_index + 1)]
+            feature = features[prelim_feature_indexes[i]]
+            start_index = int(prelim_start_indexes[i])
+            end_index = int(prelim_end_indexes[i])
+            if version_2_with_negative and i == len(prelim_scores) - 1:  # the null prediction
+                start_logit, end_logit = null_start_logit, null_end_logit
+            else:
+                result = unique_id_to_result[feature.unique_id]
+                start_logit, end_logit = float(result.start_logits[start_index]), float(result.end_logits[end_index])
+
+            if start_index > 0:  # this is a non-null prediction
+                tok_tokens = feature.tokens[start_index : (end_index + 1)]
                 tok_text = tokenizer.convert_tokens_to_string(tok_tokens)
                 if isinstance(tokenizer, RobertaTokenizer):
                     final_text = tokenizer.convert_tokens_to_string(tok_tokens).strip()
 
                 else:
-                    orig_doc_start = feature.token_to_orig_map[pred.start_index]
-                    orig_doc_end = feature.token_to_orig_map[pred.end_index]
+                    orig_doc_start = feature.token_to_orig_map[start_index]
+                    orig_doc_end = feature.token_to_orig_map[end_index]
                     orig_tokens = example.doc_tokens[orig_doc_start : (orig_doc_end + 1)]
 
                     tok_text = tok_text.strip()
@@ -145,7 +152,7 @@ def write_predictions(
                 final_text = ""
                 seen_predictions[final_text] = True
 
-            nbest.append(_NbestPrediction(text=final_text, start_logit=pred.start_logit, end_logit=pred.end_logit))
+            nbest.append(_NbestPrediction(text=final_text, start_logit=start_logit, end_logit=end_logit))
         # if we didn't include the empty option in the n-best, include it
         if version_2_with_negative:
             if "" not in seen_predictions:
@@ -196,6 +203,8 @@ def write_predictions(
                 all_predictions[example.qas_id] = best_non_null_entry.text
         all_nbest_json[example.qas_id] = nbest_json
 
+    logger.info("Computed predictions of %d examples in %.2f seconds", len(all_examples), time.time() - start_time)
+
     with open(output_prediction_file, "w") as writer:
         writer.write(json.dumps(all_predictions, indent=4) + "\n")
 
@@ -276,14 +285,23 @@ def get_final_text(pred_text, orig_text, do_lower_case, verbose_logging=False):
 
 
 def _get_best_indexes(logits, n_best_size):
-    index_and_score = sorted(enumerate(logits), key=lambda x: x[1], reverse=True)
-
-    best_indexes = []
-    for i in range(len(index_and_score)):
-        if i >= n_best_size:
-            break
-        best_indexes.append(index_and_score[i][0])
-    return best_indexes
+    """Returns the indexes of the top `n_best_size` logits in descending order, preferring smaller indexes on ties."""
+    if n_best_size < len(logits):
+        threshold = -np.partition(-logits, n_best_size - 1)[n_best_size - 1]
+        candidates = np.flatnonzero(logits >= threshold)
+    else:
+        candidates = np.arange(len(logits))
+    return candidates[np.argsort(-logits[candidates], kind="stable")[:n_best_size]]
+
+
+def _iterate_best_indexes(scores, size):
+    """Yields the indexes of the scores in descending order, sorting only as many scores as are consumed."""
+    num_yielded = 0
+    while num_yielded < len(scores):
+        indexes = _get_best_indexes(scores, size)
+        yield from indexes[num_yielded:]
+        num_yielded = len(indexes)
+        size *= 2
 
 
 def _compute_softmax(scores):
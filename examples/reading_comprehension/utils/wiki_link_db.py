@@ -1,9 +1,11 @@
 import logging
+import time
 from contextlib import closing
 from multiprocessing.pool import Pool
 
 import joblib
 import marisa_trie
+import numpy as np
 from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
@@ -44,6 +46,27 @@ class WikiLinkDB(object):
             for text_id, title_id, link_prob in self._data_trie[title]
         ]
 
+    def get_arrays(self, title):
+        """Returns the mention text ids, title ids, and link probabilities of the links in the page as arrays."""
+        if title not in self._data_trie:
+            records = []
+        else:
+            records = self._data_trie[title]
+        records = np.array(records, dtype=[("text_id", np.uint32), ("title_id", np.uint32), ("link_prob", np.float32)])
+        return records["text_id"], records["title_id"], records["link_prob"]
+
+    def get_text(self, text_id):
+        return self._mention_trie.restore_key(int(text_id))
+
+    def get_title(self, title_id):
+        return self._title_trie.restore_key(int(title_id))
+
+    def get_text_id(self, text):
+        return self._mention_trie[text]
+
+    def get_title_id(self, title):
+        return self._title_trie[title]
+
     def save(self, out_file):
         joblib.dump(
             dict(title_trie=self._title_trie, mention_trie=self._mention_trie, data_trie=self._data_trie), out_file
@@ -51,6 +74,7 @@ class WikiLinkDB(object):
 
     @staticmethod
     def build(dump_db, mention_db, out_file, pool_size, chunk_size):
+        start_time = time.time()
         title_trie = marisa_trie.Trie(dump_db.titles())
         data = {}
 
@@ -73,6 +97,7 @@ class WikiLinkDB(object):
         data_trie = marisa_trie.RecordTrie("<IIf", item_generator())
 
         joblib.dump(dict(title_trie=title_trie, mention_trie=mention_trie, data_trie=data_trie), out_file)
+        logger.info("Built the wiki link DB of %d pages in %.2f seconds", len(data), time.time() - start_time)
 
     @staticmethod
     def _initialize_worker(dump_db, mention_db, title_trie):
@@ -83,19 +108,25 @@ class WikiLinkDB(object):
 
     @staticmethod
     def _extract_wiki_links(title):
-        links = []
+        link_texts = []
+        link_title_ids = []
         for paragraph in _dump_db.get_paragraphs(title):
             for wiki_link in paragraph.wiki_links:
                 link_title = _dump_db.resolve_redirect(wiki_link.title)
                 if link_title not in _title_trie:
                     continue
 
-                mentions = _mention_db.query(wiki_link.text)
-                if mentions:
-                    link_prob = mentions[0].link_prob
-                else:
-                    link_prob = 0.0
-
-                links.append((wiki_link.text, _title_trie[link_title], link_prob))
+                link_texts.append(wiki_link.text)
+                link_title_ids.append(_title_trie[link_title])
+
+        # the link probability of the mention text is computed using the first returned mention
+        offsets, mentions = _mention_db.query_many(link_texts)
+        link_probs = np.zeros(len(link_texts))
+        has_mentions = offsets[1:] > offsets[:-1]
+        total_link_counts = mentions[offsets[:-1][has_mentions], 2].astype(np.float64)
+        doc_counts = mentions[offsets[:-1][has_mentions], 3].astype(np.float64)
+        link_probs[has_mentions] = np.minimum(
+            1.0, np.divide(total_link_counts, doc_counts, out=np.zeros_like(doc_counts), where=doc_counts > 0)
+        )
 
-        return title, links
+        return title, list(zip(link_texts, link_title_ids, link_probs.tolist()))
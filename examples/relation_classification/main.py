@@ -1,9 +1,11 @@
+import functools
 import json
 import logging
 import os
 from argparse import Namespace
 
 import click
+import numpy as np
 import torch
 from torch.utils.data import DataLoader, RandomSampler
 from torch.utils.data.distributed import DistributedSampler
@@ -13,9 +15,14 @@ from transformers import WEIGHTS_NAME
 from luke.utils.entity_vocab import MASK_TOKEN
 
 from ..utils import set_seed
+from ..utils.evaluation_sink import EvaluationSink, get_file_references
+from ..utils.inference_server import InferenceServer, inference_server_args
+from ..utils.model_export import export_and_benchmark, model_export_args
+from ..utils.quantization import compare_quantized_model
+from ..utils.sweep import run_in_process_sweep, sweep_args
 from ..utils.trainer import Trainer, trainer_args
 from .model import LukeForRelationClassification
-from .utils import HEAD_TOKEN, TAIL_TOKEN, convert_examples_to_features, DatasetProcessor
+from .utils import HEAD_TOKEN, TAIL_TOKEN, convert_examples_to_features, DatasetProcessor, InputExample
 
 logger = logging.getLogger(__name__)
 
@@ -25,25 +32,51 @@ def cli():
     pass
 
 
+def run_args(func):
+    @click.option("--checkpoint-file", type=click.Path(exists=True))
+    @click.option("--data-dir", default="data/tacred", type=click.Path(exists=True))
+    @click.option("--do-eval/--no-eval", default=True)
+    @click.option("--do-train/--no-train", default=True)
+    @click.option("--eval-batch-size", default=128)
+    @click.option("--num-train-epochs", default=5.0)
+    @click.option("--seed", default=42)
+    @click.option("--train-batch-size", default=4)
+    @click.option("--quantize/--no-quantize", default=False)
+    @trainer_args
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
 @cli.command()
-@click.option("--checkpoint-file", type=click.Path(exists=True))
-@click.option("--data-dir", default="data/tacred", type=click.Path(exists=True))
-@click.option("--do-eval/--no-eval", default=True)
-@click.option("--do-train/--no-train", default=True)
-@click.option("--eval-batch-size", default=128)
-@click.option("--num-train-epochs", default=5.0)
-@click.option("--seed", default=42)
-@click.option("--train-batch-size", default=4)
-@trainer_args
+@run_args
 @click.pass_obj
 def run(common_args, **task_args):
     task_args.update(common_args)
     args = Namespace(**task_args)
 
-    set_seed(args.seed)
+    setup_model_args(args)
+    return run_trial(args)
+
+
+@cli.command()
+@run_args
+@sweep_args
+@click.pass_obj
+def sweep(common_args, **task_args):
+    """Runs the training and evaluation for each combination of the swept values in this process, keeping the
+    pretrained weights and the features in memory across the trials."""
+    task_args.update(common_args)
+    args = Namespace(**task_args)
+
+    setup_model_args(args)
+    args.feature_cache = {}
+    run_in_process_sweep(args, run, run_trial)
 
-    args.experiment.log_parameters({p.name: getattr(args, p.name) for p in run.params})
 
+def setup_model_args(args):
     args.model_config.vocab_size += 2
     word_emb = args.model_weights["embeddings.word_embeddings.weight"]
     head_emb = word_emb[args.tokenizer.convert_tokens_to_ids(["@"])[0]].unsqueeze(0)
@@ -56,6 +89,12 @@ def run(common_args, **task_args):
     args.model_config.entity_vocab_size = 3
     args.model_weights["entity_embeddings.entity_embeddings.weight"] = torch.cat([entity_emb[:1], mask_emb])
 
+
+def run_trial(args):
+    set_seed(args.seed)
+
+    args.experiment.log_parameters({p.name: getattr(args, p.name) for p in run.params})
+
     train_dataloader, _, _, label_list = load_examples(args, fold="train")
     num_labels = len(label_list)
 
@@ -112,9 +151,17 @@ def run(common_args, **task_args):
             model.load_state_dict(torch.load(os.path.join(args.output_dir, WEIGHTS_NAME), map_location="cpu"))
         model.to(args.device)
 
+        results["evaluation_arrays"] = {}
         for eval_set in ("dev", "test"):
             output_file = os.path.join(args.output_dir, f"{eval_set}_predictions.txt")
-            results.update({f"{eval_set}_{k}": v for k, v in evaluate(args, model, eval_set, output_file).items()})
+            output_prefix = os.path.join(args.output_dir, eval_set)
+            results.update(
+                {f"{eval_set}_{k}": v for k, v in evaluate(args, model, eval_set, output_file, output_prefix).items()}
+            )
+            results["evaluation_arrays"][eval_set] = get_file_references(output_prefix)
+
+        if args.quantize:
+            results.update(compare_quantized_model(args, model, evaluate))
 
     logger.info("Results: %s", json.dumps(results, indent=2, sort_keys=True))
     args.experiment.log_metrics(results)
@@ -124,10 +171,98 @@ def run(common_args, **task_args):
     return results
 
 
-def evaluate(args, model, fold="dev", output_file=None):
-    dataloader, _, _, label_list = load_examples(args, fold=fold)
-    predictions = []
-    labels = []
+@cli.command()
+@click.option("--checkpoint-file", type=click.Path(exists=True), required=True)
+@click.option("--data-dir", default="data/tacred", type=click.Path(exists=True))
+@inference_server_args
+@click.pass_obj
+def serve(common_args, **task_args):
+    """Serves the model. POST /predict accepts {"text": ..., "span_a": [start, end], "span_b": [start, end]} or a list
+    of them, where span_a and span_b are the character spans of the head and tail entities."""
+    task_args.update(common_args)
+    args = Namespace(**task_args)
+
+    model, label_list = create_inference_model(args)
+
+    def postprocess(logits):
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        prediction = int(probs.argmax())
+        return dict(label=label_list[prediction], probability=float(probs[prediction]))
+
+    server = InferenceServer(
+        model,
+        functools.partial(featurize_instance, args, label_list),
+        postprocess,
+        args.tokenizer.pad_token_id,
+        args.device,
+        args.max_batch_size,
+        args.max_latency_ms,
+        args.num_workers,
+        args.num_threads,
+        args.metrics_window_size,
+    )
+    server.serve_forever(args.port)
+
+
+@cli.command()
+@click.option("--checkpoint-file", type=click.Path(exists=True), required=True)
+@click.option("--data-dir", default="data/tacred", type=click.Path(exists=True))
+@model_export_args
+@click.pass_obj
+def export(common_args, **task_args):
+    task_args.update(common_args)
+    args = Namespace(**task_args)
+    torch.set_num_threads(args.num_threads)
+
+    model, label_list = create_inference_model(args)
+    features = [featurize_instance(args, label_list, instance) for instance in EXPORT_EXAMPLE_INSTANCES]
+    output_file = args.output_file or os.path.join(args.output_dir, "model.pt")
+    results = export_and_benchmark(
+        model,
+        features,
+        args.tokenizer.pad_token_id,
+        output_file,
+        args.benchmark_batch_size,
+        args.benchmark_iterations,
+    )
+    logger.info("Exported the model to %s", output_file)
+    logger.info("Results: %s", json.dumps(results, indent=2, sort_keys=True))
+    with open(os.path.join(args.output_dir, "export_results.json"), "w") as f:
+        json.dump(results, f)
+
+
+EXPORT_EXAMPLE_INSTANCES = [
+    dict(text="Barack Obama was born in Hawaii .", span_a=[0, 12], span_b=[25, 31]),
+    dict(text="Satya Nadella has been the chief executive of Microsoft since 2014 .", span_a=[0, 13], span_b=[46, 55]),
+]
+
+
+def create_inference_model(args):
+    args.model_config.vocab_size += 2
+    args.model_config.entity_vocab_size = 3
+    args.tokenizer.add_special_tokens(dict(additional_special_tokens=[HEAD_TOKEN, TAIL_TOKEN]))
+
+    label_list = DatasetProcessor().get_label_list(args.data_dir)
+    model = LukeForRelationClassification(args, len(label_list))
+    model.load_state_dict(torch.load(args.checkpoint_file, map_location="cpu"))
+
+    return model, label_list
+
+
+def featurize_instance(args, label_list, instance):
+    span_a = (int(instance["span_a"][0]), int(instance["span_a"][1]))
+    span_b = (int(instance["span_b"][0]), int(instance["span_b"][1]))
+    example = InputExample(None, instance["text"], span_a, span_b, None, None, label_list[0])
+    features = convert_examples_to_features(
+        [example], label_list, args.tokenizer, args.max_mention_length, show_progress=False
+    )
+    return features[0]
+
+
+def evaluate(args, model, fold="dev", output_file=None, output_prefix=None):
+    dataloader, _, features, label_list = load_examples(args, fold=fold)
+    sink = EvaluationSink(len(features), output_prefix=output_prefix, labels_dtype=np.int64)
 
     model.eval()
     for batch in tqdm(dataloader, desc=fold):
@@ -135,25 +270,19 @@ def evaluate(args, model, fold="dev", output_file=None):
         with torch.no_grad():
             logits = model(**inputs)
 
-        predictions.extend(logits.detach().cpu().numpy().argmax(axis=1))
-        labels.extend(batch["label"].to("cpu").tolist())
+        sink.add(logits, batch["label"])
+
+    logits, labels = sink.close()
+    predictions = logits.argmax(axis=1)
 
     if output_file:
         with open(output_file, "w") as f:
             for prediction in predictions:
                 f.write(label_list[prediction] + "\n")
 
-    num_predicted_labels = 0
-    num_gold_labels = 0
-    num_correct_labels = 0
-
-    for label, prediction in zip(labels, predictions):
-        if prediction != 0:
-            num_predicted_labels += 1
-        if label != 0:
-            num_gold_labels += 1
-            if prediction == label:
-                num_correct_labels += 1
+    num_predicted_labels = int((predictions != 0).sum())
+    num_gold_labels = int((labels != 0).sum())
+    num_correct_labels = int(((labels != 0) & (predictions == labels)).sum())
 
     if num_predicted_labels > 0:
         precision = num_correct_labels / num_predicted_labels
@@ -172,18 +301,26 @@ def load_examples(args, fold="train"):
     if args.local_rank not in (-1, 0) and fold == "train":
         torch.distributed.barrier()
 
-    processor = DatasetProcessor()
-    if fold == "train":
-        examples = processor.get_train_examples(args.data_dir)
-    elif fold == "dev":
-        examples = processor.get_dev_examples(args.data_dir)
+    # the features are cached across the trials of a sweep
+    feature_cache = getattr(args, "feature_cache", None)
+    cache_key = (fold, args.data_dir)
+    if feature_cache is not None and cache_key in feature_cache:
+        examples, features, label_list = feature_cache[cache_key]
     else:
-        examples = processor.get_test_examples(args.data_dir)
+        processor = DatasetProcessor()
+        if fold == "train":
+            examples = processor.get_train_examples(args.data_dir)
+        elif fold == "dev":
+            examples = processor.get_dev_examples(args.data_dir)
+        else:
+            examples = processor.get_test_examples(args.data_dir)
 
-    label_list = processor.get_label_list(args.data_dir)
+        label_list = processor.get_label_list(args.data_dir)
 
-    logger.info("Creating features from the dataset...")
-    features = convert_examples_to_features(examples, label_list, args.tokenizer, args.max_mention_length)
+        logger.info("Creating features from the dataset...")
+        features = convert_examples_to_features(examples, label_list, args.tokenizer, args.max_mention_length)
+        if feature_cache is not None:
+            feature_cache[cache_key] = (examples, features, label_list)
 
     if args.local_rank == 0 and fold == "train":
         torch.distributed.barrier()
@@ -104,7 +104,7 @@ class DatasetProcessor(object):
         return examples
 
 
-def convert_examples_to_features(examples, label_list, tokenizer, max_mention_length):
+def convert_examples_to_features(examples, label_list, tokenizer, max_mention_length, show_progress=True):
     label_map = {l: i for i, l in enumerate(label_list)}
 
     def tokenize(text):
@@ -114,7 +114,7 @@ def convert_examples_to_features(examples, label_list, tokenizer, max_mention_le
             return tokenizer.tokenize(text)
 
     features = []
-    for example in tqdm(examples):
+    for example in tqdm(examples, disable=not show_progress):
         if example.span_a[1] < example.span_b[1]:
             span_order = ("span_a", "span_b")
         else:
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import torch
+
+
+class EvaluationSink(object):
+    """Collects the logits and labels of an evaluation set into preallocated arrays.
+
+    If `output_prefix` is specified, the arrays are memory-mapped .npy files named `<output_prefix>_logits.npy` and
+    `<output_prefix>_labels.npy`, which are filled incrementally as batches are added. Otherwise, they are kept in
+    memory.
+
+    If `logits_shape` is specified, the logits of each batch can be shorter than it in the last dimension (e.g., when
+    the sequences are padded per batch), and the remaining entries are filled with NaN.
+    """
+
+    def __init__(
+        self, num_examples, output_prefix=None, logits_shape=None, logits_dtype=np.float32, labels_dtype=np.int8
+    ):
+        self.num_examples = num_examples
+        self.output_prefix = output_prefix
+        self.logits_shape = logits_shape
+        self.logits_dtype = logits_dtype
+        self.labels_dtype = labels_dtype
+
+        self.logits = None
+        self.labels = None
+        self._size = 0
+
+    def add(self, logits, labels=None):
+        logits = _to_numpy(logits)
+        if self.logits is None:
+            self.logits = self._create_array("_logits.npy", self.logits_shape or logits.shape[1:], self.logits_dtype)
+            if self.logits_shape is not None:
+                self.logits.fill(np.nan)
+        if labels is not None and self.labels is None:
+            labels = _to_numpy(labels)
+            self.labels = self._create_array("_labels.npy", labels.shape[1:], self.labels_dtype)
+
+        end = self._size + logits.shape[0]
+        if end > self.num_examples:
+            raise ValueError(f"Received more than {self.num_examples} examples")
+        self.logits[self._size : end, ..., : logits.shape[-1]] = logits
+        if labels is not None:
+            self.labels[self._size : end] = _to_numpy(labels)
+        self._size = end
+
+    def close(self):
+        """Flushes the arrays to disk and returns the logits and labels as arrays."""
+        if self._size != self.num_examples:
+            raise ValueError(f"Received {self._size} examples but expected {self.num_examples}")
+        if self.logits is None:
+            return np.zeros((0,), dtype=self.logits_dtype), np.zeros((0,), dtype=self.labels_dtype)
+
+        for array in (self.logits, self.labels):
+            if isinstance(array, np.memmap):
+                array.flush()
+        return self.logits, self.labels
+
+    def _create_array(self, file_suffix, shape, dtype):
+        shape = (self.num_examples,) + tuple(shape)
+        if self.output_prefix is None:
+            return np.empty(shape, dtype=dtype)
+        return np.lib.format.open_memmap(self.output_prefix + file_suffix, mode="w+", dtype=dtype, shape=shape)
+
+
+def get_file_references(output_prefix, with_labels=True):
+    """Returns the names of the array files relative to the output directory, e.g., to be stored in results.json."""
+    prefix = os.path.basename(output_prefix)
+    ret = dict(predict_logits_file=prefix + "_logits.npy")
+    if with_labels:
+        ret["true_labels_file"] = prefix + "_labels.npy"
+    return ret
+
+
+def _to_numpy(array):
+    if isinstance(array, torch.Tensor):
+        return array.detach().cpu().numpy()
+    return np.asarray(array)
@@ -0,0 +1,227 @@
+import gc
+import json
+import logging
+import os
+import resource
+import time
+from argparse import Namespace
+
+import click
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+REPRESENTATIONS = ("entity", "cls", "pooled")
+
+
+@click.command(name="extract-features")
+@click.option("--task", required=True, type=click.Choice(["entity-typing", "relation-classification"]))
+@click.option("--checkpoint-file", type=click.Path(exists=True), required=True)
+@click.option("--data-dir", type=click.Path(exists=True), required=True)
+@click.option("--fold", "folds", multiple=True, default=["dev", "test"], type=click.Choice(["train", "dev", "test"]))
+@click.option("--representations", default="entity,cls,pooled", help="Comma-separated subset of entity,cls,pooled")
+@click.option("--layers", default="", help="Comma-separated layers (1-based) whose entity and CLS states are extracted")
+@click.option("--batch-size", default=256)
+@click.option("--shard-size", default=10000)
+@click.option("--max-rss-mb", default=0, help="Releases the written pages of the shard when the RSS exceeds this")
+@click.option("--fp16", is_flag=True, help="Runs the model in half precision (only on GPU)")
+@click.pass_obj
+def cli(common_args, **task_args):
+    """Extracts the entity, CLS, and pooled representations of a fine-tuned model for whole datasets.
+
+    The representations of each fold are written to sharded float16 .npy files in <output-dir>/features/<fold>, which
+    are listed with the ranges of their example ids in index.json. The extraction resumes after the last complete
+    shard if it is interrupted.
+    """
+    task_args.update(common_args)
+    args = Namespace(**task_args)
+    args.eval_batch_size = args.train_batch_size = args.batch_size
+    args.train_frac_size = 1.0
+
+    representations = [name for name in args.representations.split(",") if name]
+    for name in representations:
+        if name not in REPRESENTATIONS:
+            raise click.BadParameter(f"Invalid representation: {name}", param_hint="--representations")
+    layers = [int(layer) for layer in args.layers.split(",") if layer]
+
+    if args.task == "entity-typing":
+        from ..entity_typing.main import create_inference_model, load_examples
+    else:
+        from ..relation_classification.main import create_inference_model, load_examples
+
+    model, _ = create_inference_model(args)
+    model.to(args.device)
+    if args.fp16 and args.device.type == "cuda":
+        model.half()
+    model.eval()
+
+    for fold in args.folds:
+        dataloader = load_examples(args, fold)[0]
+        extractor = FeatureExtractor(model, representations, layers)
+        write_features(
+            extractor,
+            dataloader.dataset,
+            dataloader.collate_fn,
+            os.path.join(args.output_dir, "features", fold),
+            args.batch_size,
+            args.shard_size,
+            args.max_rss_mb,
+            args.device,
+        )
+
+
+class FeatureExtractor(object):
+    """Captures the hidden states of a model based on LukeEntityAwareAttentionModel using forward hooks."""
+
+    def __init__(self, model, representations=REPRESENTATIONS, layers=()):
+        self.model = model
+        self.representations = representations
+        self.layers = layers
+
+    @torch.no_grad()
+    def __call__(self, inputs):
+        outputs = {}
+        handles = [self.model.encoder.register_forward_hook(self._create_hook(outputs, "final"))]
+        for layer in self.layers:
+            handles.append(self.model.encoder.layer[layer - 1].register_forward_hook(self._create_hook(outputs, layer)))
+        try:
+            self.model(**inputs)
+        finally:
+            for handle in handles:
+                handle.remove()
+
+        word_hidden_states, entity_hidden_states = outputs["final"]
+        ret = {}
+        if "entity" in self.representations:
+            ret["entity"] = entity_hidden_states
+        if "cls" in self.representations:
+            ret["cls"] = word_hidden_states[:, 0]
+        if "pooled" in self.representations:
+            ret["pooled"] = self.model.pooler(word_hidden_states)
+        for layer in self.layers:
+            ret[f"layer{layer}_entity"] = outputs[layer][1]
+            ret[f"layer{layer}_cls"] = outputs[layer][0][:, 0]
+
+        return {name: tensor.to(torch.float16).cpu().numpy() for name, tensor in ret.items()}
+
+    @staticmethod
+    def _create_hook(outputs, key):
+        def hook(module, inputs, output):
+            outputs[key] = output[:2]
+
+        return hook
+
+
+def write_features(extractor, features, collate_fn, output_dir, batch_size, shard_size, max_rss_mb=0, device="cpu"):
+    """Writes the representations returned by `extractor` for `features` to float16 .npy files of `shard_size` rows.
+
+    The shards that are already listed in index.json in `output_dir` are skipped.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_file = os.path.join(output_dir, INDEX_FILE)
+    index = dict(num_examples=len(features), shard_size=shard_size, shards=[])
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+        if index["num_examples"] != len(features) or index["shard_size"] != shard_size:
+            raise RuntimeError(f"{index_file} was created for a different dataset or shard size")
+
+    start_time = time.time()
+    start = index["shards"][-1]["end"] if index["shards"] else 0
+    if start > 0:
+        logger.info("Resuming the extraction from example %d in %s", start, output_dir)
+
+    for shard_start in range(start, len(features), shard_size):
+        shard_end = min(shard_start + shard_size, len(features))
+        shard_name = f"shard_{len(index['shards']):05d}"
+        writer = _ShardWriter(os.path.join(output_dir, shard_name), shard_end - shard_start)
+        writer.add("ids", np.arange(shard_start, shard_end, dtype=np.int64))
+
+        dataloader = DataLoader(features[shard_start:shard_end], batch_size=batch_size, collate_fn=collate_fn)
+        for batch in tqdm(dataloader, desc=shard_name):
+            labels = batch.pop("labels", batch.pop("label", None))
+            arrays = extractor({k: v.to(device) for k, v in batch.items()})
+            if labels is not None:
+                arrays["labels"] = labels.numpy()
+            writer.add_batch(arrays)
+
+            if max_rss_mb and _get_rss_mb() > max_rss_mb:
+                writer.release_pages()
+                gc.collect()
+
+        index["shards"].append(dict(name=shard_name, start=shard_start, end=shard_end, files=writer.close()))
+        _write_index(index, index_file)
+
+    logger.info(
+        "Extracted the features of %d examples in %.2f seconds", len(features) - start, time.time() - start_time
+    )
+    return index
+
+
+def load_features(output_dir, name):
+    """Returns the example ids and the given representation of all shards in `output_dir` as arrays."""
+    with open(os.path.join(output_dir, INDEX_FILE)) as f:
+        index = json.load(f)
+    ids = [np.load(os.path.join(output_dir, shard["files"]["ids"])) for shard in index["shards"]]
+    arrays = [np.load(os.path.join(output_dir, shard["files"][name]), mmap_mode="r") for shard in index["shards"]]
+    return np.concatenate(ids), np.concatenate(arrays)
+
+
+class _ShardWriter(object):
+    def __init__(self, prefix, num_rows):
+        self.prefix = prefix
+        self.num_rows = num_rows
+        self.arrays = {}
+        self._size = 0
+
+    def add(self, name, array):
+        self._get_array(name, array)[:] = array
+
+    def add_batch(self, arrays):
+        size = next(iter(arrays.values())).shape[0]
+        for name, array in arrays.items():
+            self._get_array(name, array)[self._size : self._size + size] = array
+        self._size += size
+
+    def release_pages(self):
+        # re-opening the memory maps drops their written pages from the RSS of the process
+        for name, array in self.arrays.items():
+            array.flush()
+            self.arrays[name] = np.load(array.filename, mmap_mode="r+")
+
+    def close(self):
+        if self._size != self.num_rows:
+            raise RuntimeError(f"Wrote {self._size} rows to {self.prefix} but expected {self.num_rows}")
+        for array in self.arrays.values():
+            array.flush()
+        files = {name: os.path.basename(array.filename) for name, array in self.arrays.items()}
+        self.arrays = {}
+        return files
+
+    def _get_array(self, name, array):
+        if name not in self.arrays:
+            shape = (self.num_rows,) + array.shape[1:]
+            self.arrays[name] = np.lib.format.open_memmap(
+                f"{self.prefix}_{name}.npy", mode="w+", dtype=array.dtype, shape=shape
+            )
+        return self.arrays[name]
+
+
+def _write_index(index, index_file):
+    tmp_file = index_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_file, index_file)
+
+
+def _get_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        # the peak RSS is used if the current RSS is not available (e.g., on macOS, where it is in bytes)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
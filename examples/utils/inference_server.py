@@ -0,0 +1,253 @@
+import functools
+import json
+import logging
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import click
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+MODEL_INPUT_PADDING_VALUES = dict(
+    word_ids=None,  # replaced with the pad token id of the tokenizer
+    word_segment_ids=0,
+    word_attention_mask=0,
+    entity_ids=0,
+    entity_position_ids=-1,
+    entity_segment_ids=0,
+    entity_attention_mask=0,
+)
+
+
+def inference_server_args(func):
+    @click.option("--port", default=8080)
+    @click.option("--max-batch-size", default=32)
+    @click.option("--max-latency-ms", default=10.0)
+    @click.option("--num-workers", default=1)
+    @click.option("--num-threads", default=torch.get_num_threads())
+    @click.option("--metrics-window-size", default=10000)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """The same as http.server.ThreadingHTTPServer, which is only available in Python 3.7 or later."""
+
+    daemon_threads = True
+
+
+class InferenceServer(object):
+    """Serves a task model over HTTP on localhost with dynamic micro-batching.
+
+    Requests are queued and grouped into batches of at most `max_batch_size` instances. A batch is run as soon as it
+    is full or its oldest request has waited for `max_latency_ms` milliseconds.
+    """
+
+    def __init__(
+        self,
+        model,
+        featurize_fn,
+        postprocess_fn,
+        pad_token_id,
+        device,
+        max_batch_size,
+        max_latency_ms,
+        num_workers,
+        num_threads,
+        metrics_window_size,
+    ):
+        self._model = model
+        self._featurize_fn = featurize_fn
+        self._postprocess_fn = postprocess_fn
+        self._pad_token_id = pad_token_id
+        self._device = device
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency_ms / 1000.0
+        self._num_workers = num_workers
+        self._num_threads = num_threads
+
+        self._queue = queue.Queue()
+        self._workers = []
+
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=metrics_window_size)
+        self._finish_times = deque(maxlen=metrics_window_size)
+        self._num_requests = 0
+        self._num_batches = 0
+        self._num_errors = 0
+        self._start_time = time.time()
+
+    def start(self):
+        torch.set_num_threads(self._num_threads)
+        self._model.to(self._device)
+        self._model.eval()
+
+        for _ in range(self._num_workers):
+            worker = threading.Thread(target=self._run_worker, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def predict(self, instance):
+        future = Future()
+        self._queue.put((time.time(), self._featurize_fn(instance), future))
+        return future
+
+    def metrics(self):
+        with self._metrics_lock:
+            latencies = np.array(self._latencies) * 1000.0
+            finish_times = list(self._finish_times)
+            ret = dict(
+                num_requests=self._num_requests,
+                num_batches=self._num_batches,
+                num_errors=self._num_errors,
+                average_batch_size=self._num_requests / self._num_batches if self._num_batches else 0.0,
+                uptime=time.time() - self._start_time,
+            )
+
+        if latencies.size:
+            ret["latency_p50_ms"] = float(np.percentile(latencies, 50))
+            ret["latency_p99_ms"] = float(np.percentile(latencies, 99))
+        else:
+            ret["latency_p50_ms"] = ret["latency_p99_ms"] = 0.0
+
+        # the throughput is computed over the requests in the metrics window
+        if len(finish_times) > 1 and finish_times[-1] > finish_times[0]:
+            ret["throughput"] = (len(finish_times) - 1) / (finish_times[-1] - finish_times[0])
+        else:
+            ret["throughput"] = 0.0
+
+        return ret
+
+    def serve_forever(self, port):
+        server = _ThreadingHTTPServer(("127.0.0.1", port), _create_request_handler(self))
+        self.start()
+        logger.info("Serving on http://127.0.0.1:%d", port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stop()
+
+    def _run_worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = item[0] + self._max_latency
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # let this worker stop after the current batch
+                    break
+                batch.append(item)
+
+            self._process_batch(batch)
+
+    def _process_batch(self, batch):
+        try:
+            inputs = create_model_inputs([features for _, features, _ in batch], self._pad_token_id)
+            inputs = {k: v.to(self._device) for k, v in inputs.items()}
+            with torch.no_grad():
+                outputs = self._model(**inputs)
+            outputs = outputs.cpu().numpy()
+            results = [self._postprocess_fn(output) for output in outputs]
+        except Exception as e:
+            logger.exception("Failed to process a batch")
+            for _, _, future in batch:
+                future.set_exception(e)
+            with self._metrics_lock:
+                self._num_errors += len(batch)
+            return
+
+        finish_time = time.time()
+        with self._metrics_lock:
+            self._num_requests += len(batch)
+            self._num_batches += 1
+            for start_time, _, _ in batch:
+                self._latencies.append(finish_time - start_time)
+                self._finish_times.append(finish_time)
+
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+def create_model_inputs(features, pad_token_id):
+    ret = {}
+    for attr_name, padding_value in MODEL_INPUT_PADDING_VALUES.items():
+        if padding_value is None:
+            padding_value = pad_token_id
+        tensors = [torch.tensor(getattr(o, attr_name), dtype=torch.long) for o in features]
+        ret[attr_name] = torch.nn.utils.rnn.pad_sequence(tensors, batch_first=True, padding_value=padding_value)
+    return ret
+
+
+def _create_request_handler(server):
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._send_json(200, server.metrics())
+            else:
+                self._send_json(404, dict(error="Not found"))
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send_json(404, dict(error="Not found"))
+                return
+
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if isinstance(data, list):
+                    futures = [server.predict(instance) for instance in data]
+                else:
+                    futures = [server.predict(data)]
+            except (ValueError, KeyError, TypeError, IndexError) as e:
+                self._send_json(400, dict(error=f"Invalid request: {e!r}"))
+                return
+
+            try:
+                results = [future.result() for future in futures]
+            except Exception as e:
+                self._send_json(500, dict(error=repr(e)))
+                return
+
+            self._send_json(200, results if isinstance(data, list) else results[0])
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+        def _send_json(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return RequestHandler
@@ -1,15 +1,26 @@
+import functools
+import heapq
+import json
 import logging
+import os
+import pickle
+import tempfile
+import time
 from collections import defaultdict, Counter
 from contextlib import closing
+from itertools import groupby, islice
 import multiprocessing
 from multiprocessing.pool import Pool
 import click
 import joblib
 import marisa_trie
+import numpy as np
 from tqdm import tqdm
 from transformers.tokenization_bert import BasicTokenizer
 from wikipedia2vec.dump_db import DumpDB
 
+from luke.utils.entity_vocab import EntityVocab
+
 SEP_CHAR = "\u2581"
 REP_CHAR = "_"
 
@@ -30,6 +41,7 @@ def cli():
 @click.option("--max-mention-length", default=20)
 @click.option("--pool-size", default=multiprocessing.cpu_count())
 @click.option("--chunk-size", default=100)
+@click.option("--buffer-size", default=5000000)
 def build_from_wikipedia(dump_db_file, **kwargs):
     dump_db = DumpDB(dump_db_file)
     tokenizer = BasicTokenizer(do_lower_case=False)
@@ -51,6 +63,28 @@ def build_from_p_e_m_file(p_e_m_file, dump_db_file, wiki_mention_db_file, **kwar
     MentionDB.build_from_p_e_m_file(p_e_m_file, dump_db, wiki_mention_db, tokenizer, normalizer, **kwargs)
 
 
+@cli.command()
+@click.argument("mention_db_file", type=click.Path(exists=True))
+@click.argument("entity_vocab_file", type=click.Path(exists=True))
+@click.option("--input-file", type=click.File("r"), default="-")
+@click.option("--output-file", type=click.File("w"), default="-")
+@click.option("--text-field", default="text")
+@click.option("--language")
+@click.option("--min-link-prob", default=0.0)
+@click.option("--min-prior-prob", default=0.0)
+@click.option("--max-candidate-size", default=30)
+@click.option("--pool-size", default=multiprocessing.cpu_count())
+@click.option("--chunk-size", default=100)
+def link(mention_db_file, entity_vocab_file, input_file, output_file, text_field, pool_size, chunk_size, **kwargs):
+    mention_db = MentionDB(mention_db_file)
+    entity_vocab = EntityVocab(entity_vocab_file)
+    linker = EntityLinker(mention_db, entity_vocab, **kwargs)
+
+    documents = (json.loads(line) for line in input_file if line.strip())
+    for document in linker.link_documents(documents, text_field, pool_size, chunk_size):
+        output_file.write(json.dumps(document, ensure_ascii=False) + "\n")
+
+
 class Mention(object):
     __slots__ = ("title", "text", "start", "end", "link_count", "total_link_count", "doc_count")
 
@@ -97,12 +131,95 @@ class BertLowercaseNormalizer(object):
         return token
 
 
+class EntityLinker(object):
+    def __init__(
+        self, mention_db, entity_vocab, language=None, min_link_prob=0.0, min_prior_prob=0.0, max_candidate_size=30
+    ):
+        self._mention_db = mention_db
+        self._entity_vocab = entity_vocab
+        self._language = language
+        self._min_link_prob = min_link_prob
+        self._min_prior_prob = min_prior_prob
+        self._max_candidate_size = max_candidate_size
+
+    def link(self, text):
+        ret = []
+        for span, mentions in groupby(self._mention_db.detect_mentions(text), key=lambda m: m.span):
+            mentions = list(mentions)
+            if mentions[0].link_prob < self._min_link_prob:
+                continue
+
+            candidates = []
+            for mention in sorted(mentions, key=lambda m: -m.link_count):
+                if mention.prior_prob < self._min_prior_prob:
+                    continue
+                entity_id = self._entity_vocab.get_id(mention.title, self._language)
+                if entity_id is None:
+                    continue
+                candidates.append(dict(entity_id=entity_id, title=mention.title, prior_prob=mention.prior_prob))
+                if len(candidates) == self._max_candidate_size:
+                    break
+
+            if candidates:
+                ret.append(
+                    dict(
+                        text=mentions[0].text,
+                        start=span[0],
+                        end=span[1],
+                        link_prob=mentions[0].link_prob,
+                        candidates=candidates,
+                    )
+                )
+
+        return ret
+
+    def link_documents(self, documents, text_field="text", pool_size=multiprocessing.cpu_count(), chunk_size=100):
+        """Links the documents in parallel and yields them in order with their mentions stored in `mentions`.
+
+        Documents without a text in `text_field` are yielded with no mentions and the reason stored in `error`.
+        """
+        num_documents = num_errors = 0
+        start_time = time.time()
+        with closing(Pool(pool_size, initializer=EntityLinker._initialize_worker, initargs=(self, text_field))) as pool:
+            for document in pool.imap(EntityLinker._link_document, documents, chunksize=chunk_size):
+                num_documents += 1
+                if "error" in document:
+                    num_errors += 1
+                yield document
+
+        elapsed_time = time.time() - start_time
+        logger.info(
+            "Linked %d documents (%d errors) in %.1f seconds (%.1f docs/sec)",
+            num_documents,
+            num_errors,
+            elapsed_time,
+            num_documents / max(elapsed_time, 1e-9),
+        )
+
+    @staticmethod
+    def _initialize_worker(linker, text_field):
+        global _linker, _text_field
+        _linker = linker
+        _text_field = text_field
+
+    @staticmethod
+    def _link_document(document):
+        text = document.get(_text_field)
+        if isinstance(text, str):
+            document["mentions"] = _linker.link(text)
+        else:
+            document["mentions"] = []
+            document["error"] = f"no text in the field: {_text_field}"
+        return document
+
+
 # global variables used in pool workers
+_linker = _text_field = None
 _dump_db = _tokenizer = _normalizer = _max_mention_length = _name_trie = None
 
 
 class MentionDB(object):
-    def __init__(self, mention_db_file):
+    def __init__(self, mention_db_file, normalization_cache_size=1000000):
         self.mention_db_file = mention_db_file
 
         data = joblib.load(mention_db_file)
@@ -113,16 +230,14 @@ class MentionDB(object):
         self._normalizer = data["normalizer"]
         self._max_mention_length = data["max_mention_length"]
 
+        # tokens follow a Zipfian distribution, so caching the normalized forms avoids most of the normalization cost
+        self._normalize_token = functools.lru_cache(maxsize=normalization_cache_size)(self._normalize_token_uncached)
+
     def __reduce__(self):
         return (self.__class__, (self.mention_db_file,))
 
     def query(self, text_or_tokens):
-        if isinstance(text_or_tokens, str):
-            tokens = self._tokenizer.tokenize(text_or_tokens)
-        else:
-            tokens = text_or_tokens
-        tokens = [self._normalizer.normalize(t.replace(SEP_CHAR, REP_CHAR)) for t in tokens]
-        name = SEP_CHAR.join(tokens)
+        name = self._get_name(text_or_tokens)
         try:
             return [
                 Mention(self._title_trie.restore_key(args[0]), name.replace(SEP_CHAR, " "), None, None, *args[1:])
@@ -131,6 +246,70 @@ class MentionDB(object):
         except KeyError:
             return []
 
+    def query_many(self, texts_or_tokens):
+        """Queries the mentions of multiple texts at once.
+
+        Returns an array of offsets and an array of the title ids, link counts, total link counts, and document
+        counts of the mentions. The mentions of the i-th text are stored in rows offsets[i] to offsets[i + 1].
+        """
+        offsets = np.zeros(len(texts_or_tokens) + 1, dtype=np.int64)
+        records = []
+        for i, text_or_tokens in enumerate(texts_or_tokens):
+            records.extend(self._data_trie.get(self._get_name(text_or_tokens), ()))
+            offsets[i + 1] = len(records)
+
+        return offsets, np.array(records, dtype=np.uint32).reshape(-1, 4)
+
+    def get_title(self, title_id):
+        return self._title_trie.restore_key(int(title_id))
+
+    def detect_mentions(self, text):
+        """Detects the longest non-overlapping mentions in the text.
+
+        Returns the candidate entities of the detected mentions as Mention objects with character-level spans.
+        """
+        tokens = self._tokenizer.tokenize(text)
+        names = [self._normalize_token(t) for t in tokens]
+
+        token_spans = []
+        cur = 0
+        for token in tokens:
+            start = text.find(token, cur)
+            if start == -1:  # the tokenizer may modify the token, e.g., by removing control characters
+                token_spans.append((cur, cur))
+                continue
+            cur = start + len(token)
+            token_spans.append((start, cur))
+
+        ret = []
+        cur = 0
+        for start in range(len(tokens)):
+            if start < cur:
+                continue
+
+            target_text = SEP_CHAR.join(names[start : start + self._max_mention_length])
+            for name in sorted(self._mention_trie.prefixes(target_text), key=len, reverse=True):
+                if name and (len(target_text) == len(name) or target_text[len(name)] == SEP_CHAR):
+                    cur = start + name.count(SEP_CHAR) + 1
+                    char_start = token_spans[start][0]
+                    char_end = token_spans[cur - 1][1]
+                    for args in self._data_trie[name]:
+                        title = self._title_trie.restore_key(args[0])
+                        ret.append(Mention(title, text[char_start:char_end], char_start, char_end, *args[1:]))
+                    break
+
+        return ret
+
+    def _get_name(self, text_or_tokens):
+        if isinstance(text_or_tokens, str):
+            tokens = self._tokenizer.tokenize(text_or_tokens)
+        else:
+            tokens = text_or_tokens
+        return SEP_CHAR.join([self._normalize_token(t) for t in tokens])
+
+    def _normalize_token_uncached(self, token):
+        return self._normalizer.normalize(token.replace(SEP_CHAR, REP_CHAR))
+
     def save(self, out_file):
         joblib.dump(
             dict(
@@ -156,55 +335,53 @@ class MentionDB(object):
         max_mention_length,
         pool_size,
         chunk_size,
+        buffer_size=5000000,
     ):
-        logger.info("Iteration 1/2: Extracting all entity names...")
+        # the counts are aggregated in the workers, spilled to sorted runs on disk, and merged at the end so that
+        # the memory usage does not depend on the size of the dump
+        with tempfile.TemporaryDirectory() as temp_dir:
+            logger.info("Iteration 1/2: Extracting all entity names...")
 
-        name_dict = defaultdict(Counter)
-        with tqdm(total=dump_db.page_size(), mininterval=0.5) as pbar:
             initargs = (dump_db, tokenizer, normalizer, max_mention_length)
-            with closing(Pool(pool_size, initializer=MentionDB._initialize_worker, initargs=initargs)) as pool:
-                for ret in pool.imap_unordered(
-                    MentionDB._extract_name_entity_pairs, dump_db.titles(), chunksize=chunk_size
-                ):
-                    for (name, title) in ret:
-                        name_dict[name][title] += 1
-                    pbar.update()
+            name_entity_runs = MentionDB._count_in_runs(
+                dump_db, MentionDB._count_name_entity_pairs, initargs, pool_size, chunk_size, buffer_size, temp_dir
+            )
+            name_trie = marisa_trie.Trie(name for name, _ in groupby(k[0] for k, _ in _merge_runs(name_entity_runs)))
 
-        logger.info("Iteration 2/2: Counting occurrences of entity names...")
-
-        with tqdm(total=dump_db.page_size(), mininterval=0.5) as pbar:
-            name_doc_counter = Counter()
-            initargs = (dump_db, tokenizer, normalizer, max_mention_length, marisa_trie.Trie(name_dict.keys()))
-            with closing(Pool(pool_size, initializer=MentionDB._initialize_worker, initargs=initargs)) as pool:
-                for names in pool.imap_unordered(
-                    MentionDB._extract_name_occurrences, dump_db.titles(), chunksize=chunk_size
-                ):
-                    name_doc_counter.update(names)
-                    pbar.update()
+            logger.info("Iteration 2/2: Counting occurrences of entity names...")
 
-        logger.info("Building DB...")
+            initargs = (dump_db, tokenizer, normalizer, max_mention_length, name_trie)
+            name_doc_runs = MentionDB._count_in_runs(
+                dump_db, MentionDB._count_name_occurrences, initargs, pool_size, chunk_size, buffer_size, temp_dir
+            )
 
-        titles = frozenset([title for entity_counter in name_dict.values() for title in entity_counter.keys()])
-        title_trie = marisa_trie.Trie(titles)
+            logger.info("Building DB...")
 
-        def item_generator():
-            for (name, entity_counter) in name_dict.items():
-                doc_count = name_doc_counter[name]
-                total_link_count = sum(entity_counter.values())
+            title_trie = marisa_trie.Trie(title for (_, title), _ in _merge_runs(name_entity_runs))
 
-                if doc_count == 0:
-                    continue
+            def item_generator():
+                name_doc_counts = _merge_runs(name_doc_runs)
+                doc_name, doc_count = next(name_doc_counts, (None, 0))
+                for name, items in groupby(_merge_runs(name_entity_runs), key=lambda o: o[0][0]):
+                    while doc_name is not None and doc_name < name:
+                        doc_name, doc_count = next(name_doc_counts, (None, 0))
+                    if doc_name != name:
+                        continue
 
-                link_prob = total_link_count / doc_count
-                if link_prob < min_link_prob:
-                    continue
+                    entity_counts = sorted(((title, count) for (_, title), count in items), key=lambda o: -o[1])
+                    total_link_count = sum(count for _, count in entity_counts)
 
-                for (title, link_count) in entity_counter.most_common()[:max_candidate_size]:
-                    if link_count < min_link_count:
+                    link_prob = total_link_count / doc_count
+                    if link_prob < min_link_prob:
                         continue
-                    yield (name, (title_trie[title], link_count, total_link_count, doc_count))
 
-        data_trie = marisa_trie.RecordTrie("<IIII", item_generator())
+                    for title, link_count in entity_counts[:max_candidate_size]:
+                        if link_count < min_link_count:
+                            continue
+                        yield (name, (title_trie[title], link_count, total_link_count, doc_count))
+
+            data_trie = marisa_trie.RecordTrie("<IIII", item_generator())
+
         mention_trie = marisa_trie.Trie(data_trie.keys())
 
         joblib.dump(
@@ -219,6 +396,26 @@ class MentionDB(object):
             out_file,
         )
 
+    @staticmethod
+    def _count_in_runs(dump_db, count_func, initargs, pool_size, chunk_size, buffer_size, temp_dir):
+        run_files = []
+        buf = Counter()
+        with tqdm(total=dump_db.page_size(), mininterval=0.5) as pbar:
+            with closing(Pool(pool_size, initializer=MentionDB._initialize_worker, initargs=initargs)) as pool:
+                for num_pages, counter in pool.imap_unordered(
+                    count_func, _iterate_chunks(dump_db.titles(), chunk_size)
+                ):
+                    buf.update(counter)
+                    if len(buf) >= buffer_size:
+                        run_files.append(_write_run(buf, temp_dir))
+                        buf = Counter()
+                    pbar.update(num_pages)
+
+        if buf:
+            run_files.append(_write_run(buf, temp_dir))
+
+        return run_files
+
     @staticmethod
     def build_from_p_e_m_file(
         p_e_m_file, dump_db, wiki_mention_db, tokenizer, normalizer, out_file, max_mention_length
@@ -282,6 +479,14 @@ class MentionDB(object):
         _max_mention_length = max_mention_length
         _name_trie = name_trie
 
+    @staticmethod
+    def _count_name_entity_pairs(titles):
+        return len(titles), Counter(pair for title in titles for pair in MentionDB._extract_name_entity_pairs(title))
+
+    @staticmethod
+    def _count_name_occurrences(titles):
+        return len(titles), Counter(name for title in titles for name in MentionDB._extract_name_occurrences(title))
+
     @staticmethod
     def _extract_name_entity_pairs(title):
         ret = []
@@ -306,3 +511,39 @@ class MentionDB(object):
                     if len(target_text) == len(name) or target_text[len(name)] == SEP_CHAR:
                         ret.append(name)
         return frozenset(ret)
+
+
+def _iterate_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _write_run(counter, temp_dir, block_size=100000):
+    """Writes the items of the counter sorted by their keys to a temporary file and returns its path."""
+    fd, run_file = tempfile.mkstemp(dir=temp_dir, suffix=".run")
+    items = sorted(counter.items())
+    with os.fdopen(fd, "wb") as f:
+        for start in range(0, len(items), block_size):
+            pickle.dump(items[start : start + block_size], f, protocol=pickle.HIGHEST_PROTOCOL)
+    return run_file
+
+
+def _read_run(run_file):
+    with open(run_file, "rb") as f:
+        while True:
+            try:
+                items = pickle.load(f)
+            except EOFError:
+                return
+            yield from items
+
+
+def _merge_runs(run_files):
+    """Merges the sorted runs and yields the keys with their summed counts in sorted order."""
+    merged = heapq.merge(*[_read_run(run_file) for run_file in run_files], key=lambda o: o[0])
+    for key, items in groupby(merged, key=lambda o: o[0]):
+        yield key, sum(count for _, count in items)
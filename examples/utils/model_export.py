@@ -0,0 +1,106 @@
+import functools
+import time
+
+import click
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .inference_server import MODEL_INPUT_PADDING_VALUES, create_model_inputs
+
+MODEL_INPUT_NAMES = tuple(MODEL_INPUT_PADDING_VALUES.keys())
+
+
+def model_export_args(func):
+    @click.option("--output-file", type=click.Path())
+    @click.option("--benchmark-batch-size", default=8)
+    @click.option("--benchmark-iterations", default=20)
+    @click.option("--num-threads", default=torch.get_num_threads())
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+class ExportableModel(nn.Module):
+    """Wraps a task model so that it takes the model inputs as positional arguments and returns only the logits."""
+
+    def __init__(self, model):
+        super(ExportableModel, self).__init__()
+        self.model = model
+
+    def forward(
+        self,
+        word_ids,
+        word_segment_ids,
+        word_attention_mask,
+        entity_ids,
+        entity_position_ids,
+        entity_segment_ids,
+        entity_attention_mask,
+    ):
+        outputs = self.model(
+            word_ids,
+            word_segment_ids,
+            word_attention_mask,
+            entity_ids,
+            entity_position_ids,
+            entity_segment_ids,
+            entity_attention_mask,
+        )
+        if isinstance(outputs, tuple):
+            outputs = outputs[0]
+        return outputs
+
+
+def export_model(model, inputs, output_file=None):
+    """Traces the model into TorchScript and optionally saves it.
+
+    The batch and sequence sizes are not fixed in the traced graph, so the exported model accepts inputs of any
+    shape with the same signature.
+    """
+    model.eval()
+    with torch.no_grad():
+        traced_model = torch.jit.trace(ExportableModel(model), tuple(inputs[name] for name in MODEL_INPUT_NAMES))
+
+    if output_file is not None:
+        traced_model.save(output_file)
+
+    return traced_model
+
+
+def benchmark_model(model, inputs, num_iterations, num_warmup_iterations=3):
+    latencies = []
+    with torch.no_grad():
+        for i in range(num_warmup_iterations + num_iterations):
+            start_time = time.perf_counter()
+            model(*[inputs[name] for name in MODEL_INPUT_NAMES])
+            if i >= num_warmup_iterations:
+                latencies.append((time.perf_counter() - start_time) * 1000.0)
+
+    return dict(latency_mean_ms=float(np.mean(latencies)), latency_p50_ms=float(np.percentile(latencies, 50)))
+
+
+def export_and_benchmark(model, features, pad_token_id, output_file, benchmark_batch_size, benchmark_iterations):
+    """Exports the model on CPU, and compares the outputs and latencies of the eager and exported models.
+
+    The model is traced on the first two features, and compared on a batch with a different size so that the
+    parity check also covers the dynamic axes.
+    """
+    model.to("cpu")
+    model.eval()
+    traced_model = export_model(model, create_model_inputs(features[:2], pad_token_id), output_file)
+
+    benchmark_features = [features[i % len(features)] for i in range(benchmark_batch_size)]
+    inputs = create_model_inputs(benchmark_features, pad_token_id)
+    eager_model = ExportableModel(model)
+    with torch.no_grad():
+        eager_outputs = eager_model(*[inputs[name] for name in MODEL_INPUT_NAMES])
+        traced_outputs = traced_model(*[inputs[name] for name in MODEL_INPUT_NAMES])
+
+    return dict(
+        max_abs_diff=float((eager_outputs - traced_outputs).abs().max()),
+        eager=benchmark_model(eager_model, inputs, benchmark_iterations),
+        exported=benchmark_model(traced_model, inputs, benchmark_iterations),
+    )
@@ -0,0 +1,62 @@
+import io
+import logging
+import time
+from argparse import Namespace
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+
+def quantize_model(model):
+    """Returns a copy of the model with dynamic int8 quantization applied to its Linear layers.
+
+    The layers in the entity-aware self-attention, the feed-forward layers, and the task-specific layers are
+    quantized, while the embeddings, the attention output layers, and the pooler are kept in fp32.
+    """
+    module_names = {name for name, module in model.named_modules() if _is_quantization_target(name, module)}
+    return torch.quantization.quantize_dynamic(model.to("cpu"), module_names, dtype=torch.qint8)
+
+
+def compare_quantized_model(args, model, evaluate_fn, eval_sets=("dev", "test")):
+    """Evaluates the model and its quantized version on CPU, and returns their scores, speeds, and sizes.
+
+    `evaluate_fn` is called as `evaluate_fn(args, model, eval_set)` and needs to return a dict of scores.
+    """
+    cpu_args = Namespace(**dict(vars(args), device=torch.device("cpu")))
+    model.to("cpu")
+    models = dict(fp32=model, int8=quantize_model(model))
+
+    results = {}
+    for name, target_model in models.items():
+        results[f"{name}_model_size_mb"] = _get_model_size(target_model) / 1024 / 1024
+        for eval_set in eval_sets:
+            start_time = time.time()
+            scores = evaluate_fn(cpu_args, target_model, eval_set)
+            results[f"{name}_{eval_set}_seconds"] = time.time() - start_time
+            results.update({f"{name}_{eval_set}_{k}": v for k, v in scores.items()})
+
+    for eval_set in eval_sets:
+        results[f"int8_{eval_set}_speedup"] = results[f"fp32_{eval_set}_seconds"] / results[f"int8_{eval_set}_seconds"]
+
+    logger.info("Quantization results: %s", results)
+    return results
+
+
+def _is_quantization_target(name, module):
+    if not isinstance(module, nn.Linear):
+        return False
+    if name.startswith(("embeddings.", "entity_embeddings.", "pooler.")):
+        return False
+    if name.startswith("encoder."):
+        return (
+            ".attention.self." in name or ".intermediate." in name or (".output." in name and ".attention." not in name)
+        )
+    return True
+
+
+def _get_model_size(model):
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell()
@@ -0,0 +1,287 @@
+import functools
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import time
+import traceback
+from argparse import Namespace
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import click
+import torch
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FILE = "results.json"
+SWEEP_INDEX_FILE = "sweep_index.json"
+
+
+@click.group(name="sweep")
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("spec_file", type=click.Path(exists=True))
+@click.option(
+    "--gpu-ids",
+    default="",
+    help="Comma-separated GPU ids, one trial slot per id (repeat an id to run multiple trials on the same GPU)",
+)
+@click.option("--num-cpu-slots", default=1, help="Number of concurrent trials on CPU if no GPU ids are specified")
+@click.option("--max-retries", default=1)
+@click.pass_obj
+def run(common_args, spec_file, gpu_ids, num_cpu_slots, max_retries):
+    """Runs the trials of a hyperparameter sweep specified in a JSON file.
+
+    \b
+    Example of a specification:
+    {
+        "global_args": {"model-file": "luke_large_500k.tar.gz"},
+        "command": ["entity-typing", "run"],
+        "args": {"data-dir": "data/OpenEntity", "fp16": true, "num-train-epochs": 10, "dont-save-model": true},
+        "grid": {"learning-rate": [1e-5, 2e-5], "seed": [10, 11, 12]}
+    }
+
+    Instead of "grid", "random" can be specified as {"num-trials": 10, "seed": 0, "params": {"learning-rate":
+    {"log-uniform": [1e-6, 1e-4]}, "seed": [10, 11, 12]}}. Options with the value true are passed as flags and
+    options with the value false or null are omitted.
+    """
+    with open(spec_file) as f:
+        spec = json.load(f)
+
+    if gpu_ids:
+        slots = gpu_ids.split(",")
+    else:
+        slots = [None] * num_cpu_slots
+
+    run_sweep(spec, common_args["output_dir"], slots, max_retries)
+
+
+def run_sweep(spec, output_dir, slots, max_retries=1):
+    """Runs the trials of a sweep concurrently, one trial per slot at a time.
+
+    Each slot is a worker process that runs the trials on CPU (slot `None`) or on the GPU with the given id, and keeps
+    the model archive loaded across the trials. Trials whose output directory already contains a results.json are
+    skipped, and failed trials are retried up to `max_retries` times. The status of the trials is written to
+    sweep_index.json in `output_dir`.
+    """
+    trials = generate_trials(spec, output_dir)
+    index = {trial["name"]: dict(trial, status="pending", attempts=0) for trial in trials}
+
+    for entry in index.values():
+        if os.path.exists(os.path.join(entry["output_dir"], RESULTS_FILE)):
+            entry["status"] = "completed"
+    pending = [name for name, entry in index.items() if entry["status"] == "pending"]
+    logger.info("Running %d trials (%d already completed)", len(pending), len(index) - len(pending))
+    _write_sweep_index(index, output_dir)
+
+    slot_queue = multiprocessing.get_context("spawn").Queue()
+    for slot in slots:
+        slot_queue.put(slot)
+
+    with ProcessPoolExecutor(
+        max_workers=len(slots),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(slot_queue,),
+    ) as executor:
+        futures = {}
+
+        def submit(name):
+            entry = index[name]
+            entry["status"] = "running"
+            entry["attempts"] += 1
+            argv = build_trial_argv(spec, entry["params"], entry["output_dir"], use_gpu=slots[0] is not None)
+            futures[executor.submit(_run_trial, argv)] = name
+
+        for name in pending:
+            submit(name)
+
+        while futures:
+            done, _ = wait(list(futures.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                entry = index[name]
+                entry.pop("error", None)
+                try:
+                    entry.update(future.result())
+                    can_retry = True
+                except BrokenProcessPool:
+                    # the pool cannot run new trials after one of its workers died
+                    entry.update(status="failed", error="The worker process terminated abruptly")
+                    can_retry = False
+
+                if entry["status"] == "failed":
+                    logger.warning("Trial %s failed (attempt %d): %s", name, entry["attempts"], entry["error"])
+                    if can_retry and entry["attempts"] <= max_retries:
+                        submit(name)
+                else:
+                    logger.info("Trial %s completed in %.1f seconds", name, entry["seconds"])
+                _write_sweep_index(index, output_dir)
+
+    return index
+
+
+def sweep_args(func):
+    @click.option(
+        "--sweep-param",
+        "sweep_params",
+        multiple=True,
+        required=True,
+        help="Option of the run command and its comma-separated values, e.g., learning-rate=1e-5,2e-5",
+    )
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def run_in_process_sweep(args, run_command, trial_fn):
+    """Runs `trial_fn(trial_args)` for each combination of the values given by --sweep-param in the current process.
+
+    `args` contains the options of `run_command`, which are used to parse the swept values, and each trial is run with
+    a copy of `args` whose output directory is a subdirectory of the sweep's output directory. The model weights and
+    any cached features in `args` are therefore shared by the trials. Trials whose output directory already contains a
+    results.json are skipped, and the status of the trials is written to sweep_index.json.
+    """
+    params = {param.name: param for param in run_command.params}
+    grid = {}
+    for sweep_param in args.sweep_params:
+        name, values = sweep_param.split("=", 1)
+        param = params.get(name.replace("-", "_"))
+        if param is None:
+            raise click.BadParameter(f"Unknown option: {name}", param_hint="--sweep-param")
+        grid[name] = [param.type.convert(value, param, None) for value in values.split(",")]
+
+    index = {}
+    for trial in generate_trials(dict(grid=grid), args.output_dir):
+        entry = index[trial["name"]] = dict(trial, status="pending", attempts=0)
+        if os.path.exists(os.path.join(trial["output_dir"], RESULTS_FILE)):
+            entry["status"] = "completed"
+            logger.info("Skipping trial %s as it is already completed", trial["name"])
+            continue
+
+        os.makedirs(trial["output_dir"], exist_ok=True)
+        trial_args = Namespace(**vars(args))
+        trial_args.output_dir = trial["output_dir"]
+        for name, value in trial["params"].items():
+            setattr(trial_args, name.replace("-", "_"), value)
+
+        entry.update(status="running", attempts=1)
+        _write_sweep_index(index, args.output_dir)
+        start_time = time.time()
+        try:
+            trial_fn(trial_args)
+            entry["status"] = "completed"
+        except Exception:
+            logger.exception("Trial %s failed", trial["name"])
+            entry.update(status="failed", error=traceback.format_exc(limit=3))
+        entry["seconds"] = time.time() - start_time
+        logger.info("Trial %s finished in %.1f seconds", trial["name"], entry["seconds"])
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    _write_sweep_index(index, args.output_dir)
+    return index
+
+
+def generate_trials(spec, output_dir):
+    """Expands the grid or random specification of a sweep into a list of trials."""
+    if "grid" in spec:
+        names = list(spec["grid"].keys())
+        param_list = [dict(zip(names, values)) for values in itertools.product(*[spec["grid"][n] for n in names])]
+    elif "random" in spec:
+        rnd = random.Random(spec["random"].get("seed", 0))
+        params = spec["random"]["params"]
+        param_list = [
+            {name: _sample_value(rnd, dist) for name, dist in params.items()}
+            for _ in range(spec["random"]["num-trials"])
+        ]
+    else:
+        raise ValueError("The sweep specification needs to contain either 'grid' or 'random'")
+
+    trials = []
+    for params in param_list:
+        name = spec.get("name-prefix", "") + "_".join(
+            f"{key.replace('-', '_')}_{_format_value(value)}" for key, value in params.items()
+        )
+        trials.append(dict(name=name, params=params, output_dir=os.path.join(output_dir, name)))
+    return trials
+
+
+def build_trial_argv(spec, params, output_dir, use_gpu):
+    argv = _to_options(spec.get("global_args", {}))
+    argv += [f"--output-dir={output_dir}", f"--num-gpus={1 if use_gpu else 0}"]
+    argv += list(spec["command"])
+    argv += _to_options(dict(spec.get("args", {}), **params))
+    return argv
+
+
+def _to_options(args):
+    options = []
+    for name, value in args.items():
+        if value is True:
+            options.append(f"--{name}")
+        elif value is not False and value is not None:
+            options.append(f"--{name}={value}")
+    return options
+
+
+def _sample_value(rnd, dist):
+    if isinstance(dist, list):
+        return rnd.choice(dist)
+    # the sampled values are rounded to four significant digits to keep the trial names short
+    if "uniform" in dist:
+        return float(f"{rnd.uniform(*dist['uniform']):.4g}")
+    if "log-uniform" in dist:
+        low, high = dist["log-uniform"]
+        return float(f"{10 ** rnd.uniform(math.log10(low), math.log10(high)):.4g}")
+    if "int-uniform" in dist:
+        return rnd.randint(*dist["int-uniform"])
+    raise ValueError(f"Invalid distribution: {dist}")
+
+
+def _format_value(value):
+    return str(value).replace(os.sep, "_")
+
+
+def _write_sweep_index(index, output_dir):
+    tmp_file = os.path.join(output_dir, SWEEP_INDEX_FILE + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(list(index.values()), f, indent=2)
+    os.replace(tmp_file, os.path.join(output_dir, SWEEP_INDEX_FILE))
+
+
+def _init_worker(slot_queue):
+    slot = slot_queue.get()
+    if slot is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(slot)
+
+
+def _run_trial(argv):
+    # imported here as examples/cli.py imports this module
+    from ..cli import cli as examples_cli
+
+    start_time = time.time()
+    ret = dict(status="completed")
+    try:
+        examples_cli.main(args=argv, prog_name="examples.cli", standalone_mode=False)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            ret = dict(status="failed", error=traceback.format_exc(limit=3))
+    except Exception:
+        ret = dict(status="failed", error=traceback.format_exc(limit=3))
+    finally:
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    ret["seconds"] = time.time() - start_time
+    return ret
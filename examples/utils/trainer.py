@@ -8,6 +8,8 @@ import torch
 from tqdm import tqdm
 from transformers import WEIGHTS_NAME, AdamW, get_constant_schedule_with_warmup, get_linear_schedule_with_warmup
 
+from luke.utils.precision import FP16_BACKENDS, create_precision_backend
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,9 +26,13 @@ def trainer_args(func):
     @click.option("--warmup-proportion", default=0.06)
     @click.option("--gradient-accumulation-steps", default=1)
     @click.option("--fp16", is_flag=True)
+    @click.option(
+        "--fp16-backend", default="auto", type=click.Choice(FP16_BACKENDS), help="native requires torch>=1.10"
+    )
     @click.option("--fp16-opt-level", default="O2")
     @click.option("--fp16-min-loss-scale", default=1)
     @click.option("--fp16-max-loss-scale", default=4)
+    @click.option("--bf16", is_flag=True, help="Uses bfloat16 autocast (e.g., on CPU; requires torch>=1.10)")
     @click.option("--save-steps", default=0)
     @click.option("--train-frac-size", default=1.0, type=float)
     @click.option("--save-model/--dont-save-model", default=True)
@@ -52,16 +58,8 @@ class Trainer(object):
         model = self.model
         optimizer = self.optimizer
 
-        if self.args.fp16:
-            from apex import amp
-
-            model, optimizer = amp.initialize(
-                model,
-                optimizer,
-                opt_level=self.args.fp16_opt_level,
-                min_loss_scale=self.args.fp16_min_loss_scale,
-                max_loss_scale=self.args.fp16_max_loss_scale,
-            )
+        precision = create_precision_backend(self.args, self.args.device)
+        model, optimizer = precision.initialize(model, optimizer)
 
         if self.args.local_rank != -1:
             model = torch.nn.parallel.DistributedDataParallel(
@@ -94,29 +92,23 @@ class Trainer(object):
             while True:
                 for step, batch in enumerate(self.dataloader):
                     inputs = {k: v.to(self.args.device) for k, v in self._create_model_arguments(batch).items()}
-                    outputs = model(**inputs)
+                    with precision.autocast():
+                        outputs = model(**inputs)
                     loss = outputs[0]
                     if self.args.gradient_accumulation_steps > 1:
                         loss = loss / self.args.gradient_accumulation_steps
 
                     with maybe_no_sync(step):
-                        if self.args.fp16:
-                            with amp.scale_loss(loss, optimizer) as scaled_loss:
-                                scaled_loss.backward()
-                        else:
-                            loss.backward()
+                        precision.backward(loss, optimizer)
 
                     tr_loss += loss.item()
                     training_loss.append(loss.item())
 
                     if (step + 1) % self.args.gradient_accumulation_steps == 0:
                         if self.args.max_grad_norm != 0.0:
-                            if self.args.fp16:
-                                torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), self.args.max_grad_norm)
-                            else:
-                                torch.nn.utils.clip_grad_norm_(model.parameters(), self.args.max_grad_norm)
+                            precision.clip_grad_norm(model, optimizer, self.args.max_grad_norm)
 
-                        self.optimizer.step()
+                        precision.step(optimizer)
                         self.scheduler.step()
                         model.zero_grad()
 
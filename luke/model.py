@@ -348,6 +348,8 @@ class EntityAwareEncoder(nn.Module):
     def __init__(self, config):
         super(EntityAwareEncoder, self).__init__()
         self.layer = nn.ModuleList([EntityAwareLayer(config) for _ in range(config.num_hidden_layers)])
+        # called with the index and the attention probabilities of each layer (see luke.utils.attention_statistics)
+        self.attention_hook = None
 
     def forward(self, word_hidden_states, entity_hidden_states, attention_mask):
         
@@ -358,6 +360,8 @@ class EntityAwareEncoder(nn.Module):
             word_hidden_states, entity_hidden_states, attention_probs = layer_module( # Added attention_probs visualization
                 word_hidden_states, entity_hidden_states, attention_mask
             )
+            if self.attention_hook is not None:
+                self.attention_hook(i, attention_probs)
             attention_probs_all.append(attention_probs)
 
         return word_hidden_states, entity_hidden_states, attention_probs_all
@@ -26,6 +26,7 @@ from luke.pretraining.batch_generator import LukePretrainingBatchGenerator, Mult
 from luke.pretraining.dataset import WikipediaPretrainingDataset
 from luke.pretraining.model import LukePretrainingModel
 from luke.utils.model_utils import ENTITY_VOCAB_FILE
+from luke.utils.precision import FP16_BACKENDS, create_precision_backend
 
 logger = logging.getLogger(__name__)
 
@@ -62,10 +63,12 @@ logger = logging.getLogger(__name__)
 @click.option("--num-epochs", default=20)
 @click.option("--global-step", default=0)
 @click.option("--fp16", is_flag=True)
+@click.option("--fp16-backend", default="auto", type=click.Choice(FP16_BACKENDS), help="native requires torch>=1.10")
 @click.option("--fp16-opt-level", default="O2", type=click.Choice(["O1", "O2"]))
 @click.option("--fp16-master-weights/--fp16-no-master-weights", default=True)
 @click.option("--fp16-min-loss-scale", default=1)
 @click.option("--fp16-max-loss-scale", default=4)
+@click.option("--bf16", is_flag=True, help="Uses bfloat16 autocast (e.g., with --cpu; requires torch>=1.10)")
 @click.option("--local-rank", "--local_rank", default=-1)
 @click.option("--num-nodes", default=1)
 @click.option("--node-rank", default=0)
@@ -108,6 +111,9 @@ def resume_pretraining(output_dir: str, **kwargs):
         args["unmasked_entity_prob"] = 0.0
         args["random_entity_prob"] = 0.0
         args["mask_words_in_entity_span"] = False
+    if "fp16_backend" not in args:
+        args["fp16_backend"] = "auto"
+        args["bf16"] = False
 
     step_metadata_file = sorted(
         [f for f in os.listdir(output_dir) if f.startswith("metadata_") and f.endswith(".json")]
@@ -245,26 +251,8 @@ def run_pretraining(args):
         grad_avg_device=torch.device("cpu") if args.grad_avg_on_cpu else device,
     )
 
-    if args.fp16:
-        from apex import amp
-
-        if args.fp16_opt_level == "O2":
-            model, optimizer = amp.initialize(
-                model,
-                optimizer,
-                opt_level=args.fp16_opt_level,
-                master_weights=args.fp16_master_weights,
-                min_loss_scale=args.fp16_min_loss_scale,
-                max_loss_scale=args.fp16_max_loss_scale,
-            )
-        else:
-            model, optimizer = amp.initialize(
-                model,
-                optimizer,
-                opt_level=args.fp16_opt_level,
-                min_loss_scale=args.fp16_min_loss_scale,
-                max_loss_scale=args.fp16_max_loss_scale,
-            )
+    precision = create_precision_backend(args, device)
+    model, optimizer = precision.initialize(model, optimizer)
 
     if args.model_file is None:
         bert_model = AutoModelForPreTraining.from_pretrained(args.bert_model_name)
@@ -279,7 +267,7 @@ def run_pretraining(args):
         optimizer.load_state_dict(torch.load(args.optimizer_file, map_location="cpu"))
 
     if args.amp_file is not None:
-        amp.load_state_dict(torch.load(args.amp_file, map_location="cpu"))
+        precision.load_state_dict(torch.load(args.amp_file, map_location="cpu"))
 
     if args.lr_schedule == "warmup_constant":
         scheduler = get_constant_schedule_with_warmup(optimizer, num_warmup_steps=args.warmup_steps)
@@ -329,9 +317,10 @@ def run_pretraining(args):
         metadata = dict(
             global_step=global_step, model_file=model_file, optimizer_file=optimizer_file, scheduler_file=scheduler_file
         )
-        if args.fp16:
+        amp_state_dict = precision.state_dict()
+        if amp_state_dict is not None:
             amp_file = f"amp_{suffix}.bin"
-            torch.save(amp.state_dict(), os.path.join(args.output_dir, amp_file))
+            torch.save(amp_state_dict, os.path.join(args.output_dir, amp_file))
             metadata["amp_file"] = amp_file
         with open(os.path.join(args.output_dir, f"metadata_{suffix}.json"), "w") as f:
             json.dump(metadata, f, indent=2, sort_keys=True)
@@ -350,7 +339,8 @@ def run_pretraining(args):
     for batch in batch_generator.generate_batches():
         try:
             batch = {k: torch.from_numpy(v).to(device) for k, v in batch.items()}
-            result = model(**batch)
+            with precision.autocast():
+                result = model(**batch)
             loss = result["loss"]
             result = {k: v.to("cpu").detach().numpy() for k, v in result.items()}
 
@@ -368,11 +358,7 @@ def run_pretraining(args):
                     return contextlib.ExitStack()
 
             with maybe_no_sync():
-                if args.fp16:
-                    with amp.scale_loss(loss, optimizer) as scaled_loss:
-                        scaled_loss.backward()
-                else:
-                    loss.backward()
+                precision.backward(loss, optimizer)
 
         except RuntimeError:
             if prev_error:
@@ -392,11 +378,8 @@ def run_pretraining(args):
 
         if accumulation_count == args.gradient_accumulation_steps:
             if args.max_grad_norm != 0.0:
-                if args.fp16:
-                    torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), args.max_grad_norm)
-                else:
-                    torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
-            optimizer.step()
+                precision.clip_grad_norm(model, optimizer, args.max_grad_norm)
+            precision.step(optimizer)
             scheduler.step()
             model.zero_grad()
             accumulation_count = 0
@@ -0,0 +1,102 @@
+import contextlib
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+
+class AttentionStatistics(object):
+    """Aggregates the attention probabilities of EntityAwareEncoder on the device during the forward pass.
+
+    For each example, the following statistics are computed for each layer and head, so that the full attention maps
+    are never copied from the device or stored:
+
+    * `bin_means` (num_examples, num_layers, num_heads, num_bins + 1): the mean attention from the query entity (the
+      [MASK] entity in entity typing) to the word tokens divided into `num_bins` consecutive bins, and to the query
+      entity itself in the last column. The bins are the same as those of `output_bin_ranges` in
+      visual_attention/tests/visualization_attention_all_sentence_bins.py: they have floor(num_tokens / num_bins)
+      tokens each, and the last one also contains the remaining tokens. The bins are only meaningful for the examples
+      whose `num_tokens` is at least `num_bins`.
+    * `pair_attention` (num_examples, num_pairs, num_layers, num_heads): the attention from the query position to the
+      key position of each token pair passed to `capture`, or NaN if a position is -1.
+    * `num_tokens` (num_examples,): the number of word tokens of each example.
+    """
+
+    def __init__(self, num_bins: int = 5, query_entity_index: int = 0):
+        self.num_bins = num_bins
+        self.query_entity_index = query_entity_index
+
+        self._results = {"bin_means": [], "pair_attention": [], "num_tokens": []}
+        self._batch = None
+
+    @contextlib.contextmanager
+    def capture(self, encoder, word_attention_mask: torch.Tensor, token_pairs: Optional[torch.Tensor] = None):
+        """Computes the statistics of the forward passes of `encoder` run in the context.
+
+        `token_pairs` is a tensor of shape (batch_size, num_pairs, 2) with the (query, key) positions in the
+        concatenated word and entity sequence.
+        """
+        word_size = word_attention_mask.size(1)
+        num_tokens = word_attention_mask.sum(dim=1)
+        self._batch = dict(
+            num_tokens=num_tokens,
+            word_size=word_size,
+            bin_weights=None,
+            query_position=word_size + self.query_entity_index,
+            token_pairs=token_pairs,
+            bin_means=[],
+            pair_attention=[],
+        )
+
+        encoder.attention_hook = self
+        try:
+            yield self
+        finally:
+            encoder.attention_hook = None
+
+        batch, self._batch = self._batch, None
+        if batch["bin_means"]:
+            self._results["bin_means"].append(torch.stack(batch["bin_means"], dim=1).float().cpu().numpy())
+            self._results["num_tokens"].append(num_tokens.cpu().numpy())
+        if batch["pair_attention"]:
+            self._results["pair_attention"].append(torch.stack(batch["pair_attention"], dim=2).float().cpu().numpy())
+
+    def __call__(self, layer_index: int, attention_probs: torch.Tensor):
+        # attention_probs: (batch_size, num_heads, seq_size, seq_size)
+        batch = self._batch
+        if batch["bin_weights"] is None:
+            batch["bin_weights"] = self._create_bin_weights(
+                batch["num_tokens"], batch["word_size"], attention_probs.size(-1)
+            )
+        query_attention = attention_probs[:, :, batch["query_position"], :]
+        batch["bin_means"].append(torch.bmm(query_attention, batch["bin_weights"].to(query_attention.dtype)))
+
+        token_pairs = batch["token_pairs"]
+        if token_pairs is not None:
+            batch_index = torch.arange(attention_probs.size(0), device=attention_probs.device).unsqueeze(1)
+            positions = token_pairs.clamp(min=0)
+            # (batch_size, num_pairs, num_heads)
+            pair_attention = attention_probs[batch_index, :, positions[..., 0], positions[..., 1]]
+            valid = (token_pairs >= 0).all(dim=-1, keepdim=True)
+            batch["pair_attention"].append(torch.where(valid, pair_attention, torch.full_like(pair_attention, np.nan)))
+
+    def results(self) -> Dict[str, np.ndarray]:
+        return {name: np.concatenate(arrays) for name, arrays in self._results.items() if arrays}
+
+    def save(self, output_file: str):
+        np.savez(output_file, **self.results())
+
+    def _create_bin_weights(self, num_tokens: torch.Tensor, word_size: int, seq_size: int) -> torch.Tensor:
+        """Returns a tensor of shape (batch_size, seq_size, num_bins + 1) that averages the attention in each bin."""
+        device = num_tokens.device
+        bin_size = (num_tokens // self.num_bins).clamp(min=1)
+        positions = torch.arange(word_size, device=device).unsqueeze(0)
+        bin_index = torch.min(positions // bin_size.unsqueeze(1), torch.tensor(self.num_bins - 1, device=device))
+        bin_index = bin_index.masked_fill(positions >= num_tokens.unsqueeze(1), -1)
+
+        weights = torch.zeros(len(num_tokens), seq_size, self.num_bins + 1, device=device)
+        weights[:, :word_size, : self.num_bins] = (
+            bin_index.unsqueeze(2) == torch.arange(self.num_bins, device=device)
+        ).float()
+        weights[:, word_size + self.query_entity_index, self.num_bins] = 1.0
+        return weights / weights.sum(dim=1, keepdim=True).clamp(min=1.0)
@@ -0,0 +1,88 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+def one_hot_encoding(values, add_reject: bool = False) -> np.ndarray:
+    """Converts logits or labels of shape (n_examples, n_labels) to a 0/1 matrix by thresholding them at zero."""
+    one_hot = (np.asarray(values) > 0).astype(np.int64)
+    if add_reject:
+        one_hot = add_reject_class(one_hot)
+    return one_hot
+
+
+def add_reject_class(one_hot: np.ndarray) -> np.ndarray:
+    """Appends a column that is one for the examples without any positive label."""
+    reject = (one_hot.sum(axis=1) == 0).astype(one_hot.dtype)
+    return np.concatenate([one_hot, reject[:, None]], axis=1)
+
+
+def split_multi_single(y_true: np.ndarray, y_pred: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Splits the examples into those with at most one true and one predicted label, and the others."""
+    single = (y_true.sum(axis=1) <= 1) & (y_pred.sum(axis=1) <= 1)
+    return y_true[single], y_pred[single], y_true[~single], y_pred[~single]
+
+
+def logit2prob(logits) -> np.ndarray:
+    """Converts logits into probabilities using the sigmoid function."""
+    logits = np.asarray(logits, dtype=np.float64)
+    return np.exp(-np.logaddexp(0.0, -logits))
+
+
+def precision_recall_f1(y_true: np.ndarray, y_pred: np.ndarray, average: str = "micro") -> Dict[str, float]:
+    """Computes the precision, recall, and F1 score of 0/1 matrices of shape (n_examples, n_labels).
+
+    With `average="micro"`, the scores are computed from the counts over all labels, and with `average="macro"`, they
+    are computed for each label and then averaged.
+    """
+    y_true = np.asarray(y_true) > 0
+    y_pred = np.asarray(y_pred) > 0
+    if average == "micro":
+        axis = None
+    elif average == "macro":
+        axis = 0
+    else:
+        raise ValueError(f"Invalid average: {average}")
+
+    num_correct = (y_true & y_pred).sum(axis=axis)
+    num_predicted = y_pred.sum(axis=axis)
+    num_gold = y_true.sum(axis=axis)
+
+    precision = _safe_divide(num_correct, num_predicted)
+    recall = _safe_divide(num_correct, num_gold)
+    f1 = _safe_divide(2 * precision * recall, precision + recall)
+
+    return dict(precision=float(np.mean(precision)), recall=float(np.mean(recall)), f1=float(np.mean(f1)))
+
+
+def calibration_bins(
+    y_true, y_prob, n_bins: int = 10, normalize: bool = False
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Computes the fraction of positives, the mean predicted probability, and the number of examples of the non-empty
+    bins obtained by dividing [0, 1] into `n_bins` bins of equal width.
+
+    The bins are the same as the ones used by `sklearn.calibration.calibration_curve` with the uniform strategy.
+    """
+    y_true = np.asarray(y_true, dtype=np.float64).ravel()
+    y_prob = np.asarray(y_prob, dtype=np.float64).ravel()
+    if normalize:
+        y_prob = (y_prob - y_prob.min()) / (y_prob.max() - y_prob.min())
+    elif y_prob.min() < 0 or y_prob.max() > 1:
+        raise ValueError("y_prob has values outside [0, 1] and normalize is set to False")
+
+    # a probability on a bin edge belongs to the lower bin as in calibration_curve
+    bins = np.linspace(0.0, 1.0, n_bins + 1)
+    bin_ids = np.searchsorted(bins[1:-1], y_prob)
+
+    bin_sums = np.bincount(bin_ids, weights=y_prob, minlength=n_bins)
+    bin_true = np.bincount(bin_ids, weights=y_true, minlength=n_bins)
+    bin_total = np.bincount(bin_ids, minlength=n_bins)
+
+    nonzero = bin_total != 0
+    return bin_true[nonzero] / bin_total[nonzero], bin_sums[nonzero] / bin_total[nonzero], bin_total[nonzero]
+
+
+def _safe_divide(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
@@ -0,0 +1,299 @@
+import contextlib
+import json
+import logging
+import re
+import time
+
+import click
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+FP16_BACKENDS = ("auto", "apex", "native")
+
+# torch.autocast, which is used by the native fp16 and the bf16 backends, was added in PyTorch 1.10
+NATIVE_AMP_MIN_TORCH_VERSION = (1, 10)
+
+# the key of the state of GradScaler in the amp files, which also contain the loss scale in the format of apex
+NATIVE_SCALER_KEY = "native_loss_scaler"
+
+
+def create_precision_backend(args, device):
+    """Returns the precision backend selected by `args.fp16`, `args.fp16_backend`, and `args.bf16`.
+
+    With --fp16, the "auto" backend uses apex if it is installed (as before the native backend was added), and the
+    native autocast and GradScaler otherwise if the installed PyTorch supports them.
+    """
+    bf16 = getattr(args, "bf16", False)
+    if bf16 and args.fp16:
+        raise ValueError("--fp16 and --bf16 cannot be used together")
+    if not bf16 and not args.fp16:
+        return PrecisionBackend()
+
+    native_amp_available = is_native_amp_available()
+    fp16_backend = getattr(args, "fp16_backend", "auto")
+    if args.fp16 and fp16_backend == "auto":
+        # without native AMP, the apex backend raises an ImportError if apex is not installed either
+        fp16_backend = "native" if native_amp_available and not _is_apex_available() else "apex"
+    if (bf16 or fp16_backend == "native") and not native_amp_available:
+        raise ValueError(f"native fp16/bf16 need torch>=1.10 (found torch {torch.__version__})")
+
+    if bf16:
+        return BFloat16Backend(device)
+
+    if fp16_backend == "apex":
+        return ApexBackend(
+            opt_level=args.fp16_opt_level,
+            min_loss_scale=args.fp16_min_loss_scale,
+            max_loss_scale=args.fp16_max_loss_scale,
+            master_weights=getattr(args, "fp16_master_weights", None),
+        )
+    return NativeAmpBackend(device, min_loss_scale=args.fp16_min_loss_scale, max_loss_scale=args.fp16_max_loss_scale)
+
+
+class PrecisionBackend(object):
+    """Runs the training in full precision. The subclasses implement the mixed precision training."""
+
+    name = "fp32"
+
+    def initialize(self, model, optimizer):
+        return model, optimizer
+
+    def autocast(self):
+        return contextlib.ExitStack()
+
+    def backward(self, loss, optimizer):
+        loss.backward()
+
+    def clip_grad_norm(self, model, optimizer, max_grad_norm):
+        torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
+
+    def step(self, optimizer):
+        optimizer.step()
+
+    def state_dict(self):
+        """Returns the state saved in the amp file of a checkpoint, or None if there is no state."""
+        return None
+
+    def load_state_dict(self, state_dict):
+        logger.warning("The amp file is ignored with the %s precision", self.name)
+
+
+class ApexBackend(PrecisionBackend):
+    name = "apex"
+
+    def __init__(self, opt_level="O2", min_loss_scale=1, max_loss_scale=4, master_weights=None):
+        from apex import amp
+
+        self.amp = amp
+        self.opt_level = opt_level
+        self.min_loss_scale = min_loss_scale
+        self.max_loss_scale = max_loss_scale
+        self.master_weights = master_weights
+
+    def initialize(self, model, optimizer):
+        kwargs = dict(opt_level=self.opt_level, min_loss_scale=self.min_loss_scale, max_loss_scale=self.max_loss_scale)
+        if self.opt_level == "O2" and self.master_weights is not None:
+            kwargs["master_weights"] = self.master_weights
+        return self.amp.initialize(model, optimizer, **kwargs)
+
+    def backward(self, loss, optimizer):
+        with self.amp.scale_loss(loss, optimizer) as scaled_loss:
+            scaled_loss.backward()
+
+    def clip_grad_norm(self, model, optimizer, max_grad_norm):
+        torch.nn.utils.clip_grad_norm_(self.amp.master_params(optimizer), max_grad_norm)
+
+    def state_dict(self):
+        return self.amp.state_dict()
+
+    def load_state_dict(self, state_dict):
+        # amp files written by the native backend also contain the state of GradScaler
+        self.amp.load_state_dict({k: v for k, v in state_dict.items() if k.startswith("loss_scaler")})
+
+
+class NativeAmpBackend(PrecisionBackend):
+    """Runs the forward pass in float16 using autocast and scales the loss using GradScaler.
+
+    The loss scale is kept between `min_loss_scale` and `max_loss_scale` as in apex.
+    """
+
+    name = "native"
+
+    def __init__(self, device, min_loss_scale=1, max_loss_scale=2.0**24):
+        if device.type != "cuda":
+            raise ValueError("The native fp16 backend requires CUDA (use --bf16 on CPU)")
+        self.min_loss_scale = float(min_loss_scale)
+        self.max_loss_scale = float(max_loss_scale)
+
+        init_scale = min(2.0**16, self.max_loss_scale)
+        if hasattr(torch, "amp") and hasattr(torch.amp, "GradScaler"):  # torch.cuda.amp.GradScaler is deprecated
+            self.scaler = torch.amp.GradScaler("cuda", init_scale=init_scale)
+        else:
+            self.scaler = torch.cuda.amp.GradScaler(init_scale=init_scale)
+
+    def autocast(self):
+        return torch.autocast(device_type="cuda", dtype=torch.float16)
+
+    def backward(self, loss, optimizer):
+        self.scaler.scale(loss).backward()
+
+    def clip_grad_norm(self, model, optimizer, max_grad_norm):
+        self.scaler.unscale_(optimizer)
+        torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
+
+    def step(self, optimizer):
+        self.scaler.step(optimizer)
+        self.scaler.update()
+
+        scale = self.scaler.get_scale()
+        if not self.min_loss_scale <= scale <= self.max_loss_scale:
+            self.scaler.update(min(max(scale, self.min_loss_scale), self.max_loss_scale))
+
+    def state_dict(self):
+        state_dict = self.scaler.state_dict()
+        # the loss scale is also stored in the format of apex so that the checkpoint can be resumed with apex
+        return {
+            "loss_scaler0": {"loss_scale": state_dict["scale"], "unskipped": state_dict["_growth_tracker"]},
+            NATIVE_SCALER_KEY: state_dict,
+        }
+
+    def load_state_dict(self, state_dict):
+        if NATIVE_SCALER_KEY in state_dict:
+            self.scaler.load_state_dict(state_dict[NATIVE_SCALER_KEY])
+        else:
+            # an amp file written by apex
+            scaler_state_dict = self.scaler.state_dict()
+            scaler_state_dict["scale"] = float(state_dict["loss_scaler0"]["loss_scale"])
+            scaler_state_dict["_growth_tracker"] = int(state_dict["loss_scaler0"]["unskipped"])
+            self.scaler.load_state_dict(scaler_state_dict)
+
+
+class BFloat16Backend(PrecisionBackend):
+    """Runs the forward pass in bfloat16 using autocast on CPU or CUDA. The loss does not need to be scaled."""
+
+    name = "bf16"
+
+    def __init__(self, device):
+        self.device_type = device.type
+
+    def autocast(self):
+        return torch.autocast(device_type=self.device_type, dtype=torch.bfloat16)
+
+
+def is_native_amp_available():
+    """Returns whether the installed PyTorch provides torch.autocast."""
+    version = tuple(int(v) for v in re.findall(r"\d+", torch.__version__)[:2])
+    return version >= NATIVE_AMP_MIN_TORCH_VERSION
+
+
+def is_cpu_bf16_supported():
+    """Returns whether the CPU has native bfloat16 instructions (e.g., AVX512-BF16 or AMX), or None if unknown."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return None
+
+
+def benchmark_precision(model, inputs, backend, num_iterations, num_warmup_iterations=2):
+    """Returns the throughput of the training steps of `model`, whose first output is used as the loss."""
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-5)
+    model, optimizer = backend.initialize(model, optimizer)
+    model.train()
+
+    batch_size = next(iter(inputs.values())).size(0)
+    latencies = []
+    for i in range(num_warmup_iterations + num_iterations):
+        start_time = time.perf_counter()
+        with backend.autocast():
+            loss = model(**inputs)[0].float().mean()
+        backend.backward(loss, optimizer)
+        backend.step(optimizer)
+        optimizer.zero_grad()
+        if i >= num_warmup_iterations:
+            latencies.append(time.perf_counter() - start_time)
+
+    return dict(
+        precision=backend.name,
+        step_time_ms=float(np.mean(latencies) * 1000.0),
+        examples_per_sec=float(batch_size / np.mean(latencies)),
+    )
+
+
+@click.command()
+@click.option("--hidden-size", default=768)
+@click.option("--num-hidden-layers", default=12)
+@click.option("--num-attention-heads", default=12)
+@click.option("--batch-size", default=8)
+@click.option("--seq-length", default=128)
+@click.option("--entity-length", default=16)
+@click.option("--iterations", default=10)
+@click.option("--num-threads", default=torch.get_num_threads())
+@click.option("--output-file", type=click.Path())
+def benchmark_cpu_precision(
+    hidden_size: int,
+    num_hidden_layers: int,
+    num_attention_heads: int,
+    batch_size: int,
+    seq_length: int,
+    entity_length: int,
+    iterations: int,
+    num_threads: int,
+    output_file: str,
+):
+    """Compares the training throughput of a randomly initialized LUKE model on CPU in fp32 and bf16.
+
+    bf16 is only faster on CPUs with native bfloat16 instructions; it is emulated (and usually slower) otherwise.
+    """
+    from luke.model import LukeConfig, LukeEntityAwareAttentionModel
+
+    if not is_native_amp_available():
+        raise click.ClickException(f"bf16 needs torch>=1.10 (found torch {torch.__version__})")
+
+    torch.set_num_threads(num_threads)
+    device = torch.device("cpu")
+    config = LukeConfig(
+        vocab_size=1000,
+        entity_vocab_size=1000,
+        bert_model_name="bert-base-uncased",
+        entity_emb_size=hidden_size,
+        hidden_size=hidden_size,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=num_attention_heads,
+        intermediate_size=hidden_size * 4,
+        max_position_embeddings=seq_length,
+        type_vocab_size=1,
+    )
+    inputs = dict(
+        word_ids=torch.randint(1, config.vocab_size, (batch_size, seq_length)),
+        word_segment_ids=torch.zeros(batch_size, seq_length, dtype=torch.long),
+        word_attention_mask=torch.ones(batch_size, seq_length, dtype=torch.long),
+        entity_ids=torch.randint(1, config.entity_vocab_size, (batch_size, entity_length)),
+        entity_position_ids=torch.arange(entity_length).view(1, -1, 1).repeat(batch_size, 1, 1),
+        entity_segment_ids=torch.zeros(batch_size, entity_length, dtype=torch.long),
+        entity_attention_mask=torch.ones(batch_size, entity_length, dtype=torch.long),
+    )
+
+    results = dict(bf16_supported=is_cpu_bf16_supported(), num_threads=num_threads, benchmarks=[])
+    for backend in (PrecisionBackend(), BFloat16Backend(device)):
+        torch.manual_seed(0)
+        model = LukeEntityAwareAttentionModel(config)
+        results["benchmarks"].append(benchmark_precision(model, inputs, backend, iterations))
+        logger.info("%s", results["benchmarks"][-1])
+
+    fp32_throughput = results["benchmarks"][0]["examples_per_sec"]
+    results["bf16_speedup"] = results["benchmarks"][1]["examples_per_sec"] / fp32_throughput
+    click.echo(json.dumps(results, indent=2))
+
+    if output_file:
+        with open(output_file, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def _is_apex_available():
+    try:
+        import apex  # noqa: F401
+    except ImportError:
+        return False
+    return True
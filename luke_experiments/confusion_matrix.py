@@ -6,77 +6,17 @@ import os
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+from function_meta_analysis.functions import load_evaluation_arrays
+from luke.utils.multilabel_metrics import one_hot_encoding, split_multi_single
+
 plt.rcParams.update({'font.size': 24})
 plt.rc('font', size=16)
 plt.rc('axes', titlesize=16)
 
-from sklearn.calibration import calibration_curve
-
 import argparse
 
 # ================================================================================================
 
-def add_reject_entry(one_hot_dataset):
-    # Add reject as class: 
-    for i, array in enumerate(one_hot_dataset): 
-        if sum(array) > 0:
-            one_hot_dataset[i] = np.append(array, 0)
-        else:
-            one_hot_dataset[i] = np.append(array, 1)
-    return one_hot_dataset
-
-
-def one_hot_encoding(dataset, add_reject=True):
-    # One-hot encode and change type to np.array: 
-    one_hot = [(np.array(z) > 0)*1 for z in dataset]    
-    
-    if add_reject:
-        # Add rejection as a class
-        one_hot = add_reject_entry(one_hot)
-
-    # Make matrix: 
-    num_entities = len(one_hot[0])
-    one_hot = np.concatenate(one_hot)
-
-    one_hot = np.reshape(one_hot, (-1, num_entities))
-
-    return one_hot
-
-
-def logit2prob(logits):
-    prob = np.array([])
-    for logit in logits: 
-        prob = np.append(prob, (np.exp(logit) / (np.exp(logit) + 1)))
-    return prob
-
-
-def split_multi_single(y_true, y_pred):
-    y_true_single = np.array([])
-    y_pred_single = np.array([])
-        
-    y_true_multi = np.array([])
-    y_pred_multi = np.array([])
-
-    num_entities = len(y_true[0])
-
-    for i in range(len(y_pred)):
-        if sum(y_true[i,:]) <= 1 and sum(y_pred[i,:]) <=1: 
-            y_true_single = np.append(y_true_single, y_true[i,:])
-            y_pred_single = np.append(y_pred_single, y_pred[i,:])
-        else: 
-            y_true_multi = np.append(y_true_multi, y_true[i,:])
-            y_pred_multi = np.append(y_pred_multi, y_pred[i,:])
-    
-    # Reshape: 
-    y_true_single = np.reshape(y_true_single, (-1,num_entities))
-    y_pred_single = np.reshape(y_pred_single, (-1,num_entities))   
-    
-    y_true_multi = np.reshape(y_true_multi, (-1,num_entities))
-    y_pred_multi = np.reshape(y_pred_multi, (-1,num_entities)) 
-
-    return y_true_single, y_pred_single, y_true_multi, y_pred_multi
-
-
 def plot_cm(cm, class_names, normalize=False, cbar=True, font_scale=1.5, title=False):
     """
     Returns a matplotlib figure containing the plotted confusion matrix.
@@ -145,8 +85,9 @@ def run_cm():
 
     for eval_set in eval_sets: 
 
-        y_true = one_hot_encoding(evaluations[eval_set]["true_labels"])
-        y_pred = one_hot_encoding(evaluations[eval_set]["predict_logits"])
+        predict_logits, true_labels = load_evaluation_arrays(evaluations[eval_set], os.path.dirname(data_dir))
+        y_true = one_hot_encoding(true_labels, add_reject=True)
+        y_pred = one_hot_encoding(predict_logits, add_reject=True)
 
         ##############################
         ######## Multi-label #########
@@ -0,0 +1,48 @@
+import json
+import logging
+import os
+
+import click
+import numpy as np
+
+from function_meta_analysis.embedding import benchmark_embedding
+
+# ==============================================================================
+# Runtime of the t-SNE and PCA embeddings against the number of rows
+# ==============================================================================
+
+
+@click.command()
+@click.argument("matrix_file", type=click.Path(exists=True))
+@click.option("--labels-file", type=click.Path(exists=True), help=".npy file with the labels used to stratify the rows")
+@click.option("--sizes", default="1000,2000,5000,10000,20000")
+@click.option("--method", "methods", multiple=True, default=["pca", "tsne"], type=click.Choice(["pca", "tsne"]))
+@click.option("--exact-neighbors", is_flag=True)
+@click.option("--output-file", default="luke_experiments/embedding_benchmark.json")
+def run(matrix_file, labels_file, sizes, methods, exact_neighbors, output_file):
+    """Embeds stratified subsamples of MATRIX_FILE (an .npy file, which is memory-mapped) of increasing sizes and
+    reports the runtime of each of them."""
+    logging.basicConfig(level=logging.INFO)
+
+    labels = np.load(labels_file, mmap_mode="r") if labels_file else None
+    sizes = [int(size) for size in sizes.split(",")]
+
+    results = []
+    for method in methods:
+        results.extend(
+            benchmark_embedding(method, matrix_file, sizes, labels=labels, approximate_neighbors=not exact_neighbors)
+        )
+
+    for result in results:
+        print(f"{result['method']:>5} {result['size']:>8} {result['seconds']:>10.2f}s")
+
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+# ==============================================================================
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,171 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from .render import hash_inputs
+
+try:
+    from pynndescent import NNDescent
+except ImportError:
+    NNDescent = None
+
+logger = logging.getLogger(__name__)
+
+
+def load_matrix(matrix):
+    """Returns the matrix itself, or a memory-mapped array if it is the path of an .npy file."""
+    if isinstance(matrix, str):
+        return np.load(matrix, mmap_mode="r")
+    return matrix
+
+
+def stratified_subsample(num_rows, max_samples, labels=None, seed=0):
+    """Returns the sorted indices of at most `max_samples` randomly selected rows.
+
+    If `labels` is specified, each label is sampled in proportion to its frequency and, unless there are more labels
+    than `max_samples`, is kept with at least one row. The labels can be an array of label indices or a 0/1 matrix of
+    shape (num_rows, num_labels), in which case the rows are stratified by their first positive label.
+    """
+    if max_samples is None or num_rows <= max_samples:
+        return np.arange(num_rows)
+
+    rnd = np.random.RandomState(seed)
+    if labels is None:
+        return np.sort(rnd.choice(num_rows, max_samples, replace=False))
+
+    labels = np.asarray(labels)
+    if labels.ndim == 2:
+        labels = np.where(labels.any(axis=1), labels.argmax(axis=1), -1)
+    _, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+
+    if len(counts) <= max_samples:
+        # every label first gets one row, and the other rows are divided among the remaining rows of the labels
+        quota = 1 + _allocate(counts - 1, max_samples - len(counts), rnd)
+    else:
+        quota = _allocate(counts, max_samples, rnd)
+
+    # shuffle the rows, group them by label, and take the first rows of each label
+    order = rnd.permutation(num_rows)
+    order = order[np.argsort(inverse[order], kind="stable")]
+    rank = np.arange(num_rows) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.sort(order[rank < np.repeat(quota, counts)])
+
+
+def _allocate(counts, total, rnd):
+    """Divides `total` among the counts in proportion to them by the largest remainder method.
+
+    Ties between the remainders are broken randomly so that no label is preferred when the counts are equal.
+    """
+    exact = counts * total / counts.sum()
+    quota = np.floor(exact).astype(np.int64)
+    remaining = total - quota.sum()
+    quota[np.lexsort((rnd.random_sample(len(counts)), quota - exact))[:remaining]] += 1
+    return quota
+
+
+def compute_embedding(
+    method,
+    matrix,
+    n_components=3,
+    cache_dir=None,
+    labels=None,
+    max_samples=None,
+    perplexity=30.0,
+    approximate_neighbors=True,
+    seed=0,
+):
+    """Returns the t-SNE ("tsne") or PCA ("pca") embedding of the rows of `matrix` and the indices of the embedded rows.
+
+    `matrix` can be an array or the path of an .npy file, which is memory-mapped so that only the rows selected by
+    `stratified_subsample` (if `max_samples` is specified) are read. t-SNE uses the Barnes-Hut approximation
+    initialized with PCA and, if `approximate_neighbors` is True, a nearest-neighbor graph computed by pynndescent
+    (if available). If `cache_dir` is specified, the embedding is stored in it keyed by the hash of the input, and is
+    reused when the same rows are embedded again.
+    """
+    matrix = load_matrix(matrix)
+    indices = stratified_subsample(len(matrix), max_samples, labels=labels, seed=seed)
+    data = np.ascontiguousarray(matrix[indices] if len(indices) < len(matrix) else matrix, dtype=np.float32)
+
+    cache_file = None
+    if cache_dir is not None:
+        params = (
+            (method, n_components) if method == "pca" else (method, n_components, perplexity, approximate_neighbors)
+        )
+        cache_file = os.path.join(cache_dir, f"{method}_{hash_inputs(params, seed, data)}.npy")
+        if os.path.exists(cache_file):
+            return np.load(cache_file), indices
+
+    start_time = time.time()
+    if method == "tsne":
+        embedding = _run_tsne(data, n_components, perplexity, approximate_neighbors, seed)
+    elif method == "pca":
+        from sklearn.decomposition import PCA
+
+        embedding = PCA(n_components=n_components).fit_transform(data)
+    else:
+        raise ValueError(f"Invalid method: {method}")
+    logger.info("Computed the %s embedding of %d rows in %.2f seconds", method, len(data), time.time() - start_time)
+
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, embedding)
+        os.replace(tmp_file, cache_file)
+
+    return embedding, indices
+
+
+def benchmark_embedding(method, matrix, sizes, labels=None, **kwargs):
+    """Returns the runtime of `compute_embedding` for each number of sampled rows in `sizes`."""
+    matrix = load_matrix(matrix)
+    results = []
+    for size in sizes:
+        start_time = time.time()
+        _, indices = compute_embedding(method, matrix, labels=labels, max_samples=size, **kwargs)
+        results.append(dict(method=method, size=len(indices), seconds=time.time() - start_time))
+        logger.info("%s: %d rows in %.2f seconds", method, len(indices), results[-1]["seconds"])
+    return results
+
+
+def _run_tsne(data, n_components, perplexity, approximate_neighbors, seed):
+    from sklearn.decomposition import PCA
+    from sklearn.manifold import TSNE
+
+    perplexity = min(perplexity, (len(data) - 1) / 3.0)
+
+    # the same initialization as init="pca", which cannot be used with a precomputed neighbor graph
+    init = PCA(n_components=n_components, svd_solver="randomized", random_state=seed).fit_transform(data)
+    init = init / np.std(init[:, 0]) * 1e-4
+
+    tsne_kwargs = dict(
+        n_components=n_components, perplexity=perplexity, method="barnes_hut", init=init, random_state=seed
+    )
+    if not approximate_neighbors:
+        return TSNE(**tsne_kwargs).fit_transform(data)
+
+    # TSNE uses int(3 * perplexity + 1) neighbors, and requires one more in a precomputed graph
+    n_neighbors = min(len(data) - 1, int(3.0 * perplexity + 1) + 1)
+    return TSNE(metric="precomputed", **tsne_kwargs).fit_transform(_knn_graph(data, n_neighbors, seed))
+
+
+def _knn_graph(data, n_neighbors, seed):
+    """Returns a sparse matrix of the squared Euclidean distances to the nearest neighbors of each row."""
+    from scipy.sparse import csr_matrix
+
+    if NNDescent is not None:
+        index = NNDescent(data, n_neighbors=n_neighbors + 1, random_state=seed)
+        neighbors, distances = index.neighbor_graph
+        # the first neighbor is the row itself
+        neighbors, distances = neighbors[:, 1:], distances[:, 1:]
+    else:
+        from sklearn.neighbors import NearestNeighbors
+
+        distances, neighbors = NearestNeighbors(n_neighbors=n_neighbors).fit(data).kneighbors()
+
+    indptr = np.arange(0, len(data) * n_neighbors + 1, n_neighbors)
+    return csr_matrix(
+        ((distances.astype(np.float64) ** 2).ravel(), neighbors.ravel(), indptr), shape=(len(data), len(data))
+    )
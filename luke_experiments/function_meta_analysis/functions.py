@@ -1,6 +1,10 @@
+import os
+
 import numpy as np
 
-from sklearn.calibration import calibration_curve
+from luke.utils.multilabel_metrics import calibration_bins
+
+from .embedding import compute_embedding
 
 import matplotlib.pyplot as plt
 plt.rcParams.update({'font.size': 30, 'legend.fontsize': 20})
@@ -150,11 +154,11 @@ def plot_calibration_curve(y_true, y_pred_prob, model_name, title, n_bins=5, nor
     plt.plot([0, 1], [0, 1], linestyle = '--', label = 'Ideally Calibrated', color="black") 
 
     if type(model_name) == str: 
-        x, y = calibration_curve(y_true, y_pred_prob, n_bins=n_bins, normalize=normalize)
+        x, y, _ = calibration_bins(y_true, y_pred_prob, n_bins=n_bins, normalize=normalize)
         plt.plot(x, y, marker = '.', label = model_name)
     else: 
         for i in range(len(model_name)):
-            fraction_of_positives, mean_predicted_value = calibration_curve(y_true[i], y_pred_prob[i], n_bins=n_bins, normalize=normalize)
+            fraction_of_positives, mean_predicted_value, _ = calibration_bins(y_true[i], y_pred_prob[i], n_bins=n_bins, normalize=normalize)
             plt.plot(mean_predicted_value, fraction_of_positives, marker = '.', label = model_name[i]) 
 
     plt.plot([0, 1], [0, 1], linestyle = '--', color="black") 
@@ -190,11 +194,11 @@ def plot_calibration_curve_with_hist(y_true, y_pred_prob, model_name, title, n_b
     ax1.plot([0, 1], [0, 1], linestyle = '--', label = 'Ideally Calibrated', color="black") 
 
     if type(model_name) == str: 
-        x, y = calibration_curve(y_true, y_pred_prob, n_bins=n_bins, normalize=normalize)
+        x, y, _ = calibration_bins(y_true, y_pred_prob, n_bins=n_bins, normalize=normalize)
         plt.plot(x, y, marker = '.', label = model_name)
     else: 
         for i in range(len(model_name)):
-            fraction_of_positives, mean_predicted_value = calibration_curve(y_true[i], y_pred_prob[i], n_bins=n_bins, normalize=normalize)
+            fraction_of_positives, mean_predicted_value, _ = calibration_bins(y_true[i], y_pred_prob[i], n_bins=n_bins, normalize=normalize)
             ax1.plot(mean_predicted_value, fraction_of_positives, marker = '.', label = model_name[i]) 
             ax2.hist(y_pred_prob[i], range=(0, 1), bins=n_bins, label=model_name, histtype="step", lw=2)
 
@@ -216,9 +220,97 @@ def plot_calibration_curve_with_hist(y_true, y_pred_prob, model_name, title, n_b
     return figure
 
 
-def logit2prob(logits):
-    prob = np.array([])
-    for logit in logits: 
-        prob = np.append(prob, (np.exp(logit) / (np.exp(logit) + 1)))
-    return prob
+EMBEDDING_NAMES = {"tsne": "t-SNE", "pca": "PCA"}
+
+
+def embedding_plots(method, matrix, title, cache_dir=None, labels=None, max_samples=None):
+    """
+    Returns matplotlib figures containing the 2D plots of each pair of components and the 3D plot of the 3-dimensional
+    t-SNE or PCA embedding.
+    
+    Args:
+        method: "tsne" or "pca"
+        matrix: ndarray of (n_samples, n_features) or path of an .npy file
+        title: string with name of the plot
+        cache_dir: directory where the embedding is cached
+        labels: labels used to stratify the subsample
+        max_samples: maximum number of samples to be embedded
+    """
+    data_matrix, _ = compute_embedding(
+        method, matrix, n_components=3, cache_dir=cache_dir, labels=labels, max_samples=max_samples
+    )
+    # Define compoments: 
+    one = data_matrix[:,0]
+    two = data_matrix[:,1]
+    thr = data_matrix[:,2]
+    labels = [f"{ordinal} {EMBEDDING_NAMES[method]} component" for ordinal in ("1st", "2nd", "3rd")]
+
+    # 2D: 
+    one_two = plot_2d(one, two, title=title, labels=[labels[0], labels[1]])
+    one_thr = plot_2d(one, thr, title=title, labels=[labels[0], labels[2]])
+    two_thr = plot_2d(two, thr, title=title, labels=[labels[1], labels[2]])
+
+    # 3D: 
+    one_two_thr = plot_3d(one, two, thr, title, labels)
+
+    return one_two, one_thr, two_thr, one_two_thr
+
+
+def plot_2d(x, y, title, labels):
+    """
+    Returns a matplotlib figure containing the 2D T-SNE plot.
+    
+    Args:
+        x, y, z: arrays
+        title: string with name of the plot
+        labels: list of strings with label names: [x, y, z]
+    """
+    plt.rcParams.update({'font.size': 40, 'legend.fontsize': 20})
+    plt.rc('font', size=30)
+    plt.rc('axes', titlesize=35)
+
+    figure, ax = plt.subplots(figsize=(10, 10))
+    ax.scatter(x, y)
+    ax.set_title(title) 
+    ax.set_xlabel(labels[0])
+    ax.set_ylabel(labels[1])
+    plt.grid()
+    
+    plt.tight_layout()
+
+    return figure    
+
+
+def plot_3d(x, y, z, title, labels):
+    """
+    Returns a matplotlib figure containing the 3D T-SNE plot.
+    
+    Args:
+        x, y, z: arrays
+        title: string with name of the plot
+        labels: list of strings with label names: [x, y, z]
+    """
+    plt.rcParams.update({'font.size': 30, 'legend.fontsize': 20})
+    plt.rc('font', size=30)
+    plt.rc('axes', titlesize=35)
+    labelpad = 30
+
+    figure = plt.figure(figsize=(12,12))
+    ax = figure.add_subplot(projection='3d')
+    ax.scatter(x, y, z)
+    ax.set_title(title) 
+    ax.set_xlabel(labels[0], labelpad=labelpad)
+    ax.set_ylabel(labels[1], labelpad=labelpad)
+    ax.set_zlabel(labels[2], labelpad=labelpad)
+    plt.tight_layout()
+
+    return figure
+
 
+def load_evaluation_arrays(evaluation, results_dir):
+    # Newer results.json files only reference the .npy files with the logits and labels:
+    if "predict_logits_file" in evaluation:
+        logits = np.load(os.path.join(results_dir, evaluation["predict_logits_file"]), mmap_mode="r")
+        labels = np.load(os.path.join(results_dir, evaluation["true_labels_file"]), mmap_mode="r")
+        return logits, labels
+    return np.array(evaluation["predict_logits"]), np.array(evaluation["true_labels"])
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "meta_analysis_index.npz"
+EVAL_SETS = ("dev", "test")
+
+# Curves extracted from the keys of results.json in their original order:
+CURVES = {
+    "dev_f1_epoch": lambda key: "dev_f1_epoch" in key,
+    "dev_precision_epoch": lambda key: "dev_precision_epoch" in key,
+    "dev_recall_epoch": lambda key: "dev_recall_epoch" in key,
+    "dev_f1": lambda key: "dev_f1" in key and "_epoch" not in key,
+    "dev_precision": lambda key: "dev_precision" in key and "_epoch" not in key,
+    "dev_recall": lambda key: "dev_recall" in key and "_epoch" not in key,
+    "test_f1": lambda key: "test_f1" in key,
+    "test_precision": lambda key: "test_precision" in key,
+    "test_recall": lambda key: "test_recall" in key,
+}
+
+
+class MetaAnalysisIndex(object):
+    """Columnar index of the results.json files of the experiments in a directory.
+
+    Each results.json is parsed only once, and its scalar metrics, hyperparameters (log_parameters), curves (the
+    training loss averaged over the gradient accumulation steps and the metrics in `CURVES`), and the files with the
+    evaluation logits and labels are stored in an .npz file. The runs are keyed by the path and modification time of
+    their results.json, so `update` only parses the files that are new or changed since the last update. Logits and
+    labels embedded in older results.json files are extracted to .npy files next to the index.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.records = {}
+        if os.path.exists(index_file):
+            with np.load(index_file) as data:
+                self.records = _columns_to_records({key: data[key] for key in data.files})
+
+    @classmethod
+    def build(cls, data_dir, index_file=None):
+        """Loads the index of `data_dir`, updates it with the new runs, and saves it if anything has changed."""
+        index = cls(index_file or os.path.join(data_dir, INDEX_FILE_NAME))
+        if index.update(data_dir):
+            index.save()
+        return index
+
+    def update(self, data_dir):
+        start_time = time.time()
+        found = set()
+        num_parsed = 0
+        for root, _, files in os.walk(data_dir):
+            if "results.json" not in files:
+                continue
+            result_json = os.path.join(root, "results.json")
+            found.add(result_json)
+            mtime = os.path.getmtime(result_json)
+            record = self.records.get(result_json)
+            if record is not None and record["mtime"] == mtime:
+                continue
+            if record is not None:
+                self._remove_extracted_arrays(record)
+            self.records[result_json] = self._parse(result_json, mtime)
+            num_parsed += 1
+
+        removed = [path for path in self.records if path not in found]
+        for path in removed:
+            self._remove_extracted_arrays(self.records.pop(path))
+
+        logger.info(
+            "Updated the index in %.2f seconds (%d parsed, %d removed, %d runs)",
+            time.time() - start_time,
+            num_parsed,
+            len(removed),
+            len(self.records),
+        )
+        return num_parsed > 0 or len(removed) > 0
+
+    def save(self):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(f, **_records_to_columns(list(self.records.values())))
+        os.replace(tmp_file, self.index_file)
+
+    def runs(self, experiment_tag=None):
+        """Returns the records of the runs whose directory name contains `experiment_tag`, sorted by their path."""
+        return [
+            record
+            for path, record in sorted(self.records.items())
+            if experiment_tag is None or experiment_tag in record["run_name"]
+        ]
+
+    def _parse(self, result_json, mtime):
+        with open(result_json) as f:
+            data = json.load(f)
+        root = os.path.dirname(result_json)
+
+        log_parameters = data.get("experimental_configurations", {}).get("log_parameters", {})
+        params = {k: v for k, v in log_parameters.items() if v is None or isinstance(v, (bool, int, float, str))}
+        scalars = {k: float(v) for k, v in data.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        curves = {name: [float(data[key]) for key in data if match(key)] for name, match in CURVES.items()}
+
+        training_loss = np.array(data.get("training_loss", []), dtype=np.float64)
+        gradient_accumulation_steps = int(log_parameters.get("gradient_accumulation_steps", 1))
+        if len(training_loss) % gradient_accumulation_steps != 0:
+            training_loss = np.append(training_loss, training_loss[-1])
+        curves["training_loss"] = training_loss.reshape(-1, gradient_accumulation_steps).mean(axis=1).tolist()
+
+        files = {}
+        for eval_set in EVAL_SETS:
+            evaluation = data.get("evaluation_predict_label", {}).get(eval_set)
+            if not evaluation:
+                continue
+            if "predict_logits_file" in evaluation:
+                files[f"{eval_set}_logits"] = os.path.join(root, evaluation["predict_logits_file"])
+                files[f"{eval_set}_labels"] = os.path.join(root, evaluation["true_labels_file"])
+            else:
+                files.update(self._extract_arrays(result_json, eval_set, evaluation))
+
+        return dict(
+            path=result_json,
+            mtime=mtime,
+            run_name=os.path.basename(root),
+            params=params,
+            scalars=scalars,
+            curves=curves,
+            files=files,
+        )
+
+    def _extract_arrays(self, result_json, eval_set, evaluation):
+        array_dir = self._get_array_dir()
+        os.makedirs(array_dir, exist_ok=True)
+        prefix = os.path.join(array_dir, hashlib.md5(result_json.encode("utf-8")).hexdigest()[:16] + "_" + eval_set)
+        np.save(prefix + "_logits.npy", np.array(evaluation["predict_logits"], dtype=np.float32))
+        np.save(prefix + "_labels.npy", np.array(evaluation["true_labels"], dtype=np.int8))
+        return {f"{eval_set}_logits": prefix + "_logits.npy", f"{eval_set}_labels": prefix + "_labels.npy"}
+
+    def _remove_extracted_arrays(self, record):
+        for array_file in record["files"].values():
+            if os.path.dirname(array_file) == self._get_array_dir() and os.path.exists(array_file):
+                os.remove(array_file)
+
+    def _get_array_dir(self):
+        return os.path.splitext(self.index_file)[0] + "_arrays"
+
+
+def load_run_arrays(record, eval_set):
+    """Returns the memory-mapped logits and labels of a run in the index."""
+    files = record["files"]
+    return np.load(files[f"{eval_set}_logits"], mmap_mode="r"), np.load(files[f"{eval_set}_labels"], mmap_mode="r")
+
+
+def _records_to_columns(records):
+    columns = dict(
+        path=np.array([r["path"] for r in records], dtype=str),
+        mtime=np.array([r["mtime"] for r in records], dtype=np.float64),
+        run_name=np.array([r["run_name"] for r in records], dtype=str),
+    )
+
+    for group in ("params", "scalars", "files"):
+        names = sorted({name for r in records for name in r[group]})
+        for name in names:
+            values = [r[group].get(name) for r in records]
+            if all(v is None or isinstance(v, (bool, int, float)) for v in values):
+                columns[f"{group}__{name}"] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            else:
+                columns[f"{group}__{name}"] = np.array(["" if v is None else str(v) for v in values], dtype=str)
+
+    # the curves have different lengths and are stored as concatenated values and offsets
+    for name in sorted({name for r in records for name in r["curves"]}):
+        curves = [r["curves"].get(name, []) for r in records]
+        columns[f"curves__{name}__values"] = np.array([v for curve in curves for v in curve], dtype=np.float64)
+        columns[f"curves__{name}__offsets"] = np.cumsum([0] + [len(curve) for curve in curves], dtype=np.int64)
+
+    return columns
+
+
+def _columns_to_records(columns):
+    records = {}
+    for i, path in enumerate(columns["path"].tolist()):
+        records[path] = dict(
+            path=path,
+            mtime=float(columns["mtime"][i]),
+            run_name=str(columns["run_name"][i]),
+            params={},
+            scalars={},
+            curves={},
+            files={},
+        )
+
+    paths = list(records.keys())
+    for key, column in columns.items():
+        parts = key.split("__")
+        if parts[0] in ("params", "scalars", "files"):
+            for path, value in zip(paths, column.tolist()):
+                if value == "" or (isinstance(value, float) and np.isnan(value)):
+                    continue
+                records[path][parts[0]][parts[1]] = value
+        elif parts[0] == "curves" and parts[2] == "offsets":
+            values = columns[f"curves__{parts[1]}__values"]
+            for i, path in enumerate(paths):
+                records[path]["curves"][parts[1]] = values[column[i] : column[i + 1]].tolist()
+
+    return records
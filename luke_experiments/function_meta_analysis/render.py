@@ -0,0 +1,155 @@
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = "render_manifest.json"
+
+
+class RenderJob(object):
+    """A call of a plot function whose returned figure (or tuple of figures) is saved to `output_files`.
+
+    The plot function needs to be defined at the module level so that it can be run in a worker process.
+    """
+
+    def __init__(self, plot_fn, args, output_files, kwargs=None, dpi=None):
+        self.plot_fn = plot_fn
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.output_files = list(output_files)
+        self.dpi = dpi
+        # the source of the plot function and the states of the input files are hashed so that the figures are
+        # rendered again when the function is edited or an input file (e.g., a .npy matrix) is rewritten
+        self.input_hash = hash_inputs(
+            plot_fn.__module__,
+            plot_fn.__qualname__,
+            _get_source(plot_fn),
+            _get_file_states([self.args, self.kwargs]),
+            self.args,
+            self.kwargs,
+            dpi,
+        )
+
+
+def render_figures(jobs, manifest_dir, num_workers=None):
+    """Renders the figures of the jobs whose inputs have changed since they were last rendered.
+
+    The hashes of the inputs of the rendered figures are stored in render_manifest.json in `manifest_dir`. The jobs
+    are run in a process pool with the Agg backend, or in the current process if `num_workers` is 0.
+    """
+    start_time = time.time()
+    manifest_file = os.path.join(manifest_dir, MANIFEST_FILE_NAME)
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    stale_jobs = [
+        job
+        for job in jobs
+        if any(
+            manifest.get(output_file) != job.input_hash or not os.path.exists(output_file)
+            for output_file in job.output_files
+        )
+    ]
+    logger.info("Rendering %d of %d jobs (%d up to date)", len(stale_jobs), len(jobs), len(jobs) - len(stale_jobs))
+
+    try:
+        if num_workers == 0:
+            _init_worker()
+            for job in stale_jobs:
+                _render(job)
+                manifest.update({output_file: job.input_hash for output_file in job.output_files})
+        elif stale_jobs:
+            with ProcessPoolExecutor(
+                max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+            ) as executor:
+                futures = {executor.submit(_render, job): job for job in stale_jobs}
+                for future in as_completed(futures):
+                    future.result()
+                    job = futures[future]
+                    manifest.update({output_file: job.input_hash for output_file in job.output_files})
+    finally:
+        if stale_jobs:
+            os.makedirs(manifest_dir, exist_ok=True)
+            with open(manifest_file, "w") as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+
+    logger.info("Rendered the figures in %.2f seconds", time.time() - start_time)
+    return len(stale_jobs)
+
+
+def hash_inputs(*inputs):
+    """Returns a hash of the given (nested) lists, tuples, dicts, arrays, and scalars."""
+    digest = hashlib.sha1()
+    _update_hash(digest, inputs)
+    return digest.hexdigest()
+
+
+def _update_hash(digest, obj):
+    if isinstance(obj, dict):
+        digest.update(b"dict")
+        for key in sorted(obj, key=repr):
+            _update_hash(digest, key)
+            _update_hash(digest, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        digest.update(f"list{len(obj)}".encode("utf-8"))
+        for item in obj:
+            _update_hash(digest, item)
+    elif isinstance(obj, np.ndarray) or hasattr(obj, "__array__"):
+        array = np.ascontiguousarray(obj)
+        digest.update(f"array{array.dtype.str}{array.shape}".encode("utf-8"))
+        digest.update(array.tobytes())
+    else:
+        digest.update(repr(obj).encode("utf-8"))
+
+
+def _get_source(func):
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return None
+
+
+def _get_file_states(obj):
+    """Returns the paths, modification times, and sizes of the existing files among the given (nested) inputs."""
+    if isinstance(obj, dict):
+        return [state for key in sorted(obj, key=repr) for state in _get_file_states(obj[key])]
+    if isinstance(obj, (list, tuple)):
+        return [state for item in obj for state in _get_file_states(item)]
+    if isinstance(obj, str) and os.path.isfile(obj):
+        stat = os.stat(obj)
+        return [(obj, stat.st_mtime_ns, stat.st_size)]
+    return []
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _render(job):
+    import matplotlib.pyplot as plt
+
+    figures = job.plot_fn(*job.args, **job.kwargs)
+    if not isinstance(figures, (list, tuple)):
+        figures = [figures]
+
+    if len(figures) != len(job.output_files):
+        raise ValueError(
+            f"{job.plot_fn.__qualname__} returned {len(figures)} figures for {len(job.output_files)} output files"
+        )
+
+    for figure, output_file in zip(figures, job.output_files):
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        figure.savefig(output_file, dpi=job.dpi)
+        plt.close(figure)
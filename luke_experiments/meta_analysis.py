@@ -8,6 +8,9 @@ from argparse import Namespace
 import click
 
 from function_meta_analysis.functions import *
+from function_meta_analysis.index import MetaAnalysisIndex, load_run_arrays
+from function_meta_analysis.render import RenderJob, render_figures
+from luke.utils.multilabel_metrics import logit2prob
 
 import matplotlib.pyplot as plt
 
@@ -39,11 +42,13 @@ dpi = 300
 @click.option("--data-dir", default="data/outputs/seed_lr_wd_batch_train_size_dropout_with_eval_no_train", type=click.Path(exists=True))
 @click.option("--output-dir", default="luke_experiments/plots_meta_analysis")
 @click.option("--name-changing-file", default="luke_experiments/function_meta_analysis/name_change.json")
+@click.option("--index-file", default=None, help="Defaults to meta_analysis_index.npz in the data directory")
 @click.option("--tensorboard-plot/--no-tensorboard-plot", default=True)
 @click.option("--f1-training-plot/--no-f1-training-plot", default=True)
 @click.option("--scatter-plot/--no-scatter-plot", default=True)
 @click.option("--calibration-plot/--no-calibration-plot", default=True)
 @click.option("--do-evaluate-prior-train/--no-evaluate-prior-train", default=True)
+@click.option("--num-workers", type=int, default=None, help="Number of processes rendering the figures (0: no pool)")
 def run(**task_args):
     args = Namespace(**task_args)
 
@@ -62,6 +67,9 @@ def run(**task_args):
     
     tensorboard_event_folder = os.path.join(output_dir, "runs_tensorboards") 
 
+    # The results.json files are only parsed when they are new or changed since the index was last updated: 
+    index = MetaAnalysisIndex.build(data_dir, args.index_file)
+
     # Tag used for the tensorboard: 
     experiment_tags = config.tags
 
@@ -70,107 +78,69 @@ def run(**task_args):
     f1_scores = {}
 
     eval_results_with_tag = {}
+    jobs = []
 
     for experiment_tag in experiment_tags:
         eval_results[experiment_tag] = {}
         pred_logts[experiment_tag] = {}
         f1_scores[experiment_tag] = {}
 
-        f1_eval = torch.tensor([])
-        precision_eval = torch.tensor([])
-        recall_eval = torch.tensor([])
-        
-        
-        for root, dirs, files in os.walk(data_dir):
+        for record in index.runs(experiment_tag):
+            base_root = record["run_name"]
+            curves = {name: torch.tensor(values) for name, values in record["curves"].items()}
 
-            result_json = os.path.join(root, "results.json")
-            base_root = os.path.basename(root)
-            
-            if os.path.exists(result_json) and experiment_tag in base_root:
-                
-                # Load data:     
-                with open(f"{result_json}") as json_file:
-                    data = json.load(json_file)
-                
-                log_parameters = data["experimental_configurations"]["log_parameters"]
-                par = log_parameters[f"{experiment_tag}"]
-                gradient_accumulation_steps = log_parameters["gradient_accumulation_steps"]
-
-                # Get parameters to model: 
-                if len(data["training_loss"]) % gradient_accumulation_steps != 0: 
-                    # print(f"Odd number of global_steps and training_loss: {base_root}")
-                    data["training_loss"].append(data["training_loss"][-1])
-                    training_loss = np.mean(np.array(data["training_loss"]).reshape(-1, gradient_accumulation_steps), axis=1)
-                else: 
-                    training_loss = np.mean(np.array(data["training_loss"]).reshape(-1, gradient_accumulation_steps), axis=1)
-
-                ######################################################
-                        #### Meta Analysis ####
-                ######################################################
-
-                ###########################
-                # During training: 
-                training_loss   = torch.tensor(training_loss)
-                dev_f1          = torch.tensor([data[z] for z in data if "dev_f1_epoch" in z])
-                dev_precision   = torch.tensor([data[z] for z in data if "dev_precision_epoch" in z])
-                dev_recall      = torch.tensor([data[z] for z in data if "dev_recall_epoch" in z])
-
-
-                ###########################
-                # Development and Test evalution:
-                ###########################
-                # F1, Precision and Recall: 
-                dev_f1_eval         = torch.tensor([data[z] for z in data if "dev_f1" in z and "_epoch" not in z])
-                test_f1_eval        = torch.tensor([data[z] for z in data if "test_f1" in z])
-                
-                dev_precision_eval  = torch.tensor([data[z] for z in data if "dev_precision" in z and "_epoch" not in z])
-                test_precision_eval = torch.tensor([data[z] for z in data if "test_precision" in z])
-                
-                dev_recall_eval     = torch.tensor([data[z] for z in data if "dev_recall" in z and "_epoch" not in z])
-                test_recall_eval    = torch.tensor([data[z] for z in data if "test_recall" in z])
+            ######################################################
+                    #### Meta Analysis ####
+            ######################################################
 
+            ###########################
+            # During training: 
+            training_loss   = curves["training_loss"]
+            dev_f1          = curves["dev_f1_epoch"]
+            dev_precision   = curves["dev_precision_epoch"]
+            dev_recall      = curves["dev_recall_epoch"]
 
-                # Data for F1 during training: 
-                f1_scores[experiment_tag][base_root] = {}
-                f1_scores[experiment_tag][base_root] = [data[z] for z in data if "dev_f1_epoch" in z]
+            # Data for F1 during training: 
+            f1_scores[experiment_tag][base_root] = record["curves"]["dev_f1_epoch"]
 
-                # Data for Scatter Plot: 
-                eval_results[experiment_tag][base_root] = {}
-                eval_results[experiment_tag][base_root]["f1"] = [dev_f1_eval, test_f1_eval]
-                eval_results[experiment_tag][base_root]["precision"] = [dev_precision_eval, test_precision_eval]
-                eval_results[experiment_tag][base_root]["recall"] = [dev_recall_eval, test_recall_eval]
+            # Data for Scatter Plot: 
+            eval_results[experiment_tag][base_root] = {}
+            eval_results[experiment_tag][base_root]["f1"] = [curves["dev_f1"], curves["test_f1"]]
+            eval_results[experiment_tag][base_root]["precision"] = [curves["dev_precision"], curves["test_precision"]]
+            eval_results[experiment_tag][base_root]["recall"] = [curves["dev_recall"], curves["test_recall"]]
 
-                # For Calibration plots:   
-                pred_logts[experiment_tag][base_root] = {}
-                pred_logts[experiment_tag][base_root]["dev"] = data["evaluation_predict_label"]["dev"]
-                pred_logts[experiment_tag][base_root]["test"] = data["evaluation_predict_label"]["test"]
+            # For Calibration plots:   
+            pred_logts[experiment_tag][base_root] = {}
+            for eval_set in config.eval_sets:
+                predict_logits, true_labels = load_run_arrays(record, eval_set)
+                pred_logts[experiment_tag][base_root][eval_set] = {"predict_logits": predict_logits, "true_labels": true_labels}
 
 
-                ######################################################
-                    # TensorBoards: experimental based
-                ######################################################
+            ######################################################
+                # TensorBoards: experimental based
+            ######################################################
+            
+            # If event file already exists or not plotting tensorboards: 
+            if not tensorboard_plot or os.path.exists(f"{tensorboard_event_folder}/{base_root}"):
+                continue
+            else:
+                # Experimental based: 
+                tb = SummaryWriter(log_dir = f"{tensorboard_event_folder}/{base_root}")
+
+                for step, loss in enumerate(training_loss):
+                    tb.add_scalar(f"{experiment_tag}/00.loss/Train", scalar_value=training_loss[step], global_step=step)
                 
-                # If event file already exists or not plotting tensorboards: 
-                if not tensorboard_plot or os.path.exists(f"{tensorboard_event_folder}/{base_root}"):
-                    continue
-                else:
-                    # Experimental based: 
-                    tb = SummaryWriter(log_dir = f"{tensorboard_event_folder}/{base_root}")
-
-                    for step, loss in enumerate(training_loss):
-                        tb.add_scalar(f"{experiment_tag}/00.loss/Train", scalar_value=training_loss[step], global_step=step)
-                    
-                    for epoch, recall in enumerate(dev_f1):
-                        tb.add_scalar(f"{experiment_tag}/01.f1/development", scalar_value=dev_f1[epoch], global_step=epoch)
+                for epoch, recall in enumerate(dev_f1):
+                    tb.add_scalar(f"{experiment_tag}/01.f1/development", scalar_value=dev_f1[epoch], global_step=epoch)
+                
+                for epoch, precision in enumerate(dev_precision):
+                    tb.add_scalar(f"{experiment_tag}/02.precision/development", scalar_value=dev_precision[epoch], global_step=epoch)
                     
-                    for epoch, precision in enumerate(dev_precision):
-                        tb.add_scalar(f"{experiment_tag}/02.precision/development", scalar_value=dev_precision[epoch], global_step=epoch)
-                        
-                    for epoch, recall in enumerate(dev_recall):
-                        tb.add_scalar(f"{experiment_tag}/03.recall/development", scalar_value=dev_recall[epoch], global_step=epoch)
+                for epoch, recall in enumerate(dev_recall):
+                    tb.add_scalar(f"{experiment_tag}/03.recall/development", scalar_value=dev_recall[epoch], global_step=epoch)
 
-                    tb.close()
-            
+                tb.close()
+        
         ######################################################
         # Evaluation: Experimental based
         ######################################################
@@ -186,12 +156,8 @@ def run(**task_args):
             
             title = labels[0].split("=")[0][:-1] 
 
-            f1_plt = plot_f1(f1_scores[experiment_tag], labels, title=f"F1-score development set\n{title}", eval_prior_train=do_evaluate_prior_train)
-
-            if not os.path.exists(f"{output_dir}/plots_f1_train"):
-                os.makedirs(f"{output_dir}/plots_f1_train")
-                
-            f1_plt.savefig(f"{output_dir}/plots_f1_train/f1_train_{experiment_tag}", dpi=dpi)            
+            jobs.append(RenderJob(plot_f1, (f1_scores[experiment_tag], labels), [f"{output_dir}/plots_f1_train/f1_train_{experiment_tag}.png"],
+                                  kwargs=dict(title=f"F1-score development set\n{title}", eval_prior_train=do_evaluate_prior_train), dpi=dpi))
 
         # Scatter plot for dev and test:
         if eval_results[experiment_tag] and scatter_plot: 
@@ -214,20 +180,13 @@ def run(**task_args):
             
             title = labels[0].split("=")[0][:-1] 
 
-            scatter_plt = plot_scatter(eval_results_with_tag[experiment_tag], labels, title=title)
-
-            if not os.path.exists(f"{output_dir}/plots_scatter"):
-                os.makedirs(f"{output_dir}/plots_scatter")
-                
-            scatter_plt.savefig(f"{output_dir}/plots_scatter/dev_test_{experiment_tag}", dpi=dpi)
+            jobs.append(RenderJob(plot_scatter, (eval_results_with_tag[experiment_tag], labels), [f"{output_dir}/plots_scatter/dev_test_{experiment_tag}.png"],
+                                  kwargs=dict(title=title), dpi=dpi))
         
 
         # Calibration Plot for dev and test seperately: 
         if pred_logts[experiment_tag] and calibration_plot: 
             
-            if not os.path.exists(f"{output_dir}/plots_calibration"):
-                os.makedirs(f"{output_dir}/plots_calibration")
-
             for eval_set in config.eval_sets:
         
                 true = []
@@ -260,9 +219,11 @@ def run(**task_args):
 
                 if "robust_" in labels[0]:
                     labels = [label[7:] for label in labels]
-                cal_plot = plot_calibration_curve_with_hist(true, pred, model_name=labels, title=title, n_bins=10)
+                jobs.append(RenderJob(plot_calibration_curve_with_hist, (true, pred), [f"{output_dir}/plots_calibration/{experiment_tag}_{eval_set}.png"],
+                                      kwargs=dict(model_name=labels, title=title, n_bins=10), dpi=dpi))
 
-                cal_plot.savefig(f"{output_dir}/plots_calibration/{experiment_tag}_{eval_set}", dpi=dpi)
+    # The figures are rendered in parallel, and only if their inputs have changed since they were last rendered: 
+    render_figures(jobs, output_dir, num_workers=args.num_workers)
                 
 
 # ==============================================================================
@@ -1,140 +1,29 @@
 import numpy as np
 import os
 import json
-import seaborn as sns
-import matplotlib.pyplot as plt
-from sklearn.manifold import TSNE
+import logging
 import argparse
 from sklearn.metrics import confusion_matrix, multilabel_confusion_matrix
-from sklearn.decomposition import PCA
 
-from confusion_matrix import one_hot_encoding, add_reject_entry, split_multi_single
+from luke.utils.multilabel_metrics import one_hot_encoding, split_multi_single
+from function_meta_analysis.functions import embedding_plots, load_evaluation_arrays
+from function_meta_analysis.render import RenderJob, render_figures
 
 # ================================================================================================
 
 
 flatten = lambda t: [item for sublist in t for item in sublist]
 
+PLOT_SUFFIXES = ["one_two", "one_thr", "two_thr", "one_two_thr"]
 
-def tsne_plot(matrix, title):
-    """
-    Returns a matplotlib figure containing the 2D and 3D t-SNE plots.
-    
-    Args:
-        matrix: ndarray of (n_samples, n_features)
-    """
-    # Note, input should be: X: 
-    data_matrix = TSNE(n_components=3).fit_transform(matrix)
-    # Define compoments: 
-    one = data_matrix[:,0]
-    two = data_matrix[:,1]
-    thr = data_matrix[:,2]
-
-    # 2D: 
-    one_two = plot_2d(one, two, title=title, labels=["1st t-SNE component", "2nd T-SNE component"])
-    one_thr = plot_2d(one, thr, title=title, labels=["1st t-SNE component", "3rd T-SNE component"])
-    two_thr = plot_2d(two, thr, title=title, labels=["2nd t-SNE component", "3rd T-SNE component"])
-
-    # 3D: 
-    one_two_thr = plot_3d(one, two, thr, title, ["1st T-SNE component", "2nd T-SNE component", "3rd T-SNE component"])
-
-    return one_two, one_thr, two_thr, one_two_thr
-
-
-def pca_plot(matrix, title):
-    """
-    Returns a matplotlib figure containing the 2D and 3D PCA plots.
-    
-    Args:
-        matrix: ndarray of (n_samples, n_features)
-    """
-    # Note, input should be: X: 
-    data_matrix = PCA(n_components=3).fit_transform(matrix)
-    # Define compoments: 
-    one = data_matrix[:,0]
-    two = data_matrix[:,1]
-    thr = data_matrix[:,2]
-
-    # 2D: 
-    one_two = plot_2d(one, two, title=title, labels=["1st PCA component", "2nd T-SNE component"])
-    one_thr = plot_2d(one, thr, title=title, labels=["1st PCA component", "3rd T-SNE component"])
-    two_thr = plot_2d(two, thr, title=title, labels=["2nd PCA component", "3rd T-SNE component"])
-
-    # 3D: 
-    one_two_thr = plot_3d(one, two, thr, title, ["1st PCA component", "2nd PCA component", "3rd PCA component"])
-
-    return one_two, one_thr, two_thr, one_two_thr
-
-
-def plot_2d(x, y, title, labels):
-    """
-    Returns a matplotlib figure containing the 2D T-SNE plot.
-    
-    Args:
-        x, y, z: arrays
-        title: string with name of the plot
-        labels: list of strings with label names: [x, y, z]
-    """
-    plt.rcParams.update({'font.size': 40, 'legend.fontsize': 20})
-    plt.rc('font', size=30)
-    plt.rc('axes', titlesize=35)
-
-    figure, ax = plt.subplots(figsize=(10, 10))
-    ax.scatter(x, y)
-    ax.set_title(title) 
-    ax.set_xlabel(labels[0])
-    ax.set_ylabel(labels[1])
-    plt.grid()
-    
-    plt.tight_layout()
-
-    return figure    
-
-
-def plot_3d(x, y, z, title, labels):
-    """
-    Returns a matplotlib figure containing the 3D T-SNE plot.
-    
-    Args:
-        x, y, z: arrays
-        title: string with name of the plot
-        labels: list of strings with label names: [x, y, z]
-    """
-    plt.rcParams.update({'font.size': 30, 'legend.fontsize': 20})
-    plt.rc('font', size=30)
-    plt.rc('axes', titlesize=35)
-    labelpad = 30
-
-    figure = plt.figure(figsize=(12,12))
-    ax = figure.add_subplot(projection='3d')
-    ax.scatter(x, y, z)
-    ax.set_title(title) 
-    ax.set_xlabel(labels[0], labelpad=labelpad)
-    ax.set_ylabel(labels[1], labelpad=labelpad)
-    ax.set_zlabel(labels[2], labelpad=labelpad)
-    plt.tight_layout()
-
-    return figure
-
-
-def save_plot(one_two, one_thr, two_thr, one_two_thr, title, plot_type="pca_tsne", save_dir = "luke_experiments"):    
-    temp_dir = os.path.join(save_dir, "plots_meta_analysis", plot_type)
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
-
-    one_two.savefig(f"{temp_dir}/{title}_one_two")
-    one_thr.savefig(f"{temp_dir}/{title}_one_thr")
-    two_thr.savefig(f"{temp_dir}/{title}_two_thr")
-    one_two_thr.savefig(f"{temp_dir}/{title}_one_two_thr")
 
+def embedding_job(method, matrix, title, file_title, plot_dir, cache_dir, max_samples=None):
+    output_files = [os.path.join(plot_dir, f"{file_title}_{suffix}.png") for suffix in PLOT_SUFFIXES]
+    kwargs = dict(cache_dir=cache_dir, max_samples=max_samples)
+    return RenderJob(embedding_plots, (method, matrix, title), output_files, kwargs=kwargs)
 
-# ================================================================================================
 
-#
-data_dir = "../data/outputs/seed_experiment_500"
-output_dir = "."
-tsne_save = True
-#
+# ================================================================================================
 
 # Define path to data source: 
 
@@ -148,13 +37,8 @@ parser.set_defaults(tsne_save=True)
 parser.add_argument('--save-pca', dest='pca_save', action='store_true')
 parser.add_argument('--no-save-pca', dest='pca_save', action='store_false')
 parser.set_defaults(pca_save=True)
-
-args = parser.parse_args()
-
-data_dir = args.data_dir
-output_dir = args.output_dir
-tsne_save = args.tsne_save
-pca_save = args.pca_save
+parser.add_argument("--max-samples", type=int, default=None, help="Maximum number of rows embedded per plot")
+parser.add_argument("--num-workers", type=int, default=None, help="Number of processes rendering the figures (0: no pool)")
 
 
 def run():
@@ -181,8 +65,9 @@ def run():
 
                 confusion_matrices[eval_set][dir_] = {}
                 
-                y_true = one_hot_encoding(evaluations[eval_set]["true_labels"], add_reject=True)
-                y_pred = one_hot_encoding(evaluations[eval_set]["predict_logits"], add_reject=True)
+                predict_logits, true_labels = load_evaluation_arrays(evaluations[eval_set], os.path.join(root, dir_))
+                y_true = one_hot_encoding(true_labels, add_reject=True)
+                y_pred = one_hot_encoding(predict_logits, add_reject=True)
 
                 ##############################
                 ######## Multi-label #########
@@ -203,7 +88,16 @@ def run():
                 confusion_matrices[eval_set][dir_]["multi_label_only"] = multilabel_confusion_matrix(y_true_multi, y_pred_multi)
 
     ##############################
-    # T-SNE analysis
+    # T-SNE and PCA analysis
+    plot_root = os.path.join(output_dir, "plots_meta_analysis")
+    cache_dir = os.path.join(plot_root, "embedding_cache")
+    methods = []
+    if tsne_save:
+        methods.append(("tsne", "t-SNE", "plots_tsne"))
+    if pca_save:
+        methods.append(("pca", "PCA", "plots_pca"))
+
+    jobs = []
     for eval_set in eval_sets: 
         multi_label_all     = [confusion_matrices[eval_set][z]["multi_label_all"] for z in confusion_matrices[eval_set].keys()]
         single_label_only   = [confusion_matrices[eval_set][z]["single_label_only"] for z in confusion_matrices[eval_set].keys()]
@@ -222,24 +116,31 @@ def run():
         if eval_set == "dev":
             eval_title = "Development set"
 
-        one_two_sing, one_thr_sing, two_thr_sing, one_two_thr_sing = tsne_plot(matrix_sinlge, title=f"t-SNE - Seed Experiment\nSingle-labelled\n{eval_title}")
-        one_two_m_only, one_thr_m_only, two_thr_m_only, one_two_thr_m_only = tsne_plot(matrix_multi_label_only, title=f"t-SNE - Seed Experiment\nMulti-labelled\n{eval_title}")
-        one_two_all, one_thr_all, two_thr_all, one_two_thr_all = tsne_plot(matrix_multi_label_all, title=f"t-SNE - Seed Experiment\nSingle-labelled & Multi-labelled\n{eval_title}")
+        matrices = [
+            (matrix_sinlge, "Single-labelled", "single_label_only"),
+            (matrix_multi_label_only, "Multi-labelled", "multi_label_only"),
+            (matrix_multi_label_all, "Single-labelled & Multi-labelled", "multi_label_all"),
+        ]
+        for method, method_name, plot_type in methods:
+            for matrix, matrix_title, matrix_name in matrices:
+                title = f"{method_name} - Seed Experiment\n{matrix_title}\n{eval_title}"
+                plot_dir = os.path.join(plot_root, plot_type)
+                jobs.append(embedding_job(method, matrix, title, f"{eval_set}_{matrix_name}", plot_dir, cache_dir, max_samples))
 
-        pca_one_two_sing, pca_one_thr_sing, pca_two_thr_sing, pca_one_two_thr_sing = pca_plot(matrix_sinlge, title=f"PCA - Seed Experiment\nSingle-labelled\n{eval_title}")
-        pca_one_two_m_only, pca_one_thr_m_only, pca_two_thr_m_only, pca_one_two_thr_m_only = pca_plot(matrix_multi_label_only, title=f"PCA - Seed Experiment\nMulti-labelled\n{eval_title}")
-        pca_one_two_all, pca_one_thr_all, pca_two_thr_all, pca_one_two_thr_all = pca_plot(matrix_multi_label_all, title=f"PCA - Seed Experiment\nSingle-labelled & Multi-labelled\n{eval_title}")
-
-        if tsne_save: 
-            save_plot(one_two_sing, one_thr_sing, two_thr_sing, one_two_thr_sing, f"{eval_set}_single_label_only", plot_type="plots_tsne")
-            save_plot(one_two_m_only, one_thr_m_only, two_thr_m_only, one_two_thr_m_only, f"{eval_set}_multi_label_only", plot_type="plots_tsne")
-            save_plot(one_two_all, one_thr_all, two_thr_all, one_two_thr_all, f"{eval_set}_multi_label_all", plot_type="plots_tsne")
-        
-        if pca_save:
-            save_plot(pca_one_two_sing, pca_one_thr_sing, pca_two_thr_sing, pca_one_two_thr_sing, title=f"{eval_set}_single_label_only", plot_type="plots_pca")
-            save_plot(pca_one_two_m_only, pca_one_thr_m_only, pca_two_thr_m_only, pca_one_two_thr_m_only, f"{eval_set}_multi_label_only", plot_type="plots_pca")
-            save_plot(pca_one_two_all, pca_one_thr_all, pca_two_thr_all, pca_one_two_thr_all, f"{eval_set}_multi_label_all", plot_type="plots_pca")
+    # The figures are rendered in parallel, and only if their inputs have changed since they were last rendered: 
+    render_figures(jobs, plot_root, num_workers=num_workers)
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+
+    args = parser.parse_args()
+
+    data_dir = args.data_dir
+    output_dir = args.output_dir
+    tsne_save = args.tsne_save
+    pca_save = args.pca_save
+    num_workers = args.num_workers
+    max_samples = args.max_samples
+
+    run()
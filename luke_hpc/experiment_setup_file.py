@@ -26,9 +26,11 @@ To change parameter: data-dir = data_dir, num-train-epochs = num_train_epochs, e
     @click.option("--warmup-proportion", default=0.06)
     @click.option("--gradient-accumulation-steps", default=1)
     @click.option("--fp16", is_flag=True)
+    @click.option("--fp16-backend", default="auto", type=click.Choice(["auto", "apex", "native"]))
     @click.option("--fp16-opt-level", default="O2")
     @click.option("--fp16-min-loss-scale", default=1)
     @click.option("--fp16-max-loss-scale", default=4)
+    @click.option("--bf16", is_flag=True)
     @click.option("--save-steps", default=0)
     @click.option("--save-model/--dont-save-model", is_flag=True)
 
@@ -37,93 +39,54 @@ To change parameter: data-dir = data_dir, num-train-epochs = num_train_epochs, e
 
 
 # ========================================================================
+import logging
 import os
-import subprocess
-import numpy as np
-import inspect
+import sys
 
+sys.path.insert(0, os.getcwd())  # the script is run from the root directory of the repository
 
-def retrieve_name(var):
-    callers_local_vars = inspect.currentframe().f_back.f_locals.items()
-    return [var_name for var_name, var_val in callers_local_vars if var_val is var]
+from examples.utils.sweep import run_sweep
 
 
-def experiment(output_dir=".", **kwags):
+def experiment(output_dir=".", gpu_ids=("0",), max_retries=1, **kwags):
+    """Runs a sweep over the given hyperparameters (all combinations if multiple are given) using the sweep scheduler
+    in examples/utils/sweep.py. The trials run concurrently on the given GPUs and completed trials are skipped."""
     # Path parameters: 
-    model_file  = "luke_large_500k.tar.gz"
-    data_dir    = "data/OpenEntity"
-    output_dir  = output_dir 
-    saving_model= "dont-save-model"
+    global_args = {"model-file": "luke_large_500k.tar.gz"}
 
     # Hyperparameter: 
-    train_batch_size            = 2
-    gradient_accumulation_steps = 2
-    learning_rate               = 1e-5
-    num_train_epochs            = 10
-    seed                        = 12
-    train_frac_size             = 1.0
-    weight_decay                = 0.01
-    hidden_dropout_prob         = 0.1
-
-    experiment_tag = list(kwags.keys())[0]
-    loop_items = list(kwags.values())[0]
-
-    # Experiment: 
-    for loop_item in loop_items: 
-        # Naming:         
-        if experiment_tag == "gradient_accumulation_steps":
-            gradient_accumulation_steps = loop_item
-        if experiment_tag == "num_train_epochs":
-            num_train_epochs = loop_item
-        if experiment_tag == "train_batch_size":
-            train_batch_size = loop_item
-            gradient_accumulation_steps = 1
-        if experiment_tag == "learning_rate":
-            learning_rate = loop_item
-        if experiment_tag == "seed":
-            seed = loop_item
-        if experiment_tag == "train_frac_size":
-            train_frac_size = loop_item
-        if experiment_tag == "weight_decay":
-            weight_decay = loop_item
-        if experiment_tag == "hidden_dropout_prob":
-            hidden_dropout_prob = loop_item
-
-        # if type(loop_item) is np.float64:
-        #     loop_item_str = str(loop_item).replace(".", "_")
-        #     temp_output_dir = os.path.join(output_dir, f"robust_{experiment_tag}_{loop_item_str}")
-        # else:
-        
-        temp_output_dir = os.path.join(output_dir, f"robust_{experiment_tag}_{loop_item}")
-        
-        if os.path.exists(temp_output_dir): 
-            continue 
-            # examples/cli.py -> makes output_dir
-        
-        # Terminal command: 
-        subprocess.call((
-            f"python", "-m",
-            f"examples.cli",
-            f"--model-file={model_file}",
-            f"--output-dir={temp_output_dir}",
-            f"entity-typing", "run",
-            f"--data-dir={data_dir}",
-            f"--fp16",
-            f"--do-evaluate-prior-train",
-            f"--seed={seed}",
-            f"--{saving_model}",
-            f"--num-train-epochs={num_train_epochs}",
-            f"--gradient-accumulation-steps={gradient_accumulation_steps}",
-            f"--train-batch-size={train_batch_size}",
-            f"--learning-rate={learning_rate}",
-            f"--train-frac-size={train_frac_size}",
-            f"--weight-decay={weight_decay}",
-            f"--hidden-dropout-prob={hidden_dropout_prob}"
-        ))
+    args = {
+        "data-dir": "data/OpenEntity",
+        "fp16": True,
+        "do-evaluate-prior-train": True,
+        "dont-save-model": True,
+        "train-batch-size": 2,
+        "gradient-accumulation-steps": 2,
+        "learning-rate": 1e-5,
+        "num-train-epochs": 10,
+        "seed": 12,
+        "train-frac-size": 1.0,
+        "weight-decay": 0.01,
+        "hidden-dropout-prob": 0.1,
+    }
+    if "train_batch_size" in kwags:
+        args["gradient-accumulation-steps"] = 1
+
+    spec = {
+        "global_args": global_args,
+        "command": ["entity-typing", "run"],
+        "args": args,
+        "grid": {name.replace("_", "-"): list(values) for name, values in kwags.items()},
+        "name-prefix": "robust_",
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    return run_sweep(spec, output_dir, list(gpu_ids), max_retries=max_retries)
 
 
 # ========================================================================
 
+logging.basicConfig(level=logging.INFO)
 
 output_dir = "data/outputs/seed_lr_wd_batch_train_size_dropout_with_eval_no_train_dropout"
 # experiment(output_dir=output_dir, seed = list(range(10,21,1)))                                                      # Default: 12     
@@ -132,7 +95,8 @@ output_dir = "data/outputs/seed_lr_wd_batch_train_size_dropout_with_eval_no_trai
 # experiment(output_dir=output_dir, train_batch_size = [1, 2, 4, 8, 16, 32, 64])                                      # Default: 4 [2 + gradient_accumulation_steps = 2]
 # experiment(output_dir=output_dir, train_batch_size = [1]) # set gradient_accumulation_steps = 1
 # experiment(output_dir=output_dir, train_frac_size = [0.002, 0.003, 0.004, 0.005, 0.01, 0.05, 0.1, 0.2, 0.4, 0.6, 0.8, 1.0])       # Default: 1.0
-# experiment(output_dir=output_dir, hidden_dropout_prob = np.round(np.arange(0, 1, 0.1),2))                         # Default: 0.01
+# experiment(output_dir=output_dir, hidden_dropout_prob = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9])         # Default: 0.01
+# experiment(output_dir=output_dir, gpu_ids=("0", "0"), seed = list(range(10,21,1)))  # two concurrent trials on GPU 0
 
 
 # Move: out and err files: 
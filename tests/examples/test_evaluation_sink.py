@@ -0,0 +1,30 @@
+import numpy as np
+import torch
+
+from examples.utils.evaluation_sink import EvaluationSink, get_file_references
+
+
+def test_evaluation_sink(tmpdir):
+    sink = EvaluationSink(3, output_prefix=str(tmpdir.join("dev")))
+    sink.add(torch.tensor([[0.5, -1.0], [2.0, 0.0]]), torch.tensor([[1, 0], [1, 1]]))
+    sink.add(np.array([[-0.5, 1.5]]), np.array([[0, 1]]))
+    logits, labels = sink.close()
+
+    assert logits.dtype == np.float32 and labels.dtype == np.int8
+    file_references = get_file_references("dev")
+    loaded_logits = np.load(str(tmpdir.join(file_references["predict_logits_file"])))
+    loaded_labels = np.load(str(tmpdir.join(file_references["true_labels_file"])))
+    np.testing.assert_array_equal(loaded_logits, [[0.5, -1.0], [2.0, 0.0], [-0.5, 1.5]])
+    np.testing.assert_array_equal(loaded_labels, [[1, 0], [1, 1], [0, 1]])
+
+
+def test_evaluation_sink_with_padded_logits():
+    sink = EvaluationSink(2, logits_shape=(2, 4))
+    sink.add(torch.ones(1, 2, 3))
+    sink.add(torch.zeros(1, 2, 4))
+    logits, labels = sink.close()
+
+    assert labels is None
+    assert np.isnan(logits[0, :, 3]).all()
+    np.testing.assert_array_equal(logits[0, :, :3], np.ones((2, 3)))
+    np.testing.assert_array_equal(logits[1], np.zeros((2, 4)))
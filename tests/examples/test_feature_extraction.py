@@ -0,0 +1,129 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from examples.utils.feature_extraction import FeatureExtractor, load_features, write_features
+from luke.model import LukeConfig, LukeEntityAwareAttentionModel
+
+
+def collate_fn(batch):
+    return dict(word_ids=torch.tensor(batch), labels=torch.tensor(batch) % 2)
+
+
+def extractor(inputs):
+    word_ids = inputs["word_ids"].float()
+    return dict(cls=torch.stack([word_ids, -word_ids], dim=1).half().numpy())
+
+
+def test_write_features(tmpdir):
+    output_dir = str(tmpdir)
+    features = list(range(10))
+    index = write_features(extractor, features, collate_fn, output_dir, batch_size=3, shard_size=4)
+    assert [(shard["start"], shard["end"]) for shard in index["shards"]] == [(0, 4), (4, 8), (8, 10)]
+
+    ids, cls = load_features(output_dir, "cls")
+    assert ids.tolist() == features
+    assert cls.dtype == np.float16
+    assert cls[:, 0].tolist() == features
+    labels = np.load(os.path.join(output_dir, index["shards"][1]["files"]["labels"]))
+    assert labels.tolist() == [0, 1, 0, 1]
+
+
+def test_write_features_resume(tmpdir):
+    output_dir = str(tmpdir)
+    features = list(range(10))
+    write_features(extractor, features, collate_fn, output_dir, batch_size=3, shard_size=4)
+
+    # drop the last shard from the index as if the extraction had been interrupted
+    with open(os.path.join(output_dir, "index.json")) as f:
+        index = json.load(f)
+    index["shards"] = index["shards"][:2]
+    with open(os.path.join(output_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+
+    calls = []
+
+    def counting_extractor(inputs):
+        calls.append(inputs["word_ids"].tolist())
+        return extractor(inputs)
+
+    index = write_features(counting_extractor, features, collate_fn, output_dir, batch_size=3, shard_size=4)
+    assert calls == [[8, 9]]
+    assert len(index["shards"]) == 3
+    assert load_features(output_dir, "cls")[1][:, 1].tolist() == [-i for i in features]
+
+    with pytest.raises(RuntimeError):
+        write_features(extractor, features, collate_fn, output_dir, batch_size=3, shard_size=5)
+
+
+def test_feature_extractor():
+    torch.manual_seed(0)
+    config = LukeConfig(
+        vocab_size=100,
+        entity_vocab_size=3,
+        bert_model_name="bert-base-uncased",
+        hidden_size=32,
+        num_hidden_layers=3,
+        num_attention_heads=4,
+        intermediate_size=37,
+        max_position_embeddings=64,
+    )
+    model = LukeEntityAwareAttentionModel(config)
+    model.eval()
+
+    batch_size, word_size, entity_size = 2, 7, 2
+    entity_position_ids = torch.full((batch_size, entity_size, 4), -1, dtype=torch.long)
+    entity_position_ids[:, 0, :2] = torch.tensor([1, 2])
+    entity_position_ids[:, 1, 0] = 4
+    inputs = dict(
+        word_ids=torch.randint(1, 100, (batch_size, word_size)),
+        word_segment_ids=torch.zeros(batch_size, word_size, dtype=torch.long),
+        word_attention_mask=torch.ones(batch_size, word_size, dtype=torch.long),
+        entity_ids=torch.tensor([[1, 2]] * batch_size),
+        entity_position_ids=entity_position_ids,
+        entity_segment_ids=torch.zeros(batch_size, entity_size, dtype=torch.long),
+        entity_attention_mask=torch.ones(batch_size, entity_size, dtype=torch.long),
+    )
+
+    arrays = FeatureExtractor(model, layers=(1, 2))(inputs)
+    assert {name: array.shape for name, array in arrays.items()} == {
+        "entity": (batch_size, entity_size, 32),
+        "cls": (batch_size, 32),
+        "pooled": (batch_size, 32),
+        "layer1_entity": (batch_size, entity_size, 32),
+        "layer1_cls": (batch_size, 32),
+        "layer2_entity": (batch_size, entity_size, 32),
+        "layer2_cls": (batch_size, 32),
+    }
+    assert all(array.dtype == np.float16 for array in arrays.values())
+
+    # run the encoder layer by layer
+    with torch.no_grad():
+        word_hidden_states = model.embeddings(inputs["word_ids"], inputs["word_segment_ids"])
+        entity_hidden_states = model.entity_embeddings(
+            inputs["entity_ids"], inputs["entity_position_ids"], inputs["entity_segment_ids"]
+        )
+        attention_mask = model._compute_extended_attention_mask(
+            inputs["word_attention_mask"], inputs["entity_attention_mask"]
+        )
+        expected = {}
+        for i, layer_module in enumerate(model.encoder.layer):
+            word_hidden_states, entity_hidden_states = layer_module(
+                word_hidden_states, entity_hidden_states, attention_mask
+            )[:2]
+            expected[f"layer{i + 1}_entity"] = entity_hidden_states
+            expected[f"layer{i + 1}_cls"] = word_hidden_states[:, 0]
+        expected["entity"] = entity_hidden_states
+        expected["cls"] = word_hidden_states[:, 0]
+        expected["pooled"] = model.pooler(word_hidden_states)
+
+        word_outputs, entity_outputs = model(**inputs)[:2]
+    assert torch.allclose(expected["entity"], entity_outputs)
+    assert torch.allclose(expected["cls"], word_outputs[:, 0])
+
+    for name, array in arrays.items():
+        np.testing.assert_allclose(array, expected[name].numpy(), rtol=1e-2, atol=1e-2)
+    assert not np.allclose(arrays["layer1_cls"], arrays["layer2_cls"], atol=1e-2)
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+import urllib.request
+from argparse import Namespace
+
+import pytest
+import torch
+
+from examples.utils.inference_server import InferenceServer, _create_request_handler, _ThreadingHTTPServer
+
+
+class DummyModel(torch.nn.Module):
+    """Returns the sum of the word ids of each instance and fails on the batches containing a negative word id."""
+
+    def __init__(self):
+        super(DummyModel, self).__init__()
+        self.batch_sizes = []
+
+    def forward(self, word_ids, **kwargs):
+        self.batch_sizes.append(word_ids.size(0))
+        if (word_ids < 0).any():
+            raise ValueError("negative word id")
+        return word_ids.sum(dim=1, keepdim=True)
+
+
+def featurize(instance):
+    word_ids = [instance] * (abs(instance) % 3 + 1)
+    return Namespace(
+        word_ids=word_ids,
+        word_segment_ids=[0] * len(word_ids),
+        word_attention_mask=[1] * len(word_ids),
+        entity_ids=[1],
+        entity_position_ids=[[0, -1]],
+        entity_segment_ids=[0],
+        entity_attention_mask=[1],
+    )
+
+
+def _create_server(model, max_batch_size=4, max_latency_ms=50.0):
+    return InferenceServer(
+        model,
+        featurize,
+        lambda output: int(output[0]),
+        pad_token_id=0,
+        device=torch.device("cpu"),
+        max_batch_size=max_batch_size,
+        max_latency_ms=max_latency_ms,
+        num_workers=1,
+        num_threads=1,
+        metrics_window_size=100,
+    )
+
+
+def test_predict_batching():
+    model = DummyModel()
+    server = _create_server(model, max_batch_size=4, max_latency_ms=1000.0)
+    # the requests are queued before the worker starts so that they are batched deterministically
+    futures = [server.predict(i) for i in range(10)]
+    server.start()
+    try:
+        results = [future.result(timeout=10) for future in futures]
+    finally:
+        server.stop()
+
+    assert results == [i * (i % 3 + 1) for i in range(10)]
+    assert model.batch_sizes == [4, 4, 2]
+    metrics = server.metrics()
+    assert metrics["num_requests"] == 10
+    assert metrics["num_batches"] == 3
+    assert metrics["num_errors"] == 0
+    assert metrics["average_batch_size"] == 10 / 3
+
+
+def test_predict_deadline():
+    model = DummyModel()
+    server = _create_server(model, max_batch_size=32, max_latency_ms=50.0)
+    server.start()
+    try:
+        start_time = time.time()
+        futures = [server.predict(i) for i in range(3)]
+        # the batch is run once the deadline of the oldest request has passed although it is not full
+        assert [future.result(timeout=10) for future in futures] == [0, 2, 6]
+        assert time.time() - start_time >= 0.05
+    finally:
+        server.stop()
+
+    assert model.batch_sizes == [3]
+
+
+def test_predict_error():
+    model = DummyModel()
+    server = _create_server(model, max_batch_size=3, max_latency_ms=1000.0)
+    futures = [server.predict(i) for i in (1, -1, 2, 3)]
+    server.start()
+    try:
+        for future in futures[:3]:
+            with pytest.raises(ValueError):
+                future.result(timeout=10)
+        assert futures[3].result(timeout=10) == 3
+    finally:
+        server.stop()
+
+    metrics = server.metrics()
+    assert metrics["num_errors"] == 3
+    assert metrics["num_requests"] == 1
+    assert metrics["num_batches"] == 1
+
+
+def test_http_server():
+    server = _create_server(DummyModel(), max_batch_size=4, max_latency_ms=10.0)
+    http_server = _ThreadingHTTPServer(("127.0.0.1", 0), _create_request_handler(server))
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    server.start()
+    thread.start()
+    url = f"http://127.0.0.1:{http_server.server_address[1]}"
+
+    def request(path, data=None):
+        if data is not None:
+            data = json.dumps(data).encode("utf-8")
+        try:
+            with urllib.request.urlopen(url + path, data=data, timeout=10) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    try:
+        assert request("/predict", 2) == (200, 6)
+        assert request("/predict", [1, 2, 3]) == (200, [2, 6, 3])
+        assert request("/predict", [1, -1])[0] == 500
+        assert request("/unknown")[0] == 404
+
+        status, metrics = request("/metrics")
+        assert status == 200
+        # the two instances of the failed request may be run in separate batches
+        assert metrics["num_requests"] + metrics["num_errors"] == 6
+        assert metrics["num_errors"] >= 1
+        assert metrics["latency_p99_ms"] >= metrics["latency_p50_ms"] > 0.0
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+        server.stop()
@@ -0,0 +1,246 @@
+import logging
+from collections import Counter, namedtuple
+
+import joblib
+import marisa_trie
+import pytest
+from transformers.tokenization_bert import BasicTokenizer
+
+from examples.utils import mention_db
+from examples.utils.mention_db import SEP_CHAR, BertLowercaseNormalizer, EntityLinker, MentionDB
+from luke.utils.entity_vocab import EntityVocab
+
+Paragraph = namedtuple("Paragraph", ["text", "wiki_links"])
+WikiLink = namedtuple("WikiLink", ["title", "text"])
+
+PAGES = {
+    "Apple Inc.": [
+        Paragraph(
+            "Apple Inc. makes the iPhone. Apple is based in Cupertino.",
+            [WikiLink("IPhone", "iPhone"), WikiLink("Cupertino", "Cupertino")],
+        )
+    ],
+    "Apple": [
+        Paragraph("An apple is a fruit of the apple tree.", [WikiLink("Malus", "apple tree")]),
+        Paragraph("Apple is not Apple Inc.", [WikiLink("Apple Inc.", "Apple Inc."), WikiLink("Apple Inc.", "Apple")]),
+    ],
+    "Cupertino": [
+        Paragraph(
+            "Cupertino is home to Apple and to the apple orchards of Cupertino.",
+            [WikiLink("Apple Inc.", "Apple"), WikiLink("Apple", "apple"), WikiLink("Cupertino", "Cupertino")],
+        )
+    ],
+    "IPhone": [
+        Paragraph("The iPhone is made by Apple.", [WikiLink("Apple Inc.", "Apple"), WikiLink("iPhone", "iPhone")])
+    ],
+    "Malus": [Paragraph("Malus is a genus of trees, such as the apple tree.", [WikiLink("Apple", "apple")])],
+}
+REDIRECTS = {"iPhone": "IPhone"}
+
+
+class DummyDumpDB(object):
+    def page_size(self):
+        return len(PAGES)
+
+    def titles(self):
+        return iter(PAGES)
+
+    def get_paragraphs(self, title):
+        return PAGES[title]
+
+    def resolve_redirect(self, title):
+        return REDIRECTS.get(title, title)
+
+
+def _build_expected_items(dump_db, tokenizer, normalizer, max_mention_length):
+    """Counts the names and entities in memory as the mention DB did before the counts were spilled to disk."""
+    MentionDB._initialize_worker(dump_db, tokenizer, normalizer, max_mention_length)
+    name_entity_counter = Counter(
+        pair for title in dump_db.titles() for pair in MentionDB._extract_name_entity_pairs(title)
+    )
+
+    name_trie = marisa_trie.Trie(name for name, _ in name_entity_counter)
+    MentionDB._initialize_worker(dump_db, tokenizer, normalizer, max_mention_length, name_trie)
+    name_doc_counter = Counter(
+        name for title in dump_db.titles() for name in MentionDB._extract_name_occurrences(title)
+    )
+
+    items = {}
+    for name in name_trie:
+        entity_counts = [(title, count) for (n, title), count in name_entity_counter.items() if n == name]
+        total_link_count = sum(count for _, count in entity_counts)
+        items[name] = [(title, count, total_link_count, name_doc_counter[name]) for title, count in entity_counts]
+    return items
+
+
+def _build_mention_db(out_file, buffer_size):
+    MentionDB.build_from_wikipedia(
+        DummyDumpDB(),
+        BasicTokenizer(do_lower_case=False),
+        BertLowercaseNormalizer(),
+        out_file,
+        min_link_prob=0.0,
+        max_candidate_size=100,
+        min_link_count=1,
+        max_mention_length=5,
+        pool_size=2,
+        chunk_size=1,
+        buffer_size=buffer_size,
+    )
+
+
+@pytest.fixture(scope="module")
+def mention_db_file(tmpdir_factory):
+    out_file = str(tmpdir_factory.mktemp("mention_db").join("mention.db"))
+    _build_mention_db(out_file, buffer_size=100)
+    return out_file
+
+
+@pytest.fixture
+def entity_vocab(tmpdir):
+    # Malus is not in the vocabulary
+    vocab_file = str(tmpdir.join("entity_vocab.tsv"))
+    with open(vocab_file, "w") as f:
+        for title in ("[PAD]", "[UNK]", "[MASK]", "Apple Inc.", "Apple", "IPhone", "Cupertino"):
+            f.write(f"{title}\t1\n")
+    return EntityVocab(vocab_file)
+
+
+def test_merge_runs(tmpdir):
+    counters = [Counter({"b": 1, "a": 2}), Counter({"c": 4, "a": 1}), Counter(), Counter({"b": 2, "d": 1})]
+    run_files = [mention_db._write_run(counter, str(tmpdir), block_size=1) for counter in counters]
+    assert list(mention_db._merge_runs(run_files)) == sorted(sum(counters, Counter()).items())
+
+
+def test_build_from_wikipedia(tmpdir, monkeypatch):
+    run_files = []
+
+    def write_run(counter, temp_dir):
+        run_files.append(mention_db_write_run(counter, temp_dir))
+        return run_files[-1]
+
+    mention_db_write_run = mention_db._write_run
+    monkeypatch.setattr(mention_db, "_write_run", write_run)
+
+    out_file = str(tmpdir.join("mention.db"))
+    _build_mention_db(out_file, buffer_size=2)
+    # both passes spill several runs
+    assert len(run_files) >= 6
+
+    data = joblib.load(out_file)
+    title_trie, data_trie = data["title_trie"], data["data_trie"]
+    actual = {
+        name: [(title_trie.restore_key(title_id), *counts) for title_id, *counts in data_trie[name]]
+        for name in data_trie.keys()
+    }
+    expected = _build_expected_items(DummyDumpDB(), BasicTokenizer(do_lower_case=False), BertLowercaseNormalizer(), 5)
+    # the records of a name are ordered by their packed values in the trie
+    assert {name: sorted(items) for name, items in actual.items()} == {k: sorted(v) for k, v in expected.items()}
+    assert sorted(data["mention_trie"].keys()) == sorted(expected.keys())
+    assert sorted(actual["apple"]) == [("Apple", 2, 5, 5), ("Apple Inc.", 3, 5, 5)]
+    assert actual[SEP_CHAR.join(["apple", "tree"])] == [("Malus", 1, 1, 2)]
+
+
+@pytest.mark.parametrize("normalization_cache_size", [0, 1000])
+def test_query_many(mention_db_file, normalization_cache_size):
+    db = MentionDB(mention_db_file, normalization_cache_size=normalization_cache_size)
+    queries = [
+        "Apple",
+        "apple tree",
+        "Unknown",
+        ["APPLE"],
+        ["[MASK]"],
+        ["Cupertino", "[MASK]"],
+        "",
+        "CUPERTINO",
+        "Apple",
+    ]
+    # the query is repeated so that the second one hits the cache
+    for _ in range(2):
+        offsets, records = db.query_many(queries)
+        assert offsets.shape == (len(queries) + 1,)
+        assert records.shape == (offsets[-1], 4)
+        for i, query in enumerate(queries):
+            expected = [(m.title, m.link_count, m.total_link_count, m.doc_count) for m in db.query(query)]
+            actual = [(db.get_title(r[0]), *r[1:].tolist()) for r in records[offsets[i] : offsets[i + 1]]]
+            assert actual == expected
+
+    assert offsets[1] > offsets[0]
+    assert offsets[3] == offsets[2]
+    assert records[offsets[3] : offsets[4]].tolist() == records[offsets[0] : offsets[1]].tolist()
+    offsets, records = db.query_many([])
+    assert offsets.tolist() == [0]
+    assert records.shape == (0, 4)
+
+
+def test_normalization_never_lowercases_special_tokens(mention_db_file):
+    db = MentionDB(mention_db_file)
+    assert db._get_name(["[MASK]", "Café", "[UNK]"]) == SEP_CHAR.join(["[MASK]", "cafe", "[UNK]"])
+    # the cached normalization returns the same names as the uncached one
+    for token in ("[MASK]", "[MASK]", "Apple", "Apple", "[PAD]", "Ünïcode", SEP_CHAR):
+        assert db._normalize_token(token) == db._normalize_token_uncached(token)
+    assert db._normalize_token.cache_info().hits > 0
+
+
+TEXT = "Apple makes the iPhone in Cupertino, not the apple tree. Apple Inc. too."
+
+
+def test_detect_mentions(mention_db_file):
+    mentions = MentionDB(mention_db_file).detect_mentions(TEXT)
+    assert sorted((m.span, m.text, m.title) for m in mentions) == [
+        ((0, 5), "Apple", "Apple"),
+        ((0, 5), "Apple", "Apple Inc."),
+        ((16, 22), "iPhone", "IPhone"),
+        ((26, 35), "Cupertino", "Cupertino"),
+        # the longest names are detected instead of the "apple" in them
+        ((45, 55), "apple tree", "Malus"),
+        ((57, 67), "Apple Inc.", "Apple Inc."),
+    ]
+    assert [m.start for m in mentions] == sorted(m.start for m in mentions)
+
+
+def test_link(mention_db_file, entity_vocab):
+    db = MentionDB(mention_db_file)
+    entity_vocab_ids = {title: entity_vocab.get_id(title) for title in ("Apple Inc.", "Apple", "IPhone", "Cupertino")}
+
+    mentions = EntityLinker(db, entity_vocab).link(TEXT)
+    # the mention of Malus is dropped because the entity is not in the vocabulary
+    assert [(m["text"], m["start"], m["end"]) for m in mentions] == [
+        ("Apple", 0, 5),
+        ("iPhone", 16, 22),
+        ("Cupertino", 26, 35),
+        ("Apple Inc.", 57, 67),
+    ]
+    # the candidates are sorted by their link counts
+    assert mentions[0]["candidates"] == [
+        dict(entity_id=entity_vocab_ids["Apple Inc."], title="Apple Inc.", prior_prob=0.6),
+        dict(entity_id=entity_vocab_ids["Apple"], title="Apple", prior_prob=0.4),
+    ]
+    assert mentions[0]["link_prob"] == 1.0
+    assert mentions[3]["link_prob"] == 0.5
+
+    mentions = EntityLinker(db, entity_vocab, min_prior_prob=0.5).link(TEXT)
+    assert [c["title"] for c in mentions[0]["candidates"]] == ["Apple Inc."]
+
+    mentions = EntityLinker(db, entity_vocab, max_candidate_size=1).link(TEXT)
+    assert [c["title"] for c in mentions[0]["candidates"]] == ["Apple Inc."]
+    assert len(mentions) == 4
+
+    mentions = EntityLinker(db, entity_vocab, min_link_prob=0.6).link(TEXT)
+    assert [m["text"] for m in mentions] == ["Apple", "iPhone", "Cupertino"]
+
+
+def test_link_documents(mention_db_file, entity_vocab, caplog):
+    caplog.set_level(logging.INFO)
+    linker = EntityLinker(MentionDB(mention_db_file), entity_vocab)
+    documents = [dict(id=0, body=TEXT), dict(id=1), dict(id=2, body="The iPhone."), dict(id=3, body=None)]
+    linked_documents = list(linker.link_documents(documents, text_field="body", pool_size=2, chunk_size=1))
+
+    assert [d["id"] for d in linked_documents] == [0, 1, 2, 3]
+    assert len(linked_documents[0]["mentions"]) == 4
+    assert [m["text"] for m in linked_documents[2]["mentions"]] == ["iPhone"]
+    for document in (linked_documents[1], linked_documents[3]):
+        assert document["mentions"] == []
+        assert "body" in document["error"]
+    assert "error" not in linked_documents[0]
+    assert "Linked 4 documents (2 errors)" in caplog.text
@@ -0,0 +1,52 @@
+from argparse import Namespace
+
+import torch
+
+from examples.relation_classification.model import LukeForRelationClassification
+from examples.utils.model_export import MODEL_INPUT_NAMES, ExportableModel, export_model
+from luke.model import LukeConfig
+
+
+def _create_inputs(batch_size, word_size, max_mention_length):
+    word_attention_mask = torch.ones(batch_size, word_size, dtype=torch.long)
+    word_attention_mask[0, word_size // 2 :] = 0
+    entity_position_ids = torch.full((batch_size, 2, max_mention_length), -1, dtype=torch.long)
+    entity_position_ids[:, 0, :2] = torch.tensor([1, 2])
+    entity_position_ids[:, 1, :1] = 3
+    return dict(
+        word_ids=torch.randint(1, 100, (batch_size, word_size)),
+        word_segment_ids=torch.zeros(batch_size, word_size, dtype=torch.long),
+        word_attention_mask=word_attention_mask,
+        entity_ids=torch.tensor([[1, 2]] * batch_size),
+        entity_position_ids=entity_position_ids,
+        entity_segment_ids=torch.zeros(batch_size, 2, dtype=torch.long),
+        entity_attention_mask=torch.ones(batch_size, 2, dtype=torch.long),
+    )
+
+
+def test_export_model(tmpdir):
+    config = LukeConfig(
+        vocab_size=100,
+        entity_vocab_size=3,
+        bert_model_name="bert-base-uncased",
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=37,
+        max_position_embeddings=64,
+    )
+    model = LukeForRelationClassification(Namespace(model_config=config), num_labels=5)
+    model.eval()
+
+    output_file = str(tmpdir.join("model.pt"))
+    export_model(model, _create_inputs(2, 7, 4), output_file)
+    exported_model = torch.jit.load(output_file)
+
+    # the exported model needs to support batch and sequence sizes different from those used for tracing
+    inputs = _create_inputs(3, 11, 4)
+    with torch.no_grad():
+        expected = ExportableModel(model)(*[inputs[name] for name in MODEL_INPUT_NAMES])
+        actual = exported_model(*[inputs[name] for name in MODEL_INPUT_NAMES])
+
+    assert actual.size() == (3, 5)
+    assert torch.allclose(actual, expected, atol=1e-5)
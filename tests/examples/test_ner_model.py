@@ -0,0 +1,202 @@
+from argparse import Namespace
+
+import numpy as np
+import torch
+
+from examples.ner.main import prune_features
+from examples.ner.model import LukeForNamedEntityRecognition
+from examples.ner.utils import InputFeatures, merge_sentence_features
+from luke.model import LukeConfig
+
+
+def _create_model(span_scorer=False, num_hidden_layers=2):
+    config = LukeConfig(
+        vocab_size=100,
+        entity_vocab_size=3,
+        bert_model_name="bert-base-uncased",
+        hidden_size=32,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=4,
+        intermediate_size=37,
+        max_position_embeddings=64,
+    )
+    args = Namespace(model_config=config, no_word_feature=False, no_entity_feature=False, span_scorer=span_scorer)
+    model = LukeForNamedEntityRecognition(args, num_labels=5)
+    model.eval()
+    return model
+
+
+def _create_feature(spans, labels, sentence_index=0, word_size=8, max_mention_length=4):
+    starts = np.array([start for start, _ in spans], dtype=np.int64)
+    ends = np.array([end for _, end in spans], dtype=np.int64)
+    position_ids = starts[:, np.newaxis] + np.arange(max_mention_length)
+    position_ids[position_ids >= ends[:, np.newaxis]] = -1
+    return InputFeatures(
+        example_index=0,
+        sentence_index=sentence_index,
+        word_ids=np.arange(1, word_size + 1, dtype=np.int64),
+        word_segment_ids=np.zeros(word_size, dtype=np.int64),
+        word_attention_mask=np.ones(word_size, dtype=np.int64),
+        entity_start_positions=starts,
+        entity_end_positions=ends - 1,
+        entity_ids=np.ones(len(spans), dtype=np.int64),
+        entity_position_ids=position_ids,
+        entity_segment_ids=np.zeros(len(spans), dtype=np.int64),
+        entity_attention_mask=np.ones(len(spans), dtype=np.int64),
+        original_entity_spans=list(spans),
+        labels=np.array(labels, dtype=np.int64),
+    )
+
+
+class DummyScorer(object):
+    """Scores each span by a fixed score looked up by its (start, end) positions."""
+
+    def __init__(self, scores):
+        self.scores = scores
+
+    def eval(self):
+        pass
+
+    def score_spans(
+        self, word_ids, word_segment_ids, word_attention_mask, entity_start_positions, entity_end_positions
+    ):
+        return torch.tensor(
+            [
+                [self.scores.get((s, e), -100.0) for s, e in zip(starts.tolist(), ends.tolist())]
+                for starts, ends in zip(entity_start_positions, entity_end_positions)
+            ]
+        )
+
+
+def _create_args(max_entity_length=8, eval_batch_size=2):
+    return Namespace(
+        max_entity_length=max_entity_length,
+        eval_batch_size=eval_batch_size,
+        tokenizer=Namespace(pad_token_id=0),
+        device=torch.device("cpu"),
+    )
+
+
+def test_score_spans():
+    torch.manual_seed(0)
+    model = _create_model(span_scorer=True)
+    feature = _create_feature([(1, 2), (2, 4), (5, 8)], [1, 0, 2])
+    inputs = {
+        k: torch.as_tensor(getattr(feature, k)).unsqueeze(0)
+        for k in (
+            "word_ids",
+            "word_segment_ids",
+            "word_attention_mask",
+            "entity_start_positions",
+            "entity_end_positions",
+        )
+    }
+    scores = model.score_spans(**inputs)
+    assert scores.size() == (1, 3)
+
+    # the score of a span only depends on its own start and end positions
+    permuted_inputs = dict(inputs)
+    permuted_inputs["entity_start_positions"] = inputs["entity_start_positions"].flip(1)
+    permuted_inputs["entity_end_positions"] = inputs["entity_end_positions"].flip(1)
+    assert torch.allclose(model.score_spans(**permuted_inputs), scores.flip(1), atol=1e-6)
+
+
+def test_prune_features():
+    spans = [(1, 2), (1, 3), (2, 4), (4, 5), (5, 8)]
+    features = [
+        _create_feature(spans[:3], [1, 0, 2], sentence_index=0),
+        _create_feature(spans[3:], [0, 3], sentence_index=0),
+        _create_feature(spans[:2], [4, 0], sentence_index=1),
+    ]
+    # the scores are looked up by the subword positions of the spans (the end position is inclusive)
+    scores = {(1, 1): 0.1, (1, 2): 0.9, (2, 3): 0.5, (4, 4): 0.7, (5, 7): 0.2}
+    pruned_features = prune_features(_create_args(), DummyScorer(scores), features, top_k=3)
+
+    assert len(pruned_features) == 2
+    feature = pruned_features[0]
+    # the three highest-scoring spans are kept in their original order
+    assert feature.original_entity_spans == [(1, 3), (2, 4), (4, 5)]
+    assert feature.labels.tolist() == [0, 2, 0]
+    assert feature.entity_start_positions.tolist() == [1, 2, 4]
+    assert feature.entity_end_positions.tolist() == [2, 3, 4]
+    assert feature.entity_position_ids.tolist() == [[1, 2, -1, -1], [2, 3, -1, -1], [4, -1, -1, -1]]
+    assert feature.entity_chunk_ids is None
+
+    # the second sentence has fewer spans than top_k
+    feature = pruned_features[1]
+    assert feature.original_entity_spans == [(1, 2), (1, 3)]
+    assert feature.labels.tolist() == [4, 0]
+
+
+def test_prune_features_without_pruning():
+    spans = [(1, 2), (1, 3), (2, 4), (4, 5)]
+    features = [_create_feature(spans, [1, 0, 2, 3])]
+    scores = {(1, 1): 0.4, (1, 2): 0.3, (2, 3): 0.2, (4, 4): 0.1}
+    for top_k in (4, 10):
+        (feature,) = prune_features(_create_args(), DummyScorer(scores), features, top_k=top_k)
+        for attr in ("entity_start_positions", "entity_end_positions", "entity_position_ids", "labels"):
+            assert np.array_equal(getattr(feature, attr), getattr(features[0], attr))
+        assert feature.original_entity_spans == spans
+
+    # top_k is capped by max_entity_length
+    (feature,) = prune_features(_create_args(max_entity_length=2), DummyScorer(scores), features, top_k=10)
+    assert feature.original_entity_spans == [(1, 2), (1, 3)]
+
+
+def _create_model_inputs(feature):
+    return {
+        k: torch.as_tensor(getattr(feature, k)).unsqueeze(0)
+        for k in (
+            "word_ids",
+            "word_segment_ids",
+            "word_attention_mask",
+            "entity_start_positions",
+            "entity_end_positions",
+            "entity_ids",
+            "entity_position_ids",
+            "entity_segment_ids",
+            "entity_attention_mask",
+        )
+    }
+
+
+def test_merged_single_chunk():
+    torch.manual_seed(0)
+    model = _create_model()
+    feature = merge_sentence_features([_create_feature([(1, 2), (2, 4), (5, 8)], [1, 0, 2])])
+    inputs = _create_model_inputs(feature)
+    with torch.no_grad():
+        expected = model(**inputs)
+        actual = model(**inputs, entity_chunk_ids=torch.as_tensor(feature.entity_chunk_ids).unsqueeze(0))
+    assert torch.equal(actual, expected)
+
+
+def test_merged_chunks_are_isolated():
+    torch.manual_seed(0)
+    # words attend to the entities of every chunk, so the entities of the other chunks only reach an entity through
+    # the words from the second layer on; with a single layer, they must not affect it at all
+    model = _create_model(num_hidden_layers=1)
+    features = [
+        _create_feature([(1, 2), (2, 4)], [1, 0]),
+        _create_feature([(4, 5), (5, 8)], [0, 3]),
+    ]
+    feature = merge_sentence_features(features)
+    assert feature.entity_chunk_ids.tolist() == [0, 0, 1, 1]
+    inputs = _create_model_inputs(feature)
+    del inputs["entity_start_positions"], inputs["entity_end_positions"]
+    inputs["entity_chunk_ids"] = torch.as_tensor(feature.entity_chunk_ids).unsqueeze(0)
+
+    perturbed_inputs = dict(inputs, entity_ids=torch.tensor([[1, 1, 2, 0]]))
+    # with a single chunk, the entities of the first half attend to those of the second half
+    single_chunk_inputs = dict(inputs, entity_chunk_ids=torch.zeros_like(inputs["entity_chunk_ids"]))
+    perturbed_single_chunk_inputs = dict(perturbed_inputs, entity_chunk_ids=single_chunk_inputs["entity_chunk_ids"])
+
+    with torch.no_grad():
+        entity_states = model._encode_entity_chunks(**inputs)[1]
+        perturbed_entity_states = model._encode_entity_chunks(**perturbed_inputs)[1]
+        single_chunk_entity_states = model._encode_entity_chunks(**single_chunk_inputs)[1]
+        perturbed_single_chunk_entity_states = model._encode_entity_chunks(**perturbed_single_chunk_inputs)[1]
+
+    assert torch.equal(perturbed_entity_states[:, :2], entity_states[:, :2])
+    assert not torch.allclose(perturbed_entity_states[:, 2:], entity_states[:, 2:])
+    assert not torch.allclose(perturbed_single_chunk_entity_states[:, :2], single_chunk_entity_states[:, :2])
@@ -0,0 +1,29 @@
+import numpy as np
+
+from examples.ner.utils import create_entity_position_ids, enumerate_spans, select_non_overlapping_spans
+
+
+def test_enumerate_spans():
+    boundaries = [2, 3, 5, 6]
+    starts, ends = enumerate_spans(boundaries, max_mention_length=3)
+
+    expected = [(start, end) for start in boundaries for end in boundaries if start < end and end - start <= 3]
+    assert list(zip(starts.tolist(), ends.tolist())) == expected
+
+
+def test_enumerate_spans_without_boundaries():
+    starts, ends = enumerate_spans([4], max_mention_length=16)
+    assert len(starts) == 0
+    assert len(ends) == 0
+
+
+def test_create_entity_position_ids():
+    position_ids = create_entity_position_ids([1, 3], [3, 4], max_mention_length=4)
+    assert np.array_equal(position_ids, [[1, 2, -1, -1], [3, -1, -1, -1]])
+
+
+def test_select_non_overlapping_spans():
+    spans = [(0, 2), (1, 3), (3, 4), (2, 3), (0, 1)]
+    scores = [0.5, 0.9, 0.1, 0.2, 0.2]
+
+    assert select_non_overlapping_spans(spans, scores, sequence_length=4) == [1, 4, 2]
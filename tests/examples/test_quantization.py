@@ -0,0 +1,80 @@
+from argparse import Namespace
+
+import torch
+import torch.nn as nn
+
+from examples.relation_classification.model import LukeForRelationClassification
+from examples.utils.quantization import compare_quantized_model, quantize_model
+from luke.model import LukeConfig
+
+
+def _create_model():
+    config = LukeConfig(
+        vocab_size=100,
+        entity_vocab_size=3,
+        bert_model_name="bert-base-uncased",
+        entity_emb_size=16,
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=37,
+        max_position_embeddings=64,
+    )
+    return LukeForRelationClassification(Namespace(model_config=config), num_labels=5)
+
+
+def _is_quantized(module):
+    return isinstance(module, torch.nn.quantized.dynamic.Linear)
+
+
+def test_quantize_model():
+    model = _create_model()
+    quantized_modules = dict(quantize_model(model).named_modules())
+
+    for name in (
+        "encoder.layer.0.attention.self.query",
+        "encoder.layer.0.attention.self.key",
+        "encoder.layer.0.attention.self.value",
+        "encoder.layer.0.attention.self.w2e_query",
+        "encoder.layer.1.attention.self.e2w_query",
+        "encoder.layer.1.attention.self.e2e_query",
+        "encoder.layer.0.intermediate.dense",
+        "encoder.layer.1.output.dense",
+        "classifier",
+    ):
+        assert _is_quantized(quantized_modules[name]), name
+
+    fp32_names = [
+        name
+        for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and not _is_quantized(quantized_modules[name])
+    ]
+    assert sorted(fp32_names) == [
+        "encoder.layer.0.attention.output.dense",
+        "encoder.layer.1.attention.output.dense",
+        "entity_embeddings.entity_embedding_dense",
+        "pooler.dense",
+    ]
+    assert isinstance(quantized_modules["embeddings.word_embeddings"], nn.Embedding)
+    assert isinstance(quantized_modules["entity_embeddings.entity_embeddings"], nn.Embedding)
+
+
+def test_compare_quantized_model():
+    model = _create_model()
+    eval_calls = []
+
+    def evaluate_fn(args, target_model, eval_set):
+        eval_calls.append((args.device.type, eval_set))
+        return dict(f1=0.5)
+
+    args = Namespace(device=torch.device("cpu"), seed=1)
+    results = compare_quantized_model(args, model, evaluate_fn, eval_sets=("dev", "test"))
+
+    assert eval_calls == [("cpu", "dev"), ("cpu", "test")] * 2
+    for name in ("fp32", "int8"):
+        assert results[f"{name}_model_size_mb"] > 0
+        for eval_set in ("dev", "test"):
+            assert results[f"{name}_{eval_set}_f1"] == 0.5
+            assert results[f"{name}_{eval_set}_seconds"] >= 0
+    assert results["int8_model_size_mb"] < results["fp32_model_size_mb"]
+    assert set(results) >= {"int8_dev_speedup", "int8_test_speedup"}
@@ -0,0 +1,63 @@
+import json
+import os
+from argparse import Namespace
+
+import numpy as np
+import pytest
+
+from examples.reading_comprehension.utils.result_writer import Result, _get_best_indexes, write_predictions
+
+NBEST_FIXTURE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../fixtures/reading_comprehension_nbest_ties.json"
+)
+
+
+class DummyTokenizer(object):
+    def convert_tokens_to_string(self, tokens):
+        return " ".join(tokens).replace(" ##", "")
+
+
+def test_get_best_indexes():
+    logits = np.array([1.0, 3.0, 3.0, 2.0, 3.0, 2.0])
+    assert _get_best_indexes(logits, 2).tolist() == [1, 2]
+    assert _get_best_indexes(logits, 4).tolist() == [1, 2, 4, 3]
+    assert _get_best_indexes(logits, 10).tolist() == [1, 2, 4, 3, 5, 0]
+
+
+@pytest.mark.parametrize("version_2_with_negative", [False, True])
+def test_write_predictions_with_ties(tmpdir, version_2_with_negative):
+    doc_tokens = ["The", "quick", "brown", "fox", "jumps", "over", "the", "lazy", "dog"]
+    example = Namespace(qas_id="q0", doc_tokens=doc_tokens)
+    feature = Namespace(
+        example_index=0,
+        unique_id=1000,
+        tokens=["[CLS]", "what", "?", "[SEP]"] + [t.lower() for t in doc_tokens] + ["[SEP]"],
+        token_to_orig_map={4 + i: i for i in range(len(doc_tokens))},
+        token_is_max_context={4 + i: True for i in range(len(doc_tokens))},
+    )
+    # many spans have the same scores, so the n-best entries depend on how the ties are ordered
+    result = Result(1000, [0.5, 0, 0, 0, 2, 1, 2, 1, 2, 0, 0, 1, 0, 0], [0.5, 0, 0, 0, 1, 2, 1, 2, 1, 0, 0, 2, 0, 0])
+
+    output_nbest_file = str(tmpdir.join("nbest_predictions.json"))
+    predictions = write_predictions(
+        [example],
+        [feature],
+        [result],
+        n_best_size=5,
+        max_answer_length=3,
+        do_lower_case=True,
+        output_prediction_file=str(tmpdir.join("predictions.json")),
+        output_nbest_file=output_nbest_file,
+        output_null_log_odds_file=str(tmpdir.join("null_odds.json")),
+        verbose_logging=False,
+        version_2_with_negative=version_2_with_negative,
+        null_score_diff_threshold=0.0,
+        tokenizer=DummyTokenizer(),
+    )
+
+    # the fixture was written by the implementation that sorted all candidates with sorted()
+    with open(NBEST_FIXTURE_FILE) as f:
+        expected = json.load(f)["squad_v2" if version_2_with_negative else "squad_v1"]
+    with open(output_nbest_file) as f:
+        assert json.load(f) == {"q0": expected}
+    assert predictions == {"q0": "The quick"}
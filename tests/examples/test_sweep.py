@@ -0,0 +1,72 @@
+import os
+from argparse import Namespace
+
+import click
+
+from examples.utils.sweep import build_trial_argv, generate_trials, run_in_process_sweep
+
+
+def test_generate_trials():
+    spec = {"command": ["entity-typing", "run"], "grid": {"learning-rate": [1e-5, 2e-5], "seed": [10, 11]}}
+    trials = generate_trials(spec, "out")
+    assert [trial["name"] for trial in trials] == [
+        "learning_rate_1e-05_seed_10",
+        "learning_rate_1e-05_seed_11",
+        "learning_rate_2e-05_seed_10",
+        "learning_rate_2e-05_seed_11",
+    ]
+    assert trials[0]["output_dir"] == os.path.join("out", "learning_rate_1e-05_seed_10")
+
+    spec = {
+        "command": ["entity-typing", "run"],
+        "random": {"num-trials": 3, "params": {"seed": {"int-uniform": [0, 9]}}},
+    }
+    assert generate_trials(spec, "out") == generate_trials(spec, "out")
+    assert len(generate_trials(spec, "out")) == 3
+
+
+def test_build_trial_argv():
+    spec = {
+        "global_args": {"model-file": "model.tar.gz", "fp16": True},
+        "command": ["entity-typing", "run"],
+        "args": {"data-dir": "data", "dont-save-model": True, "do-eval": False, "learning-rate": 1e-5},
+    }
+    argv = build_trial_argv(spec, {"learning-rate": 2e-5}, "out/trial", use_gpu=False)
+    assert argv == [
+        "--model-file=model.tar.gz",
+        "--fp16",
+        "--output-dir=out/trial",
+        "--num-gpus=0",
+        "entity-typing",
+        "run",
+        "--data-dir=data",
+        "--dont-save-model",
+        "--learning-rate=2e-05",
+    ]
+
+
+def test_run_in_process_sweep(tmpdir):
+    @click.command()
+    @click.option("--learning-rate", default=1e-5)
+    @click.option("--seed", default=12)
+    def run(**kwargs):
+        pass
+
+    def trial_fn(args):
+        trial_args.append(args)
+        with open(os.path.join(args.output_dir, "results.json"), "w") as f:
+            f.write("{}")
+
+    trial_args = []
+    args = Namespace(
+        output_dir=str(tmpdir), learning_rate=1e-5, seed=12, sweep_params=["learning-rate=1e-5,2e-5", "seed=1"]
+    )
+    index = run_in_process_sweep(args, run, trial_fn)
+
+    assert [(a.learning_rate, a.seed) for a in trial_args] == [(1e-5, 1), (2e-5, 1)]
+    assert trial_args[1].output_dir == os.path.join(str(tmpdir), "learning_rate_2e-05_seed_1")
+    assert all(entry["status"] == "completed" for entry in index.values())
+
+    trial_args.clear()
+    run_in_process_sweep(args, run, trial_fn)
+    assert trial_args == []
@@ -1,7 +1,10 @@
 import json 
+import os
 import pandas as pd
 import numpy as np
 
+from luke.utils.multilabel_metrics import logit2prob
+
 ###
 # Helper script useful for inspecting the output. 
 # input (data_dir): test.json, test_prediction.jsonl, results.json
@@ -61,13 +64,6 @@ def format_data(df, top_label_prob_list):
     return dict_format
 
 
-def logit2prob(logits):
-    prob = np.array([])
-    for logit in logits: 
-        prob = np.append(prob, (np.exp(logit) / (np.exp(logit) + 1)))
-    return prob
-
-
 def count_entity_types(list_entity_labels):
     labels = {}
     labels["reject"] = 0
@@ -104,7 +100,11 @@ df = pd.concat([df_data_file, df_predict_file], axis=1)
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
 labels      = df_results["evaluation_predict_label"]["label_list"]
-logit_list  = df_results["evaluation_predict_label"][f"{set_}"]["predict_logits"]
+evaluation  = df_results["evaluation_predict_label"][f"{set_}"]
+if "predict_logits_file" in evaluation:
+    logit_list = np.load(os.path.join(os.path.dirname(result_file), evaluation["predict_logits_file"]))
+else:
+    logit_list = evaluation["predict_logits"]
 top_label_prob_list = top_labels_prob(logit_list, labels)
 
 dict_format_all = format_data(df, top_label_prob_list)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from luke_experiments.function_meta_analysis.embedding import stratified_subsample
+
+
+def test_stratified_subsample():
+    labels = np.array([0] * 80 + [1] * 19 + [2])
+    indices = stratified_subsample(len(labels), 10, labels=labels)
+    assert len(indices) == 10
+    assert np.all(np.diff(indices) > 0)
+    # the label with a single row is kept, and the other nine rows are divided among the other labels
+    assert np.bincount(labels[indices]).tolist() == [7, 2, 1]
+
+    one_hot = np.eye(3, dtype=np.int8)[labels]
+    np.testing.assert_array_equal(stratified_subsample(len(labels), 10, labels=one_hot), indices)
+
+    assert len(stratified_subsample(len(labels), 10)) == 10
+    np.testing.assert_array_equal(stratified_subsample(len(labels), 200, labels=labels), np.arange(100))
+
+
+def test_stratified_subsample_with_many_labels():
+    # there are more labels than samples, so not every label can be kept
+    indices = stratified_subsample(100, 5, labels=np.arange(100))
+    assert len(indices) == 5
+    assert len(np.unique(indices)) == 5
+    # the labels are not selected by their order when they have the same frequencies
+    assert indices.tolist() != list(range(5))
+
+    labels = np.repeat(np.arange(40), 3)
+    indices = stratified_subsample(len(labels), 20, labels=labels)
+    assert len(indices) == 20
+    assert np.bincount(labels[indices], minlength=40).max() == 1
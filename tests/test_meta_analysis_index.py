@@ -0,0 +1,50 @@
+import json
+import os
+
+import numpy as np
+
+from luke_experiments.function_meta_analysis.index import MetaAnalysisIndex, load_run_arrays
+
+
+def _write_results(run_dir, results):
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, "results.json"), "w") as f:
+        json.dump(results, f)
+
+
+def test_meta_analysis_index(tmpdir):
+    data_dir = str(tmpdir.join("outputs"))
+    log_parameters = dict(gradient_accumulation_steps=2, learning_rate=1e-5, output_dir="out")
+    evaluation = dict(predict_logits=[[0.5, -1.0]], true_labels=[[1, 0]])
+    _write_results(
+        os.path.join(data_dir, "robust_seed_10"),
+        {
+            "dev_f1_epoch_no_training": 0.1,
+            "dev_f1_epoch0": 0.5,
+            "dev_f1": 0.6,
+            "test_f1": 0.7,
+            "experimental_configurations": dict(log_parameters=log_parameters),
+            "evaluation_predict_label": dict(dev=evaluation, test=evaluation),
+            "training_loss": [1.0, 3.0, 2.0],
+        },
+    )
+
+    index = MetaAnalysisIndex.build(data_dir)
+    reloaded = MetaAnalysisIndex(os.path.join(data_dir, "meta_analysis_index.npz"))
+    for target in (index, reloaded):
+        (record,) = target.runs("seed")
+        assert record["run_name"] == "robust_seed_10"
+        assert record["curves"]["dev_f1_epoch"] == [0.1, 0.5]
+        assert record["curves"]["training_loss"] == [2.0, 2.0]
+        assert record["scalars"]["test_f1"] == 0.7
+        assert record["params"]["learning_rate"] == 1e-5 and record["params"]["output_dir"] == "out"
+        logits, labels = load_run_arrays(record, "dev")
+        np.testing.assert_array_equal(logits, [[0.5, -1.0]])
+        np.testing.assert_array_equal(labels, [[1, 0]])
+
+    assert reloaded.runs("learning_rate") == []
+    assert not reloaded.update(data_dir)
+
+    _write_results(os.path.join(data_dir, "robust_learning_rate_1e-05"), {"dev_f1": 0.4})
+    assert reloaded.update(data_dir)
+    assert [record["run_name"] for record in reloaded.runs()] == ["robust_learning_rate_1e-05", "robust_seed_10"]
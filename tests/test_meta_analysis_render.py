@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pytest
+
+from luke_experiments.function_meta_analysis.render import RenderJob, render_figures
+
+
+def plot_matrix(matrix_file, num_figures=1):
+    import matplotlib.pyplot as plt
+
+    matrix = np.load(matrix_file)
+    figures = []
+    for _ in range(num_figures):
+        figure = plt.figure()
+        plt.plot(matrix)
+        figures.append(figure)
+    return tuple(figures)
+
+
+def test_render_figures(tmpdir):
+    matrix_file = str(tmpdir.join("matrix.npy"))
+    np.save(matrix_file, np.arange(3))
+    output_file = str(tmpdir.join("plots", "matrix.png"))
+
+    def create_job():
+        return RenderJob(plot_matrix, (matrix_file,), [output_file])
+
+    assert render_figures([create_job()], str(tmpdir), num_workers=0) == 1
+    assert os.path.exists(output_file)
+    assert render_figures([create_job()], str(tmpdir), num_workers=0) == 0
+
+    # the figure is rendered again when the input file is rewritten
+    np.save(matrix_file, np.arange(4))
+    stat = os.stat(matrix_file)
+    os.utime(matrix_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert render_figures([create_job()], str(tmpdir), num_workers=0) == 1
+
+
+def test_render_figures_with_missing_output_files(tmpdir):
+    matrix_file = str(tmpdir.join("matrix.npy"))
+    np.save(matrix_file, np.arange(3))
+    job = RenderJob(plot_matrix, (matrix_file,), [str(tmpdir.join("a.png"))], kwargs=dict(num_figures=2))
+    with pytest.raises(ValueError):
+        render_figures([job], str(tmpdir), num_workers=0)
@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+
+from luke.utils.attention_statistics import AttentionStatistics
+
+
+class DummyEncoder(object):
+    def __init__(self, attention_probs):
+        self.attention_probs = attention_probs
+        self.attention_hook = None
+
+    def __call__(self):
+        for i, attention_probs in enumerate(self.attention_probs):
+            if self.attention_hook is not None:
+                self.attention_hook(i, attention_probs)
+
+
+def _bin_ranges(num_bins, num_tokens):
+    # the bins of output_bin_ranges in visual_attention/tests/visualization_attention_all_sentence_bins.py
+    bin_size = num_tokens // num_bins
+    ranges = [range(i * bin_size, (i + 1) * bin_size) for i in range(num_bins)]
+    ranges[-1] = range(ranges[-1][0], num_tokens)
+    return ranges + [range(num_tokens, num_tokens + 1)]
+
+
+def test_attention_statistics():
+    num_layers, num_heads, word_size, entity_size = 3, 2, 9, 2
+    num_tokens = [9, 7, 5]
+    attention_probs = torch.softmax(torch.randn(num_layers, 3, num_heads, word_size + entity_size, 11), dim=-1)
+    word_attention_mask = torch.tensor([[1] * n + [0] * (word_size - n) for n in num_tokens])
+    token_pairs = torch.tensor([[[1, 3], [-1, -1]], [[2, 10], [4, 0]], [[0, 0], [-1, 2]]])
+
+    statistics = AttentionStatistics(num_bins=3)
+    encoder = DummyEncoder(attention_probs)
+    with statistics.capture(encoder, word_attention_mask, token_pairs):
+        encoder()
+    assert encoder.attention_hook is None
+    results = statistics.results()
+
+    assert results["bin_means"].shape == (3, num_layers, num_heads, 4)
+    assert results["pair_attention"].shape == (3, 2, num_layers, num_heads)
+    assert results["num_tokens"].tolist() == num_tokens
+
+    for i, n in enumerate(num_tokens):
+        # the attention of the padded words is moved to the end of the sequence in the reference
+        probs = torch.cat(
+            [attention_probs[:, i, :, word_size, :n], attention_probs[:, i, :, word_size, word_size:]], -1
+        )
+        for j, bin_range in enumerate(_bin_ranges(3, n)):
+            expected = probs[:, :, bin_range[0] : bin_range[-1] + 1].mean(dim=-1).numpy()
+            np.testing.assert_allclose(results["bin_means"][i, :, :, j], expected, rtol=1e-5)
+
+    np.testing.assert_allclose(results["pair_attention"][1, 0], attention_probs[:, 1, :, 2, 10].numpy())
+    np.testing.assert_allclose(results["pair_attention"][1, 1], attention_probs[:, 1, :, 4, 0].numpy())
+    assert np.isnan(results["pair_attention"][0, 1]).all()
+    assert np.isnan(results["pair_attention"][2, 1]).all()
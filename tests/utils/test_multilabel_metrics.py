@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from sklearn.calibration import calibration_curve
+
+from luke.utils.multilabel_metrics import calibration_bins, one_hot_encoding, precision_recall_f1, split_multi_single
+
+
+def test_one_hot_encoding_with_reject_class():
+    one_hot = one_hot_encoding([[0.5, -1.0], [-0.5, -2.0]], add_reject=True)
+    np.testing.assert_array_equal(one_hot, [[1, 0, 0], [0, 0, 1]])
+
+
+def test_precision_recall_f1():
+    y_true = np.array([[1, 0, 1], [0, 1, 0]])
+    y_pred = np.array([[1, 1, 0], [0, 1, 0]])
+
+    assert precision_recall_f1(y_true, y_pred) == dict(precision=2 / 3, recall=2 / 3, f1=2 / 3)
+    macro = precision_recall_f1(y_true, y_pred, average="macro")
+    assert np.isclose(macro["precision"], 0.5)
+    assert np.isclose(macro["recall"], 2 / 3)
+    assert np.isclose(macro["f1"], 5 / 9)
+
+
+def test_split_multi_single():
+    y_true = np.array([[1, 0], [1, 1], [0, 1]])
+    y_pred = np.array([[1, 0], [1, 0], [1, 1]])
+    y_true_single, y_pred_single, y_true_multi, y_pred_multi = split_multi_single(y_true, y_pred)
+
+    np.testing.assert_array_equal(y_true_single, [[1, 0]])
+    np.testing.assert_array_equal(y_pred_single, [[1, 0]])
+    np.testing.assert_array_equal(y_true_multi, [[1, 1], [0, 1]])
+    np.testing.assert_array_equal(y_pred_multi, [[1, 0], [1, 1]])
+
+
+def test_calibration_bins():
+    fraction_of_positives, mean_predicted_value, counts = calibration_bins([0, 1, 1, 0], [0.1, 0.3, 0.8, 0.9], n_bins=2)
+    np.testing.assert_allclose(fraction_of_positives, [0.5, 0.5])
+    np.testing.assert_allclose(mean_predicted_value, [0.2, 0.85])
+    np.testing.assert_array_equal(counts, [2, 2])
+
+
+def test_calibration_bins_with_bin_edges():
+    # 0.2, 0.4, 0.6, and 0.8 are on the bin edges, and 0.5 is the probability of a zero logit
+    y_true = np.array([0, 1, 0, 1, 1, 0, 1, 0, 1])
+    y_prob = np.array([0.2, 0.4, 0.4, 0.6, 0.8, 0.0, 0.5, 1.0, 0.5])
+    for n_bins in (2, 4, 5, 10):
+        fraction_of_positives, mean_predicted_value, _ = calibration_bins(y_true, y_prob, n_bins=n_bins)
+        expected_fraction, expected_mean = calibration_curve(y_true, y_prob, n_bins=n_bins)
+        np.testing.assert_allclose(fraction_of_positives, expected_fraction)
+        np.testing.assert_allclose(mean_predicted_value, expected_mean)
+
+    fraction_of_positives, _, counts = calibration_bins(y_true[:6], y_prob[:6], n_bins=5)
+    np.testing.assert_allclose(fraction_of_positives, [0, 0.5, 1, 1])
+    np.testing.assert_array_equal(counts, [2, 2, 1, 1])
+
+
+def test_calibration_bins_with_invalid_probabilities():
+    with pytest.raises(ValueError):
+        calibration_bins([0, 1], [-0.5, 0.5])
+    with pytest.raises(ValueError):
+        calibration_bins([0, 1], [0.5, 1.5])
+    # the probabilities are scaled into [0, 1] with normalize
+    fraction_of_positives, _, _ = calibration_bins([0, 1], [-0.5, 1.5], n_bins=2, normalize=True)
+    np.testing.assert_allclose(fraction_of_positives, [0, 1])
@@ -0,0 +1,70 @@
+from argparse import Namespace
+
+import pytest
+import torch
+
+from luke.utils import precision
+from luke.utils.precision import BFloat16Backend, PrecisionBackend, create_precision_backend
+
+
+def _create_args(**kwargs):
+    args = dict(fp16=False, fp16_backend="auto", fp16_opt_level="O2", fp16_min_loss_scale=1, fp16_max_loss_scale=4)
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+def test_create_precision_backend():
+    device = torch.device("cpu")
+    assert type(create_precision_backend(_create_args(), device)) == PrecisionBackend
+    assert type(create_precision_backend(_create_args(bf16=True), device)) == BFloat16Backend
+
+    with pytest.raises(ValueError):
+        create_precision_backend(_create_args(fp16=True, bf16=True), device)
+    with pytest.raises(ValueError):
+        create_precision_backend(_create_args(fp16=True, fp16_backend="native"), device)
+
+
+def test_create_precision_backend_without_native_amp(monkeypatch):
+    monkeypatch.setattr(precision.torch, "__version__", "1.5.0")
+    monkeypatch.setattr(precision, "_is_apex_available", lambda: False)
+    device = torch.device("cpu")
+    assert type(create_precision_backend(_create_args(), device)) == PrecisionBackend
+
+    with pytest.raises(ValueError, match="torch>=1.10"):
+        create_precision_backend(_create_args(bf16=True), device)
+    with pytest.raises(ValueError, match="torch>=1.10"):
+        create_precision_backend(_create_args(fp16=True, fp16_backend="native"), torch.device("cuda"))
+    # the auto backend does not fall back to the native one, and fails to import apex
+    with pytest.raises(ImportError):
+        create_precision_backend(_create_args(fp16=True), torch.device("cuda"))
+
+
+def test_is_native_amp_available(monkeypatch):
+    for version, expected in (("1.5.0", False), ("1.9.1+cu111", False), ("1.10.0", True), ("2.1.0a0+git", True)):
+        monkeypatch.setattr(precision.torch, "__version__", version)
+        assert precision.is_native_amp_available() == expected
+
+
+def test_bf16_backend():
+    torch.manual_seed(0)
+    model = torch.nn.Linear(8, 1)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    backend = BFloat16Backend(torch.device("cpu"))
+    model, optimizer = backend.initialize(model, optimizer)
+    inputs, targets = torch.randn(16, 8), torch.randn(16, 1)
+
+    losses = []
+    for _ in range(5):
+        with backend.autocast():
+            outputs = model(inputs)
+        assert outputs.dtype == torch.bfloat16
+        loss = torch.nn.functional.mse_loss(outputs.float(), targets)
+        backend.backward(loss, optimizer)
+        backend.clip_grad_norm(model, optimizer, 1.0)
+        backend.step(optimizer)
+        optimizer.zero_grad()
+        losses.append(loss.item())
+
+    assert model.weight.dtype == torch.float32
+    assert losses[-1] < losses[0]
+    assert backend.state_dict() is None